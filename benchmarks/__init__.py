@@ -0,0 +1,4 @@
+#!/usr/bin/env python3
+
+# Benchmarks for the emulator core, run with 'python -m benchmarks' from
+# the top of the repository. See suite for what is measured.
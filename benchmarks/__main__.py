@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+
+import json
+from sys import exit, stdout, stderr
+from argparse import ArgumentParser, ArgumentTypeError
+from .suite import GROUPS, run_benchmarks, compare_results
+
+def pos_int(value):
+    ivalue = int(value)
+    if ivalue < 1:
+         raise ArgumentTypeError("%s is an invalid positive int value." % value)
+    return ivalue
+
+def fraction(value):
+    fvalue = float(value)
+    if not 0 <= fvalue < 1:
+         raise ArgumentTypeError("%s is an invalid fraction, use 0 to 1." % value)
+    return fvalue
+
+def parse_args():
+    parser = ArgumentParser(prog='python -m benchmarks', description=
+        '''
+        Measures the speed of the tortilla8 emulator core and compares
+        results against a stored baseline.
+        ''')
+    subparsers = parser.add_subparsers(dest='option', help=
+        'Options for the benchmarks...')
+
+    run_parser = subparsers.add_parser('run',help=
+        '''
+        Runs the benchmarks and writes the results as JSON.
+        ''')
+    compare_parser = subparsers.add_parser('compare',help=
+        '''
+        Compares results against a baseline, exits with status 1 if any
+        metric regressed past the threshold.
+        ''')
+
+    for sub in (run_parser, compare_parser):
+        sub.add_argument('-g','--groups',nargs='+',choices=GROUPS,default=list(GROUPS),help=
+            'Benchmark groups to run, all by default.')
+        sub.add_argument('-s','--scale',type=pos_int,default=1,help=
+            'Multiplies the work done per measurement.')
+        sub.add_argument('-r','--repeat',type=pos_int,default=5,help=
+            'Measurements taken per metric, the fastest is kept.')
+        sub.add_argument('-o','--output',help=
+            'File to write the results to.')
+
+    run_parser.set_defaults(output='-')
+    compare_parser.add_argument('baseline',help=
+        'Results file to compare against.')
+    compare_parser.add_argument('current',nargs='?',help=
+        'Results file to compare, the benchmarks are run if not given.')
+    compare_parser.add_argument('-t','--threshold',type=fraction,default=0.1,help=
+        'Largest slowdown allowed, as a fraction of the baseline. Default 0.1.')
+
+    opts = parser.parse_args()
+    if opts.option is None:
+        parser.print_help()
+        exit(1)
+    return opts
+
+def progress(group):
+    print("Running " + group + " benchmarks...", file=stderr)
+
+def write_results(results, file_path):
+    if file_path == '-':
+        json.dump(results, stdout, indent=2)
+        stdout.write('\n')
+    else:
+        with open(file_path, 'w') as fh:
+            json.dump(results, fh, indent=2)
+
+def print_comparison(rows, regressions, threshold):
+    for name, base, value, change in rows:
+        print(name.ljust(24) + str(round(base)).rjust(12) + str(round(value)).rjust(12) +
+              ('%+.1f%%' % (change * 100)).rjust(9) + ('  REGRESSED' if name in regressions else ''))
+    if regressions:
+        print(str(len(regressions)) + " of " + str(len(rows)) + " metrics regressed more than " +
+              str(threshold * 100) + "%")
+    else:
+        print("No metric regressed more than " + str(threshold * 100) + "%")
+
+def main(opts):
+    if opts.option == 'run':
+        results = run_benchmarks(opts.groups, opts.scale, opts.repeat, progress)
+        write_results(results, opts.output)
+        return 0
+
+    with open(opts.baseline) as fh:
+        baseline = json.load(fh)
+    if opts.current is None:
+        current = run_benchmarks(opts.groups, opts.scale, opts.repeat, progress)
+    else:
+        with open(opts.current) as fh:
+            current = json.load(fh)
+    if opts.output is not None:
+        write_results(current, opts.output)
+    for key in ('python', 'platform', 'cpu_count'):
+        if baseline.get('metadata', {}).get(key) != current.get('metadata', {}).get(key):
+            print("Warning: baseline was taken with a different " + key, file=stderr)
+    try:
+        rows, regressions = compare_results(baseline, current, opts.threshold)
+    except RuntimeError as err:
+        print(err, file=stderr)
+        return 2
+    print_comparison(rows, regressions, opts.threshold)
+    return 1 if regressions else 0
+
+if __name__ == '__main__':
+    exit( main(parse_args()) )
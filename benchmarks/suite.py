@@ -0,0 +1,262 @@
+#!/usr/bin/env python3
+
+import os
+import platform
+import subprocess
+from time import perf_counter, strftime, gmtime
+from tempfile import mkstemp
+from tortilla8 import salsa
+from tortilla8.salsa import Salsa, decode_opcode, decode_table, TBL_SIZE
+from tortilla8.guacamole import Guacamole
+from tortilla8.masa import Masa, WORKLOADS
+from tortilla8.constants.reg_rom_stack import PROGRAM_BEGIN_ADDRESS
+from tortilla8.constants.graphics import GFX_WIDTH_PX
+
+RESULTS_VERSION = 1
+
+# Instructions looped over for each opcode family. 0x300 is a ret for the
+# calls, I is pointed at 0x400 before anything touches RAM through it.
+FAMILIES = {
+    'ld':     (0x6A12, 0x8AB0, 0xA400, 0xFA07, 0xFA15, 0xFA18, 0xFA29),
+    'alu':    (0x7A01, 0x8AB1, 0x8AB2, 0x8AB3, 0x8AB4, 0x8AB5, 0x8AB6, 0x8AB7, 0x8ABE),
+    'skip':   (0x3A00, 0x4A00, 0x5AB0, 0x9AB0, 0xEA9E, 0xEAA1),
+    'call':   (0x2300,),
+    'memory': (0xA400, 0xFA33, 0xA400, 0xFF55, 0xA400, 0xFF65, 0xFA1E),
+    'rnd':    (0xCAFF,),
+    'drw':    (0xA400, 0xDAB5),
+    'cls':    (0x00E0,),
+}
+LOOP_LENGTH = 64
+SUBROUTINE  = 0x300
+
+DRW_HEIGHTS = (1, 5, 8, 15)
+REWIND_BUDGETS = (0, 4096, 65536, 1048576)
+REWIND_DEPTHS  = (1, 16, 256, 4096)
+
+GROUPS = ('tick', 'drw', 'rewind', 'reset', 'salsa', 'workloads')
+
+def program(opcodes):
+    '''
+    ROM bytes that loop over opcodes, with a ret at SUBROUTINE. The loop ends
+    in two jumps back so a skip on the last instruction stays in it.
+    '''
+    words = [ opcodes[i % len(opcodes)] for i in range(LOOP_LENGTH) ]
+    words += [ 0x1000 | PROGRAM_BEGIN_ADDRESS ] * 2
+    code = bytearray( b''.join( w.to_bytes(2, 'big') for w in words ) )
+    code += bytes(SUBROUTINE - PROGRAM_BEGIN_ADDRESS - len(code)) + b'\x00\xee'
+    return bytes(code)
+
+def load_program(emu, code):
+    emu.ram[PROGRAM_BEGIN_ADDRESS:PROGRAM_BEGIN_ADDRESS + len(code)] = code
+    emu.rom_image = bytes(emu.ram)
+
+def best_rate(run, count, repeat):
+    '''
+    Operations per second of the fastest of repeat calls to run(count),
+    which must perform count operations.
+    '''
+    best = None
+    for _ in range(repeat):
+        start = perf_counter()
+        run(count)
+        elapsed = perf_counter() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return count / max(best, 1e-9)
+
+def metric(value, unit):
+    return {'value':value, 'unit':unit}
+
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+# Benchmarks, each returns a dictionary of metric name to metric
+
+def bench_tick(scale, repeat):
+    '''
+    cpu_tick() rate per opcode family, with rewind off.
+    '''
+    results = {}
+    for name, opcodes in FAMILIES.items():
+        emu = Guacamole(init_ram=True, rewind_budget=0)
+        load_program(emu, program(opcodes))
+        tick = emu.cpu_tick
+        def run(count):
+            for _ in range(count):
+                tick()
+        results['tick.' + name] = metric( best_rate(run, 20000 * scale, repeat), 'instructions/s' )
+    return results
+
+def bench_drw(scale, repeat):
+    '''
+    i_drw rate across the pixel shifts within a byte and sprite heights.
+    '''
+    results = {}
+    emu = Guacamole(init_ram=True, rewind_budget=0)
+    emu.ram[0x400:0x410] = b'\xa5' * 16
+    emu.index_register = 0x400
+    for height in DRW_HEIGHTS:
+        ins = decode_opcode(0xD010 | height)
+        drw = emu.ins_tbl[ins.variant]
+        for shift in range(8):
+            emu.register[0] = shift + GFX_WIDTH_PX // 2
+            emu.register[1] = 3
+            def run(count):
+                for _ in range(count):
+                    drw(emu, ins)
+            results['drw.h' + str(height) + '.s' + str(shift)] = \
+                metric( best_rate(run, 5000 * scale, repeat), 'sprites/s' )
+    return results
+
+def bench_rewind(scale, repeat):
+    '''
+    Journaled cpu_tick() rate for several rewind budgets, and the rate
+    rewind() undoes instructions at for several depths.
+    '''
+    results = {}
+    code = program( sum(FAMILIES.values(), ()) )
+    for budget in REWIND_BUDGETS:
+        emu = Guacamole(init_ram=True, rewind_budget=budget)
+        load_program(emu, code)
+        tick = emu.cpu_tick
+        def run(count):
+            for _ in range(count):
+                tick()
+        results['rewind.record.b' + str(budget)] = \
+            metric( best_rate(run, 20000 * scale, repeat), 'instructions/s' )
+
+    emu = Guacamole(init_ram=True, rewind_budget=max(REWIND_BUDGETS))
+    load_program(emu, code)
+    count = 20000 * scale
+    for depth in REWIND_DEPTHS:
+        best = None
+        for _ in range(repeat):
+            emu.execute(count)
+            frames = len(emu.journal)
+            start = perf_counter()
+            for _ in range(frames // depth):
+                emu.rewind(depth)
+            rate = (frames - len(emu.journal)) / max(perf_counter() - start, 1e-9)
+            if best is None or rate > best:
+                best = rate
+        results['rewind.undo.d' + str(depth)] = metric(best, 'instructions/s')
+    return results
+
+def bench_reset(scale, repeat):
+    '''
+    reset() rate with a ROM to load, with and without a rewind journal.
+    '''
+    results = {}
+    handle, rom = mkstemp(suffix='.ch8')
+    try:
+        with os.fdopen(handle, 'wb') as fh:
+            fh.write( program(FAMILIES['ld']) )
+        for budget in (0, REWIND_BUDGETS[2]):
+            emu = Guacamole(rom=rom, rewind_budget=budget)
+            def run(count):
+                for _ in range(count):
+                    emu.reset(rom, rewind_budget=budget)
+            results['reset.b' + str(budget)] = metric( best_rate(run, 500 * scale, repeat), 'resets/s' )
+    finally:
+        os.remove(rom)
+    return results
+
+def bench_salsa(scale, repeat):
+    '''
+    Salsa() and decode_opcode() rates over every opcode, cold builds every
+    entry, warm is served from the caches.
+    '''
+    decode_table()
+    opcodes = [ (op >> 8, op & 0xFF) for op in range(TBL_SIZE) ]
+    def cold_salsa(count):
+        salsa._asm_cache[:] = [None] * TBL_SIZE
+        for byte_list in opcodes:
+            Salsa(byte_list)
+    def warm_salsa(count):
+        for byte_list in opcodes:
+            Salsa(byte_list)
+    def cold_decode(count):
+        salsa._ins_cache[:] = [None] * TBL_SIZE
+        for op in range(TBL_SIZE):
+            decode_opcode(op)
+    def warm_decode(count):
+        for op in range(TBL_SIZE):
+            decode_opcode(op)
+
+    results = {}
+    for name, run in (('salsa.cold', cold_salsa), ('salsa.warm', warm_salsa),
+                      ('decode.cold', cold_decode), ('decode.warm', warm_decode)):
+        results[name] = metric( best_rate(run, TBL_SIZE, repeat), 'opcodes/s' )
+    return results
+
+def bench_workloads(scale, repeat):
+    '''
+    execute() rate over the default Masa workloads, interpreted and compiled.
+    '''
+    results = {}
+    for name in WORKLOADS:
+        code = Masa(name).assemble()
+        for compiled in (False, True):
+            emu = Guacamole(init_ram=True, rewind_budget=0, compiled=compiled, seed=0)
+            load_program(emu, code)
+            results['workload.' + name + ('.compiled' if compiled else '.interpreted')] = \
+                metric( best_rate(emu.execute, 20000 * scale, repeat), 'instructions/s' )
+    return results
+
+BENCHMARKS = {'tick':bench_tick, 'drw':bench_drw, 'rewind':bench_rewind,
+              'reset':bench_reset, 'salsa':bench_salsa, 'workloads':bench_workloads}
+
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+# Results
+
+def machine_metadata():
+    '''
+    Describes where and when the results were taken.
+    '''
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=os.path.dirname(__file__),
+            stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, universal_newlines=True).stdout.strip()
+    except OSError:
+        commit = ''
+    return {
+        'date': strftime('%Y-%m-%dT%H:%M:%SZ', gmtime()),
+        'python': platform.python_implementation() + ' ' + platform.python_version(),
+        'platform': platform.platform(),
+        'machine': platform.machine(),
+        'processor': platform.processor(),
+        'cpu_count': os.cpu_count(),
+        'commit': commit or None,
+    }
+
+def run_benchmarks(groups=GROUPS, scale=1, repeat=5, progress=None):
+    '''
+    Runs the benchmark groups and returns the results as a dictionary ready
+    to be written as JSON. Scale multiplies the work done per measurement,
+    repeat is how many measurements are taken, the fastest is kept.
+    '''
+    metrics = {}
+    for group in groups:
+        if progress is not None:
+            progress(group)
+        metrics.update( BENCHMARKS[group](scale, repeat) )
+    return {'version':RESULTS_VERSION, 'metadata':machine_metadata(),
+            'settings':{'scale':scale, 'repeat':repeat}, 'metrics':metrics}
+
+def compare_results(baseline, current, threshold):
+    '''
+    Compares the metrics of two results, all rates where higher is better.
+    Returns a list of (name, baseline value, current value, change) for the
+    metrics in both and a list of the names that regressed by more than
+    threshold, a fraction of the baseline value.
+    '''
+    for results in (baseline, current):
+        if results.get('version') != RESULTS_VERSION:
+            raise RuntimeError("Benchmark results version " + str(results.get('version')) + " is not supported")
+    rows, regressions = [], []
+    for name, base in sorted(baseline['metrics'].items()):
+        if name not in current['metrics']:
+            continue
+        value = current['metrics'][name]['value']
+        change = value / base['value'] - 1 if base['value'] else 0.0
+        rows.append( (name, base['value'], value, change) )
+        if change < -threshold:
+            regressions.append(name)
+    return rows, regressions
@@ -16,6 +16,7 @@ setup(
 	#install_requires = [], #Curses and SimpleAudio are optional
     extras_require = {
         'Sound':  ['simpleaudio'],
+        'Batch':  ['numpy'],
     },
 	#scripts = [
 	#	    'scripts/t8-assemble',
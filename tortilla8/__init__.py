@@ -42,9 +42,19 @@ class EmulationError(Enum):
 
 # Skipping platter and instructions, they are not useful to programmers
 from .blackbean import *
+from .breakpoints import *
 from .cilantro import *
+from .comal import *
+from .counters import *
+from .errorlog import *
+from .framebuffer import *
 from .guacamole import *
 from .jalapeno import *
+from .masa import *
+from .movie import *
 from .salsa import *
+from .savestate import *
+from .taquitos import *
+from .tracer import *
 
 
@@ -4,14 +4,23 @@ import os
 import select
 import contextlib
 from time import sleep
-from sys import platform, argv
+from random import Random
+from sys import platform, argv, stdout, exit
 from argparse import ArgumentParser, ArgumentTypeError
 from .jalapeno import Jalapeno
 from .blackbean import Blackbean
 from .salsa import Salsa
-from .guacamole import Guacamole
+from .guacamole import Guacamole, DEFAULT_REWIND_BUDGET
 from .platter import Platter
 from .nacho import Nacho
+from .comal import Comal
+from .breakpoints import Breakpoints
+from .tracer import TraceRecorder, read_trace, render_trace, DEFAULT_TRACE_SIZE
+from .movie import load_movie
+from .masa import Masa, WORKLOADS, WAITING_WORKLOADS, fast_forward_check
+from .taquitos import parity_check
+from .constants.reg_rom_stack import BYTES_OF_RAM
+from .constants.quirks import QUIRK_PROFILES, PLATFORMS, DEFAULT_PLATFORM
 
 def pos_int(value):
     ivalue = int(value)
@@ -19,9 +28,34 @@ def pos_int(value):
          raise ArgumentTypeError("%s is an invalid positive int value." % value)
     return ivalue
 
+def non_neg_int(value):
+    ivalue = int(value)
+    if ivalue < 0:
+         raise ArgumentTypeError("%s is an invalid non-negative int value." % value)
+    return ivalue
+
+def address(value):
+    ivalue = int(value, 16)
+    if not 0 <= ivalue < BYTES_OF_RAM:
+         raise ArgumentTypeError("%s is an invalid address." % value)
+    return ivalue
+
+def parameter(value):
+    name, _, number = value.partition('=')
+    try:
+        return name, int(number, 0)
+    except ValueError:
+        raise ArgumentTypeError("%s is an invalid parameter, use NAME=INT." % value)
+
+def rom_profile(value):
+    rom, _, profile = value.rpartition('=')
+    if not rom or profile not in QUIRK_PROFILES:
+        raise ArgumentTypeError("%s is an invalid ROM quirk profile, use ROM=PROFILE." % value)
+    return rom, profile
+
 def dissassemble_file(in_handler, out_handler):
     byte_list = []
-    file_size = os.path.getsize(input_path)
+    file_size = os.fstat(in_handler.fileno()).st_size
     for _ in range(int(file_size/2)):
         byte_list[0:2] = [int.from_bytes(in_handler.read(1), 'big') for _ in range(2)]
         dis_inis = Salsa(byte_list)
@@ -83,6 +117,24 @@ def parse_args():
     dis_parser.add_argument('-o','--output',help=
         'File to write to.')
 
+    gen_parser = subparsers.add_parser('generate', help=
+        '''
+        Generate a synthetic stress test ROM, for benchmarking and comparing emulators.
+        Workloads are tight ALU loops, sprite storms, call recursion, memory traffic
+        through I, self-modifying code and delay timer waits. All of them loop forever.
+        ''')
+    gen_parser.add_argument('workload', choices=list(WORKLOADS), help=
+        'Kind of program to generate.')
+    gen_parser.add_argument('-p','--param', type=parameter, action='append', default=[], help=
+        'Workload parameter as NAME=INT, may be repeated. Parameters and defaults: ' +\
+        '; '.join( w + ' ' + ', '.join( n + '=' + str(v) for n,v in WORKLOADS[w][1].items() )
+                   for w in WORKLOADS ) + '.')
+    gen_parser.add_argument('-o','--output', help=
+        'Name of every generated file, will have either "asm" or "ch8" appended. By ' +\
+        'default the workload name is used.')
+    gen_parser.add_argument('-s','--source', action='store_true', help=
+        'Also store the generated assembly to OUTPUT.asm file.')
+
     ex_parser = subparsers.add_parser('execute', help=
         '''
         Execute a rom to quickly check for errors. The program counter, hex instruction (the two
@@ -101,8 +153,93 @@ def parse_args():
         'Initialize RAM to all zero values.', action='store_true')
     ex_parser.add_argument('-ls','--legacy_shift', help=
         'Use the legacy shift method of bit shift Y and storing to X.', action='store_true')
+    ex_parser.add_argument('-p','--platform', choices=PLATFORMS, default=DEFAULT_PLATFORM, help=
+        'Platform the ROM was written for. Options: ' + ', '.join(PLATFORMS) + \
+        '. ' + DEFAULT_PLATFORM + ' by default.')
+    ex_parser.add_argument('-q','--quirks', choices=QUIRK_PROFILES, help=
+        'Quirk profile the ROM was written for. Options: ' + ', '.join(QUIRK_PROFILES) + \
+        '. The profile of the platform by default.')
     ex_parser.add_argument("-e","--enforce_instructions", default='None', help=
         'Warning to log if an unoffical instruction is executed. Options: None Info Warning Fatal')
+    ex_parser.add_argument("-c","--cycles", type=pos_int, help=
+        'Run headless for this many CPU cycles as fast as possible, timers are ' +\
+        'driven by the cycle count rather than the wall clock.')
+    ex_parser.add_argument('-j','--compiled', action='store_true', help=
+        'Execute with the basic-block compiler rather than the interpreter.')
+    ex_parser.add_argument('-sd','--seed', type=int, help=
+        'Seed for the random number generator, by default every run differs.')
+    ex_parser.add_argument('-m','--movie', help=
+        'Replay a movie recorded by emulate headless, from the state it starts at to its end.')
+    ex_parser.add_argument('-t','--trace', help=
+        'Record every executed instruction to this binary trace file, see the trace command.')
+    ex_parser.add_argument('-ts','--trace_size', type=pos_int, default=DEFAULT_TRACE_SIZE, help=
+        'Most bytes the trace file may use, the oldest instructions are overwritten once ' +\
+        'it is full. By default ' + str(DEFAULT_TRACE_SIZE) + ' bytes are used.')
+    ex_parser.add_argument('-tr','--trace_registers', action='store_true', help=
+        'Also record the registers each instruction changed.')
+
+    trace_parser = subparsers.add_parser('trace', help=
+        '''
+        Print a trace file recorded by execute as text, one instruction per line.
+        ''')
+    trace_parser.add_argument('input', help=
+        'Trace file to print.')
+    trace_parser.add_argument('-o','--output', help=
+        'File to write to, by default the trace is printed to the screen.')
+
+    farm_parser = subparsers.add_parser('farm', help=
+        '''
+        Run a corpus of ROMs headless across a pool of processes. One line of JSON is
+        written per ROM with its status, cycles run, cycles skipped over busy waits,
+        instructions per second executed, a hash of the final screen, and any fatal errors.
+        ''')
+    farm_parser.add_argument('roms', nargs='+', help=
+        'ROMs to run, directories are searched for .ch8 files.')
+    budget = farm_parser.add_mutually_exclusive_group(required=True)
+    budget.add_argument("-c","--cycles", type=pos_int, help=
+        'Number of CPU cycles to run each ROM for.')
+    budget.add_argument("-fr","--frames", type=pos_int, help=
+        'Number of 60Hz delay timer frames to run each ROM for.')
+    farm_parser.add_argument("-t","--timeout", type=float, default=60, help=
+        'Most wall clock seconds to spend on one ROM. 60 by default.')
+    farm_parser.add_argument("-w","--workers", type=pos_int, help=
+        'Number of worker processes. By default one per CPU.')
+    farm_parser.add_argument("-f","--frequency", type=pos_int, default=200, help=
+        'CPU frequency, sets how many cycles make a timer frame. 200Hz by default.')
+    farm_parser.add_argument('-ls','--legacy_shift', action='store_true', help=
+        'Use the legacy shift method of bit shift Y and storing to X.')
+    farm_parser.add_argument('-p','--platform', choices=PLATFORMS, default=DEFAULT_PLATFORM, help=
+        'Platform the ROMs were written for. Options: ' + ', '.join(PLATFORMS) + \
+        '. ' + DEFAULT_PLATFORM + ' by default.')
+    farm_parser.add_argument('-q','--quirks', choices=QUIRK_PROFILES, help=
+        'Quirk profile of the ROMs without one in --rom_quirks. Options: ' + ', '.join(QUIRK_PROFILES) + \
+        '. The profile of the platform by default.')
+    farm_parser.add_argument('-rq','--rom_quirks', type=rom_profile, nargs='+', default=[], help=
+        'Quirk profiles for single ROMs as ROM=PROFILE, ROM is the file name without directories.')
+    farm_parser.add_argument('-j','--compiled', action='store_true', help=
+        'Execute with the basic-block compiler rather than the interpreter.')
+    farm_parser.add_argument('-sd','--seed', type=int, help=
+        'Seed for the random number generator of every ROM, by default every run differs.')
+    farm_parser.add_argument('-o','--output', help=
+        'JSON lines file to write results to, by default they are printed.')
+
+    check_parser = subparsers.add_parser('check', help=
+        '''
+        Run the emulator's self checks, exits with status 1 if any fails. Every Masa
+        workload is run with busy waits skipped and with every cycle executed, the two
+        must end in the same state and the workloads that wait must have cycles skipped.
+        Every opcode is run on Taquitos and on Guacamole under each quirk profile, and
+        with legacy shift, the results and error logs must match. Needs NumPy.
+        ''')
+    check_parser.add_argument("-c","--cycles", type=pos_int, default=20000, help=
+        'Number of CPU cycles to run each workload for. 20000 by default.')
+    check_parser.add_argument("-f","--frequency", type=pos_int, default=200, help=
+        'CPU frequency, sets how many cycles make a timer frame. 200Hz by default.')
+    check_parser.add_argument("-s","--sample", type=pos_int, help=
+        'Number of random opcodes to check the parity of per quirk profile, every ' +\
+        'opcode by default which takes a few minutes per profile.')
+    check_parser.add_argument('-np','--no_parity', action='store_true', help=
+        'Skip the Taquitos parity check.')
 
     emu_parser = subparsers.add_parser('emulate', help=
         '''
@@ -131,12 +268,32 @@ def parse_args():
     emu_parser.add_argument('-ls','--legacy_shift', action='store_true', help=
         'Use the legacy shift method of bit shift Y and storing to X. ' +\
         'By default the newer method is used where Y is ignored and X is bitshifted then stored to itself.')
+    emu_parser.add_argument('-p','--platform', choices=PLATFORMS, default=DEFAULT_PLATFORM, help=
+        'Platform the ROM was written for, schip and xochip add the Super Chip-8 and XO-Chip ' +\
+        'instructions and screen. Rewind is disabled on them. Options: ' + \
+        ', '.join(PLATFORMS) + '. ' + DEFAULT_PLATFORM + ' by default.')
+    emu_parser.add_argument('-q','--quirks', choices=QUIRK_PROFILES, help=
+        'Quirk profile the ROM was written for, selects how shifts, loads and stores through I, ' +\
+        'jp v0, the logic instructions and sprites at the screen edge behave. Options: ' + \
+        ', '.join(QUIRK_PROFILES) + '. The profile of the platform by default.')
     emu_parser.add_argument("-e","--enforce_instructions", default='None', help=
         'Warning to log if an unoffical instruction is executed. ' +\
         'By default, no errors are logged. Options: None Info Warning Fatal')
-    emu_parser.add_argument("-r","--rewind_depth", type=pos_int, default=1000, help=
-        'Number of instructions back to be recorded to enable rewinding. ' +\
-        'To disable set to zero or "off". By default 1000 instructions are recorded.')
+    emu_parser.add_argument("-r","--rewind_budget", type=non_neg_int, default=DEFAULT_REWIND_BUDGET, help=
+        'Bytes of memory used to record instructions for rewinding, most instructions ' +\
+        'take 15 to 30 bytes. To disable set to zero. By default ' + str(DEFAULT_REWIND_BUDGET) + ' bytes are used.')
+    emu_parser.add_argument("-b","--breakpoint", type=address, nargs='+', default=[], help=
+        'Hex addresses to stop at before the instruction there is executed.')
+    emu_parser.add_argument("-w","--watch", type=address, nargs='+', default=[], help=
+        'Hex RAM addresses to stop at after an instruction writes to them.')
+    emu_parser.add_argument("-bc","--break_condition", nargs='+', default=[], help=
+        'Expressions to stop at when they become true, i.e. "v3 == 0x10 and i > 0x300". ' +\
+        'Registers v0-vf, i, pc, sp, dt, st, ram[address] and cycles can be used.')
+    emu_parser.add_argument("-sd","--seed", type=int, help=
+        'Seed for the random number generator, by default every run differs.')
+    emu_parser.add_argument("-rm","--record_movie", help=
+        'Record the keypad and frequency changes to this movie file, it is written on exit. ' +\
+        'Replay it with execute --movie. Rewind is disabled while recording.')
     emu_parser.add_argument("-u","--unicode", nargs='*', help=
         'Forces unicode on or off for the menu and game screen. ' +\
         'Valid values are: On, Off, Menu-On, Menu-Off, Game-On, Game-Off. ' +\
@@ -199,21 +356,113 @@ def main():
             with open(opts.output, 'w+') as fo:
                 dissassemble_file(fi, fo)
 
+    if opts.option == 'generate':
+        if not opts.output:
+            opts.output = opts.workload
+
+        masa = Masa(opts.workload, **dict(opts.param))
+
+        if opts.source:
+            with open(opts.output + '.asm', 'w') as fh:
+                masa.export_source(fh)
+
+        with open(opts.output + '.ch8', 'wb') as fh:
+            masa.export_binary(fh)
+
     if opts.option == 'execute':
         if not os.path.isfile(opts.rom):
             raise OSError("File '" + opts.rom + "' does not exist.")
 
         guac = Guacamole(opts.rom, opts.frequency, opts.soundtimer, opts.delaytimer,
-                         opts.initram, opts.legacy_shift, opts.enforce_instructions)
+                         opts.initram, opts.legacy_shift, opts.enforce_instructions,
+                         0 if opts.cycles or opts.movie else DEFAULT_REWIND_BUDGET, opts.compiled, opts.seed,
+                         opts.quirks, opts.platform)
         guac.log_to_screen = True
-        sleep_time = (1/opts.frequency)*.98
+
+        tracer = None
+        if opts.trace:
+            tracer = TraceRecorder(opts.trace, opts.trace_size, opts.trace_registers)
+            guac.set_tracer(tracer)
+
         try:
-            while True:
-                guac.run()
-                sleep(sleep_time)
+            if opts.movie:
+                movie = load_movie(opts.movie)
+                guac.play_movie(movie)
+                opts.cycles = movie.end - guac.cycles
+
+            if opts.cycles is not None:
+                guac.run_cycles(opts.cycles)
+                for err in guac.error_log:
+                    print( str(err[0]) + ": " + err[1] )
+                print("Ran " + str(guac.cycles) + " cycles, PC at " + hex(guac.program_counter))
+                return
+
+            sleep_time = (1/opts.frequency)*.98
+            try:
+                while True:
+                    guac.run()
+                    sleep(sleep_time)
+
+            except KeyboardInterrupt:
+                pass
+        finally:
+            if tracer is not None:
+                tracer.close()
+
+    if opts.option == 'trace':
+        if not os.path.isfile(opts.input):
+            raise OSError("File '" + opts.input + "' does not exist.")
 
-        except KeyboardInterrupt:
-            pass
+        if opts.output:
+            with open(opts.output, 'w') as fh:
+                for line in render_trace(read_trace(opts.input)):
+                    fh.write(line + '\n')
+        else:
+            for line in render_trace(read_trace(opts.input)):
+                stdout.write(line + '\n')
+
+    if opts.option == 'farm':
+        farm = Comal(opts.roms, opts.cycles, opts.frames, opts.timeout, opts.workers,
+                     opts.frequency, opts.legacy_shift, opts.compiled, opts.seed,
+                     opts.quirks, dict(opts.rom_quirks), opts.platform)
+        if opts.output:
+            with open(opts.output, 'w') as fh:
+                farm.run(fh)
+        else:
+            farm.run(stdout)
+
+    if opts.option == 'check':
+        failed = 0
+        for name in WORKLOADS:
+            differs, skipped = fast_forward_check(name, opts.cycles, opts.frequency)
+            if differs is not None:
+                status = 'FAILED, states differ by cycle ' + str(differs)
+            elif skipped == 0 and name in WAITING_WORKLOADS:
+                status = 'FAILED, no cycles skipped'
+            else:
+                status = 'ok'
+            failed += status != 'ok'
+            print('fast-forward ' + name.ljust(8) + ' ' + str(skipped).rjust(8) + ' of ' + \
+                  str(opts.cycles) + ' cycles skipped  ' + status)
+
+        opcodes = range(0x10000) if opts.sample is None else \
+                  Random(0).sample(range(0x10000), min(opts.sample, 0x10000))
+        profiles = [ (name, name, False) for name in QUIRK_PROFILES ] + \
+                   [ (PLATFORMS[DEFAULT_PLATFORM] + ' legacy', PLATFORMS[DEFAULT_PLATFORM], True) ]
+        for name, quirks, legacy_shift in ([] if opts.no_parity else profiles):
+            try:
+                mismatches = parity_check(opcodes, legacy_shift, quirks=quirks)
+            except ImportError as e:
+                print('parity       ' + name.ljust(16) + ' FAILED, ' + str(e))
+                failed += 1
+                continue
+            status = 'ok' if not mismatches else \
+                     'FAILED, ' + ' '.join( hex(op)[2:].zfill(4) for op in mismatches[:8] ) + \
+                     (' ...' if len(mismatches) > 8 else '')
+            failed += status != 'ok'
+            print('parity       ' + name.ljust(16) + ' ' + str(len(mismatches)).rjust(6) + ' of ' + \
+                  str(len(opcodes)) + ' opcodes differ  ' + status)
+        exit(1 if failed else 0)
 
     if opts.option == 'emulate':
         if not os.path.isfile(opts.rom):
@@ -240,10 +489,21 @@ def main():
                 else:
                     raise IOError("Unknown value following the '--unicode' flag.")
 
+        breakpoints = None
+        if opts.breakpoint or opts.watch or opts.break_condition:
+            breakpoints = Breakpoints()
+            for addr in opts.breakpoint:
+                breakpoints.add_breakpoint(addr)
+            for addr in opts.watch:
+                breakpoints.add_watchpoint(addr)
+            for condition in opts.break_condition:
+                breakpoints.add_condition(condition)
+
         disp = Platter( opts.rom, opts.frequency, opts.soundtimer, opts.delaytimer,
                         opts.initram, opts.legacy_shift, opts.enforce_instructions,
-                        opts.rewind_depth, opts.drawfix, screen_unicode, menu_unicode,
-                        opts.audio )
+                        opts.rewind_budget, opts.drawfix, screen_unicode, menu_unicode,
+                        opts.audio, breakpoints, opts.seed, opts.record_movie, opts.quirks,
+                        opts.platform )
         disp.start(opts.step)
 
 if __name__ == "__main__":
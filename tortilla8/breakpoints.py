@@ -0,0 +1,176 @@
+#!/usr/bin/env python3
+
+from . import export
+from io import StringIO
+from tokenize import generate_tokens, NAME, NEWLINE, ENDMARKER, TokenError
+from .constants.opcodes import OP_VARIANTS, VARIANT_IDS
+from .constants.reg_rom_stack import BYTES_OF_RAM, AUDIO_PATTERN_SIZE
+from .journal import WRITE_SETS
+__all__ = []
+
+# Names usable in conditions and the code they are compiled to
+REGISTER_NAMES = {
+    'i':'emu.index_register', 'pc':'emu.program_counter', 'sp':'emu.stack_pointer',
+    'dt':'emu.delay_timer_register', 'st':'emu.sound_timer_register' }
+REGISTER_NAMES.update( { 'v' + hex(r)[2:]:'reg[' + hex(r) + ']' for r in range(16) } )
+CONDITION_NAMES = dict(REGISTER_NAMES)
+CONDITION_NAMES.update( {'ram':'ram', 'cycles':'emu.cycles', 'and':'and', 'or':'or',
+                         'not':'not', 'true':'True', 'false':'False'} )
+
+@export
+class Breakpoints:
+    '''
+    Execution breakpoints, RAM watchpoints, register watches and conditions
+    checked by a Guacamole, see Guacamole.set_breakpoints(). Addresses are
+    flagged in maps indexed by RAM address and conditions are compiled once.
+    Execution breakpoints stop a run before the instruction, everything
+    else after it. Hit holds (kind, address or source) of the last stop.
+    '''
+    def __init__(self):
+        self.exec_map  = bytearray(BYTES_OF_RAM)
+        self.read_map  = bytearray(BYTES_OF_RAM)
+        self.write_map = bytearray(BYTES_OF_RAM)
+        self.exec_conditions = {}
+        self.registers  = {} # name: getter
+        self.conditions = [] # [source, condition, value]
+        self.watch_ram  = False
+        self.hit  = None
+        self.skip = None # Address resumed from, not broken on again
+
+    def add_breakpoint(self, address, condition=None):
+        '''
+        Stops before the instruction at address runs, optionally only when
+        the condition expression is true.
+        '''
+        self.exec_map[address] = 1
+        if condition is None:
+            self.exec_conditions.pop(address, None)
+        else:
+            self.exec_conditions[address] = compile_condition(condition)
+
+    def remove_breakpoint(self, address):
+        self.exec_map[address] = 0
+        self.exec_conditions.pop(address, None)
+
+    def add_watchpoint(self, address, length=1, read=False, write=True):
+        '''
+        Stops after an instruction reads or writes any of length bytes
+        starting at address. Instruction fetches are not reads.
+        '''
+        if read:
+            self.read_map[address:address + length] = b'\x01' * length
+        if write:
+            self.write_map[address:address + length] = b'\x01' * length
+        self.update()
+
+    def remove_watchpoint(self, address, length=1):
+        self.read_map[address:address + length] = bytes(length)
+        self.write_map[address:address + length] = bytes(length)
+        self.update()
+
+    def watch_register(self, name):
+        '''
+        Stops after an instruction changes a register, one of v0-vf, i, pc,
+        sp, dt or st.
+        '''
+        name = name.lower()
+        if name not in REGISTER_NAMES:
+            raise RuntimeError("Unknown register '" + name + "'")
+        self.registers[name] = compile_condition(name, truth=False)
+
+    def add_condition(self, source):
+        '''
+        Stops after an instruction makes the condition expression true. It
+        must become false again before it stops another run.
+        '''
+        self.conditions.append( [source, compile_condition(source), False] )
+
+    def clear(self):
+        self.__init__()
+
+    def update(self):
+        self.watch_ram = self.read_map.find(1) != -1 or self.write_map.find(1) != -1
+
+    def exec_only(self):
+        '''
+        True if only execution breakpoints are set, which compiled blocks
+        can be checked against before they run.
+        '''
+        return not self.watch_ram and not self.registers and not self.conditions
+
+    def allows_skip(self, address):
+        '''
+        True if a busy wait at address can be fast forwarded, see
+        Guacamole.skip_idle(), without passing over a breakpoint.
+        '''
+        return self.exec_only() and self.exec_map.find(1, address, address + 6) == -1
+
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+# Helpers
+
+def compile_condition(source, truth=True):
+    '''
+    Compiles a condition expression into a function of (emu, reg, ram).
+    Expressions use Python operators and numbers, the names in
+    CONDITION_NAMES and ram[address], i.e. "v3 == 0x10 and ram[i] > 2".
+    '''
+    try:
+        tokens = list( generate_tokens(StringIO(source).readline) )
+    except TokenError:
+        raise RuntimeError("Incomplete condition '" + source + "'")
+    code = []
+    for tok in tokens:
+        if tok.type in (NEWLINE, ENDMARKER):
+            continue
+        if tok.type == NAME:
+            if tok.string.lower() not in CONDITION_NAMES:
+                raise RuntimeError("Unknown name '" + tok.string + "' in condition '" + source + "'")
+            code.append( CONDITION_NAMES[tok.string.lower()] )
+        else:
+            code.append(tok.string)
+
+    namespace = {}
+    body = 'bool(' + ' '.join(code) + ')' if truth else ' '.join(code)
+    try:
+        exec('def condition(emu, reg, ram):\n    return ' + body, namespace)
+    except SyntaxError:
+        raise RuntimeError("Invalid condition '" + source + "'")
+    return namespace['condition']
+
+def ram_sprite(emu, ins):
+    return range(emu.index_register, min(emu.index_register + ins.n, BYTES_OF_RAM))
+
+def ram_to_x(emu, ins):
+    return range(emu.index_register, min(emu.index_register + ins.x + 1, BYTES_OF_RAM))
+
+def ram_large_sprite(emu, ins):
+    return range(emu.index_register, min(emu.index_register + 32, BYTES_OF_RAM))
+
+def ram_x_to_y(emu, ins):
+    return range(emu.index_register, min(emu.index_register + abs(ins.y - ins.x) + 1, BYTES_OF_RAM))
+
+def ram_audio(emu, ins):
+    return range(emu.index_register, min(emu.index_register + AUDIO_PATTERN_SIZE, BYTES_OF_RAM))
+
+# Read set functions indexed by Instruction.variant, the RAM each reads
+READ_SETS = [None] * (len(OP_VARIANTS) + 1)
+READ_SETS[VARIANT_IDS['Dxyz']] = ram_sprite
+READ_SETS[VARIANT_IDS['Fx65']] = ram_to_x
+READ_SETS[VARIANT_IDS['Dxy0']] = ram_large_sprite
+READ_SETS[VARIANT_IDS['5xy3']] = ram_x_to_y
+READ_SETS[VARIANT_IDS['F002']] = ram_audio
+
+def accessed(emu, ins, access_map, sets):
+    '''
+    First address flagged in access_map that ins would touch, or None.
+    '''
+    access_set = sets[ins.variant]
+    if access_set is None:
+        return None
+    addresses = access_set(emu, ins)
+    if sets is WRITE_SETS:
+        addresses = addresses[1]
+    for address in addresses:
+        if access_map[address]:
+            return address
+    return None
@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+
+from . import export
+from . import EmulationError
+from os import cpu_count, walk
+from os.path import isdir, join, basename
+from json import dumps
+from time import perf_counter
+from hashlib import sha1
+from multiprocessing import Pool
+from .guacamole import Guacamole
+from .constants.quirks import DEFAULT_PLATFORM
+__all__ = []
+
+# How often, in CPU cycles, a worker checks its timeout and error count
+CHECK_CYCLES = 10000
+
+# A ROM stops once it has logged this many fatal errors
+MAX_FATAL_ERRORS = 20
+
+@export
+class Comal:
+    '''
+    Comal runs a corpus of ROMs headless, spread over a pool of processes,
+    and reports one JSON object per ROM. Each ROM runs for a budget of CPU
+    cycles or delay timer frames on the virtual clock, or until it times
+    out or logs too many fatal errors. Cycles skipped over busy waits are
+    reported as idle_cycles and left out of the instructions per second.
+    '''
+    def __init__(self, roms, cycles=None, frames=None, timeout=None, workers=None,
+                 cpuhz=200, legacy_shift=False, compiled=False, seed=None,
+                 quirks=None, rom_quirks=None, platform=DEFAULT_PLATFORM):
+        '''
+        Roms is a list of ROM files and directories, directories are searched
+        for .ch8 files. Give either cycles or frames as the budget, timeout is
+        the most wall clock seconds any one ROM may take. Workers defaults to
+        the number of CPUs. Seed makes rnd repeatable, every ROM uses it.
+        Quirks is the quirk profile, as for Guacamole, of the ROMs whose file
+        name is not in the rom_quirks dictionary of file name to profile.
+        Platform, one of PLATFORMS, is used for every ROM.
+        '''
+        self.roms = find_roms(roms)
+        self.workers = workers or cpu_count() or 1
+        self.settings = {'cycles':cycles, 'frames':frames, 'timeout':timeout,
+                         'cpuhz':cpuhz, 'legacy_shift':legacy_shift, 'compiled':compiled,
+                         'seed':seed, 'platform':platform}
+        self.rom_quirks = rom_quirks or {}
+        self.quirks = quirks
+        if (cycles is None) == (frames is None):
+            raise RuntimeError("Give a budget of either cycles or frames.")
+
+    def run(self, out_handler):
+        '''
+        Runs every ROM and writes each result to out_handler as a line of
+        JSON as soon as it is done. Returns the number of ROMs run.
+        '''
+        jobs = [ dict(self.settings, rom=rom, quirks=self.rom_quirks.get(basename(rom), self.quirks))
+                 for rom in self.roms ]
+        with Pool(min(self.workers, len(jobs) or 1)) as pool:
+            for result in pool.imap_unordered(bake, jobs):
+                out_handler.write(dumps(result) + '\n')
+                out_handler.flush()
+        return len(jobs)
+
+def bake(job):
+    '''
+    Runs a single ROM, the worker side of Comal.run().
+    '''
+    result = {'rom':job['rom'], 'status':'ok', 'cycles':0, 'idle_cycles':0, 'seconds':0.0, 'ips':0,
+              'gfx_sha1':None, 'fatal_count':0, 'fatal_errors':[]}
+    try:
+        emu = Guacamole(job['rom'], job['cpuhz'], init_ram=True, legacy_shift=job['legacy_shift'],
+                        rewind_budget=0, compiled=job['compiled'], seed=job['seed'], quirks=job['quirks'],
+                        platform=job['platform'])
+    except Exception as e:
+        result['status'] = 'error'
+        result['fatal_errors'].append( type(e).__name__ + ": " + str(e) )
+        return result
+    emu.error_log.level = EmulationError._Fatal
+
+    start = perf_counter()
+    deadline = None if job['timeout'] is None else start + job['timeout']
+
+    def check(emu):
+        collect_fatal(emu, result)
+        if result['fatal_count'] >= MAX_FATAL_ERRORS:
+            result['status'] = 'fatal'
+            emu.stop()
+        elif deadline is not None and perf_counter() > deadline:
+            result['status'] = 'timeout'
+            emu.stop()
+        else:
+            emu.schedule(emu.cycles + CHECK_CYCLES, check)
+
+    emu.schedule(CHECK_CYCLES, check)
+    try:
+        if job['cycles'] is not None:
+            emu.run_cycles(job['cycles'])
+        else:
+            emu.run_frames(job['frames'])
+    except Exception as e:
+        result['status'] = 'error'
+        result['fatal_errors'].append( type(e).__name__ + ": " + str(e) )
+    collect_fatal(emu, result)
+
+    seconds = perf_counter() - start
+    result['cycles']      = emu.cycles
+    result['idle_cycles'] = emu.idle_cycles
+    result['seconds']     = round(seconds, 6)
+    result['ips']         = int((emu.cycles - emu.idle_cycles) / seconds) if seconds else 0
+    width, _ = emu.screen_size()
+    result['gfx_sha1'] = sha1( b''.join( row.to_bytes(width // 8, 'big') for row in emu.screen_rows() ) ).hexdigest()
+    return result
+
+def collect_fatal(emu, result):
+    '''
+    Moves the fatal errors out of the emulator's log into the result.
+    '''
+    fatal = [ m for e,m in emu.error_log if e is EmulationError._Fatal ]
+    result['fatal_count'] += len(fatal) + emu.error_log.dropped
+    result['fatal_errors'] += fatal[:max(0, MAX_FATAL_ERRORS - len(result['fatal_errors']))]
+    emu.error_log.clear()
+
+def find_roms(paths):
+    '''
+    Expands directories in paths to the .ch8 files they contain.
+    '''
+    roms = []
+    for path in paths:
+        if not isdir(path):
+            roms.append(path)
+            continue
+        for root, dirs, files in walk(path):
+            dirs.sort()
+            roms += [ join(root, f) for f in sorted(files) if f.lower().endswith('.ch8') ]
+    return roms
@@ -0,0 +1,286 @@
+#!/usr/bin/env python3
+
+from .salsa import decode_opcode
+from .errorlog import LOG_UNOFFICIAL
+from .instructions import LONG_SKIPS
+from .constants.opcodes import VARIANT_IDS
+from .constants.quirks import Quirks
+from .constants.reg_rom_stack import BYTES_OF_RAM
+from .constants.graphics import GFX_FONT_ADDRESS
+
+# Basic-block compiler used by Guacamole's compiled engine. Straight-line
+# runs of instructions, up to and including the branch that ends them, are
+# translated to Python source with their operands inlined, compiled once and
+# cached by start address.
+
+MAX_BLOCK_LENGTH = 32
+
+# Start addresses whose block was dropped this many times are not compiled
+# again, code that keeps being rewritten is left to the interpreter.
+MAX_RECOMPILES = 4
+
+# Templates for instructions that are inlined. Operands are substituted
+# from the Instruction.
+INLINE = {
+    '6xyy': ('reg[{x}] = {kk}',),
+    '8xy0': ('reg[{x}] = reg[{y}]',),
+    '7xyy': ('reg[{x}] = (reg[{x}] + {kk}) & 0xFF',),
+    '8xy4': ('t = reg[{x}] + reg[{y}]',
+             'reg[{x}] = t & 0xFF',
+             'reg[0xF] = 1 if t > 0xFF else 0'),
+    '8xy1': ('reg[{x}] |= reg[{y}]',),
+    '8xy2': ('reg[{x}] &= reg[{y}]',),
+    '8xy3': ('reg[{x}] ^= reg[{y}]',),
+    '8xy5': ('reg[0xF] = 1 if reg[{x}] >= reg[{y}] else 0',
+             'reg[{x}] = (reg[{x}] - reg[{y}]) & 0xFF'),
+    '8xy7': ('reg[0xF] = 1 if reg[{y}] >= reg[{x}] else 0',
+             'reg[{x}] = (reg[{y}] - reg[{x}]) & 0xFF'),
+    '8x06': ('reg[0xF] = reg[{x}] & 1',
+             'reg[{x}] = reg[{x}] >> 1'),
+    '8x0E': ('reg[0xF] = 1 if reg[{x}] >= 0x80 else 0',
+             'reg[{x}] = (reg[{x}] << 1) & 0xFF'),
+    'Cxyy': ('reg[{x}] = emu.rng.randint(0, 255) & {kk}',),
+    'Ayyy': ('emu.index_register = {nnn}',),
+    'Fy1E': ('emu.index_register = (emu.index_register + reg[{x}]) & 0xFFF',),
+    'Fx07': ('reg[{x}] = emu.delay_timer_register',),
+    'Fy15': ('emu.delay_timer_register = reg[{x}]',),
+    'Fy18': ('emu.sound_timer_register = reg[{x}]',),
+    'Fy29': ('emu.index_register = ' + str(GFX_FONT_ADDRESS) + ' + 5 * reg[{x}]',),
+}
+
+# Branches end a block, their templates return the address execution goes
+# on at. {skip} is the address past the next instruction, {next} the next one.
+BRANCH_INLINE = {
+    '1xxx': ('return {nnn}',),
+    '3xyy': ('return {skip} if reg[{x}] == {kk} else {next}',),
+    '4xyy': ('return {skip} if reg[{x}] != {kk} else {next}',),
+    '5xy0': ('return {skip} if reg[{x}] == reg[{y}] else {next}',),
+    '9xy0': ('return {skip} if reg[{x}] != reg[{y}] else {next}',),
+    'Ex9E': ('return {skip} if emu.keypad & (0x8000 >> (reg[{x}] & 0xF)) else {next}',),
+    'ExA1': ('return {next} if emu.keypad & (0x8000 >> (reg[{x}] & 0xF)) else {skip}',),
+}
+
+# Instructions that stay in a block but run through the emulator's handler,
+# with the program counter and dis_ins set to the instruction first
+CALLED = ('00E0', 'Dxyz', 'Fx65')
+
+# Branches that run through the handler, as do the skips on the XO-Chip
+# where they also step over a long instruction
+CALLED_BRANCHES = ('2xxx', '00EE', 'Byyy') + LONG_SKIPS
+
+# Stores can rewrite code, so they are always the last instruction of a block
+STORES = ('Fy33', 'Fy55')
+
+# Templates replacing the ones above when a Quirks field is on, see
+# instructions.QUIRK_HANDLERS
+QUIRK_INLINE = {
+    'shift_vy':       {'8x06': ('reg[0xF] = reg[{y}] & 1',
+                                'reg[{x}] = reg[{y}] >> 1'),
+                       '8x0E': ('reg[0xF] = 1 if reg[{y}] >= 0x80 else 0',
+                                'reg[{x}] = (reg[{y}] << 1) & 0xFF')},
+    'vf_reset':       {'8xy1': INLINE['8xy1'] + ('reg[0xF] = 0',),
+                       '8xy2': INLINE['8xy2'] + ('reg[0xF] = 0',),
+                       '8xy3': INLINE['8xy3'] + ('reg[0xF] = 0',)},
+    'index_overflow': {'Fy1E': ('emu.index_register += reg[{x}]',
+                                'if emu.index_register > 0xFF: reg[0xF] = 1',
+                                'emu.index_register &= 0xFFF')} }
+
+CALLED_VARIANTS = frozenset( VARIANT_IDS[k] for k in CALLED + CALLED_BRANCHES + STORES )
+BRANCH_VARIANTS = frozenset( VARIANT_IDS[k] for k in tuple(BRANCH_INLINE) + CALLED_BRANCHES )
+STORE_VARIANTS  = frozenset( VARIANT_IDS[k] for k in STORES )
+JUMP_VARIANT    = VARIANT_IDS['1xxx']
+
+def inline_templates(quirks, platform):
+    '''
+    Inline templates by variant, with the ones for quirks, a Quirks,
+    swapped in. The skips are called on the xochip platform.
+    '''
+    templates = dict(INLINE)
+    templates.update(BRANCH_INLINE)
+    for field, on in zip(Quirks._fields, quirks):
+        if on:
+            templates.update(QUIRK_INLINE.get(field, {}))
+    if platform == 'xochip':
+        for hex_template in LONG_SKIPS:
+            del templates[hex_template]
+    return { VARIANT_IDS[k]:v for k,v in templates.items() }
+
+class Block:
+    '''
+    A compiled basic block. run(emu, reg, n) executes its first n
+    instructions and returns the address to go on at, decoded holds their
+    Instructions.
+    '''
+    __slots__ = ('start', 'end', 'length', 'run', 'decoded', 'source')
+
+    def __init__(self, start, end, length, run, decoded, source):
+        self.start   = start
+        self.end     = end
+        self.length  = length
+        self.run     = run
+        self.decoded = decoded
+        self.source  = source
+
+class BlockCompiler:
+    '''
+    Finds, compiles and caches basic blocks for one emulator. Addresses
+    covered by a cached entry are flagged in code_map so stores into code
+    can drop the affected blocks, drops counts how often that happened to
+    the block at each start address.
+    '''
+    def __init__(self, emu):
+        self.emu = emu
+        self.cache = {}
+        self.code_map = bytearray(BYTES_OF_RAM)
+        self.drops = {}
+        self.inline = inline_templates(emu.quirks, emu.platform)
+
+    def lookup(self, address):
+        '''
+        Returns the Block starting at address, or None if the instruction
+        there has to go through the interpreter.
+        '''
+        try:
+            return self.cache[address]
+        except KeyError:
+            # Code that keeps being rewritten is neither compiled nor watched
+            if self.drops.get(address, 0) >= MAX_RECOMPILES:
+                self.cache[address] = None
+                return None
+            block = self.compile(address)
+            self.cache[address] = block
+            end = address + 2 if block is None else block.end
+            self.code_map[address:end] = b'\x01' * (end - address)
+            return block
+
+    def compile(self, start):
+        '''
+        Translates the straight-line run of instructions at start, and the
+        branch or store ending it, into a Python function that returns after
+        its first n instructions. A jump to itself is left to the interpreter,
+        which flags the spin.
+        '''
+        emu = self.emu
+        ram = emu.ram
+        body = []
+        namespace = {}
+        address = start
+        length = 0
+        decoded = []
+
+        while length < MAX_BLOCK_LENGTH and address + 1 < BYTES_OF_RAM:
+            if emu.ram_init_map is not None and emu.ram_unset(address, 2):
+                break
+            ins = decode_opcode( (ram[address] << 8) | ram[address + 1] )
+            if not ins.is_valid or \
+               (ins.variant not in self.inline and ins.variant not in CALLED_VARIANTS) or \
+               (ins.variant == JUMP_VARIANT and ins.nnn == address):
+                break
+            if length:
+                body.append('if n == ' + str(length) + ': return ' + hex(address))
+
+            # Errors are logged with the program counter and dis_ins
+            name = str(length)
+            warn = emu.warn_exotic_ins and ins.unoffical_op
+            if warn or ins.variant not in self.inline:
+                namespace['i' + name] = ins
+                body.append('emu.program_counter, emu.dis_ins = ' + hex(address) + ', i' + name)
+            if warn:
+                namespace['err_' + name] = emu.warn_exotic_ins
+                body.append('emu.log(' + str(LOG_UNOFFICIAL) + ', err_' + name + ', ' + \
+                    repr(ins.mnemonic) + ', ' + hex(address) + ')')
+
+            if ins.variant in self.inline:
+                for line in self.inline[ins.variant]:
+                    body.append(line.format(x=ins.x, y=ins.y, kk=ins.kk, nnn=hex(ins.nnn),
+                                            next=hex(address + 2), skip=hex(address + 4)))
+            else:
+                namespace['h' + name] = emu.ins_tbl[ins.variant]
+                body.append('h' + name + '(emu, i' + name + ')')
+                if ins.variant in BRANCH_VARIANTS:
+                    body.append('return emu.program_counter + 2')
+
+            address += 2
+            length += 1
+            decoded.append(ins)
+            if ins.variant in BRANCH_VARIANTS or ins.variant in STORE_VARIANTS:
+                break
+
+        if length == 0:
+            return None
+        if decoded[-1].variant not in BRANCH_VARIANTS:
+            body.append('return ' + hex(address))
+
+        source = 'def block(emu, reg, n):\n    ' + '\n    '.join(body) + '\n'
+        exec(compile(source, '<block ' + hex(start) + '>', 'exec'), namespace)
+        return Block(start, address, length, namespace['block'], tuple(decoded), source)
+
+    def invalidate(self, address, length):
+        '''
+        Drops every cached entry that overlaps the written range. Only the
+        range the dropped entries covered is cleared from code_map, entries
+        left in it are marked again.
+        '''
+        if self.code_map.find(1, address, address + length) == -1:
+            return
+        end = address + length
+        low, high = end, address
+        for start, block in [(s,b) for s,b in self.cache.items()
+                             if s < end and (s + 2 if b is None else b.end) > address]:
+            del self.cache[start]
+            low, high = min(low, start), max(high, start + 2 if block is None else block.end)
+            if block is not None:
+                self.drops[start] = self.drops.get(start, 0) + 1
+        self.code_map[low:high] = bytes(high - low)
+        for start, block in self.cache.items():
+            stop = start + 2 if block is None else block.end
+            if start < high and stop > low:
+                self.code_map[start:stop] = b'\x01' * (stop - start)
+
+    def fork(self, emu):
+        '''
+        Copy of this compiler for a cloned emulator. Blocks do not hold a
+        reference to the emulator so the cached ones are shared.
+        '''
+        child = BlockCompiler.__new__(BlockCompiler)
+        child.emu = emu
+        child.cache = dict(self.cache)
+        child.code_map = bytearray(self.code_map)
+        child.drops = dict(self.drops)
+        child.inline = self.inline
+        return child
+
+    def flush(self):
+        '''
+        Forgets all compiled code, for when RAM is replaced wholesale.
+        '''
+        self.cache.clear()
+        self.code_map[:] = bytes(BYTES_OF_RAM)
+        self.drops.clear()
+
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+# Store wrappers, installed in Guacamole's dispatch table so cached sprites
+# and compiled blocks are dropped when a store overwrites them
+
+def invalidating_store(handler, span):
+    '''
+    Wraps a store handler so the emulator drops what it overwrites.
+    '''
+    def store(emu, ins):
+        index = emu.index_register
+        handler(emu, ins)
+        emu.invalidate(index, span(ins))
+    return store
+
+STORE_SPANS = {
+    VARIANT_IDS['Fy33']: lambda ins: 3,
+    VARIANT_IDS['Fy55']: lambda ins: ins.x + 1,
+    VARIANT_IDS['5xy2']: lambda ins: abs(ins.y - ins.x) + 1 }
+
+def wrap_stores(table):
+    '''
+    Replaces the store handlers of a dispatch table with invalidating ones.
+    '''
+    for variant, span in STORE_SPANS.items():
+        table[variant] = invalidating_store(table[variant], span)
+    return table
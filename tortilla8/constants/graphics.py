@@ -6,6 +6,11 @@ GFX_WIDTH_PX   = 64
 GFX_WIDTH      = int(GFX_WIDTH_PX/8)
 GFX_RESOLUTION = int(GFX_WIDTH*GFX_HEIGHT_PX) #In bytes
 
+# Super Chip-8 high resolution and the XO-Chip planes, see Framebuffer
+GFX_HIRES_HEIGHT_PX = 64
+GFX_HIRES_WIDTH_PX  = 128
+GFX_XO_PLANES       = 2
+
 SET_VF_ON_GFX_OVERFLOW = False # Undocumented 'feature'. When 'Add I, VX' overflows 'I'
                                # VF is set to one when this is True. The insturction does
                                # not set VF low. Used by Spacefight 2019.
@@ -30,3 +35,24 @@ GFX_FONT = (
     0xF0, 0x80, 0xF0, 0x80, 0x80  # F
     )
 
+
+# Super Chip-8 large font (160 bytes), A to F are from the XO-Chip
+GFX_BIG_FONT_ADDRESS = 0x0A0
+GFX_BIG_FONT = (
+    0x3C, 0x7E, 0xE7, 0xC3, 0xC3, 0xC3, 0xC3, 0xE7, 0x7E, 0x3C, # 0
+    0x18, 0x38, 0x58, 0x18, 0x18, 0x18, 0x18, 0x18, 0x18, 0x3C, # 1
+    0x3E, 0x7F, 0xC3, 0x06, 0x0C, 0x18, 0x30, 0x60, 0xFF, 0xFF, # 2
+    0x3C, 0x7E, 0xC3, 0x03, 0x0E, 0x0E, 0x03, 0xC3, 0x7E, 0x3C, # 3
+    0x06, 0x0E, 0x1E, 0x36, 0x66, 0xC6, 0xFF, 0xFF, 0x06, 0x06, # 4
+    0xFF, 0xFF, 0xC0, 0xC0, 0xFC, 0xFE, 0x03, 0xC3, 0x7E, 0x3C, # 5
+    0x3E, 0x7C, 0xE0, 0xC0, 0xFC, 0xFE, 0xC3, 0xC3, 0x7E, 0x3C, # 6
+    0xFF, 0xFF, 0x03, 0x06, 0x0C, 0x18, 0x30, 0x60, 0x60, 0x60, # 7
+    0x3C, 0x7E, 0xC3, 0xC3, 0x7E, 0x7E, 0xC3, 0xC3, 0x7E, 0x3C, # 8
+    0x3C, 0x7E, 0xC3, 0xC3, 0x7F, 0x3F, 0x03, 0x03, 0x3E, 0x7C, # 9
+    0x18, 0x3C, 0x66, 0xC3, 0xC3, 0xFF, 0xFF, 0xC3, 0xC3, 0xC3, # A
+    0xFC, 0xFE, 0xC3, 0xC3, 0xFC, 0xFC, 0xC3, 0xC3, 0xFE, 0xFC, # B
+    0x3C, 0x7E, 0xC3, 0xC0, 0xC0, 0xC0, 0xC0, 0xC3, 0x7E, 0x3C, # C
+    0xFC, 0xFE, 0xC3, 0xC3, 0xC3, 0xC3, 0xC3, 0xC3, 0xFE, 0xFC, # D
+    0xFF, 0xFF, 0xC0, 0xC0, 0xFC, 0xFC, 0xC0, 0xC0, 0xFF, 0xFF, # E
+    0xFF, 0xFF, 0xC0, 0xC0, 0xFC, 0xFC, 0xC0, 0xC0, 0xC0, 0xC0  # F
+    )
@@ -41,13 +41,41 @@ OP_CODES = {                                 # X and Y in the right most indicat
             OpData('f.18',['st','reg'],'Fy18'),
             OpData('f.29',['f','reg'],'Fy29'),
             OpData('f.33',['b','reg'],'Fy33'),
-            OpData('f.55',['[i]','reg'],'Fy55')),
-    'drw' : OpData('d...',['reg','reg','nibble'],'Dxyz')
+            OpData('f.55',['[i]','reg'],'Fy55'),
+            OpData('f.30',['hf','reg'],'Fy30'),
+            OpData('f.75',['r','reg'],'Fy75'),
+            OpData('f.85',['reg','r'],'Fx85')),
+    'drw' :(OpData('d..0',['reg','reg'],'Dxy0'),
+            OpData('d...',['reg','reg','nibble'],'Dxyz')),
+    'scd' : OpData('00c.',['nibble'],'00Cx'),
+    'scu' : OpData('00d.',['nibble'],'00Dx'),
+    'scr' : OpData('00fb',[],'00FB'),
+    'scl' : OpData('00fc',[],'00FC'),
+    'exit': OpData('00fd',[],'00FD'),
+    'low' : OpData('00fe',[],'00FE'),
+    'high': OpData('00ff',[],'00FF'),
+    'save': OpData('5..2',['reg','reg'],'5xy2'),
+    'load': OpData('5..3',['reg','reg'],'5xy3'),
+    'long': OpData('f000',[],'F000'),   # Followed by the 16 bit address, declare it with dw
+    'plane':OpData('f.01',['nibble'],'Fx01'),
+    'audio':OpData('f002',[],'F002'),
+    'pitch':OpData('f.3a',['reg'],'Fx3A')
     }
 
+# Every version of every mnemonic, in the order they are matched
+OP_VARIANTS = tuple( (mnemonic, opdata)
+    for mnemonic, versions in OP_CODES.items()
+    for opdata in (versions if type(versions) is tuple else (versions,)) )
+
+# Variant number of each version, keyed by its hex template
+VARIANT_IDS = { opdata.hex:i+1 for i,(_,opdata) in enumerate(OP_VARIANTS) }
+
 UNOFFICIAL_OP_CODES = ('xor','shr','shl','subn') # But still supported
 BANNED_OP_CODES = ('7f..','8f.4','8f.6','8f.e','cf..','6f..','8f.0','ff07','ff0a','ff65') # Ins that modify VF: add, shr, shl, rnd, ld
-SUPER_CHIP_OP_CODES = ('00c.','00fb','00fc','00fd','00fe','00ff','d..0','f.30','f.75','f.85') # Super chip-8, not supported
+
+# Versions added by the Super Chip-8 and XO-Chip, only run on those platforms
+SUPER_CHIP_OP_CODES = ('00Cx','00FB','00FC','00FD','00FE','00FF','Dxy0','Fy30','Fy75','Fx85')
+XO_CHIP_OP_CODES    = ('00Dx','5xy2','5xy3','F000','Fx01','F002','Fx3A')
 
 # Used to explode opcodes that are not used (below)
 def explode_op_codes( op_code_list ):
@@ -64,7 +92,6 @@ def explode_op_codes( op_code_list ):
     return exploded_list
 
 BANNED_OP_CODES_EXPLODED = explode_op_codes(BANNED_OP_CODES)
-SUPER_CHIP_OP_CODES_EXPLODED = explode_op_codes(SUPER_CHIP_OP_CODES)
 
 
 
@@ -0,0 +1,44 @@
+#!/usr/bin/env python3
+
+from collections import namedtuple
+from .graphics import SET_VF_ON_GFX_OVERFLOW
+
+# Behaviours that differ between CHIP-8 interpreters. Each field selects the
+# handlers build_dispatch_table() puts in the table, nothing is checked
+# while running.
+#   shift_vy        shr/shl shift VY into VX rather than shifting VX
+#   load_increment  ld [i],vx and ld vx,[i] leave I pointing past the last register
+#   jump_vx         jp v0,nnn jumps to nnn plus VX, X being the top nibble of nnn
+#   vf_reset        or, and and xor set VF to zero
+#   clip_sprites    drw clips sprites at the screen edges rather than wrapping
+#   index_overflow  add i,vx sets VF when I goes past 0xFF
+Quirks = namedtuple('Quirks', 'shift_vy load_increment jump_vx vf_reset clip_sprites index_overflow')
+
+QUIRK_PROFILES = {
+    'tortilla8': Quirks(False, False, False, False, False, SET_VF_ON_GFX_OVERFLOW),
+    'cosmac':    Quirks(True,  True,  False, True,  True,  False),
+    'schip':     Quirks(False, False, True,  False, True,  False),
+    'xochip':    Quirks(True,  True,  False, False, False, False),
+}
+
+DEFAULT_QUIRK_PROFILE = 'tortilla8'
+
+# Platforms the emulator runs and the quirk profile each uses by default.
+# Chip8 treats the Super Chip-8 and XO-Chip instructions as errors.
+PLATFORMS = {'chip8':'tortilla8', 'schip':'schip', 'xochip':'xochip'}
+
+DEFAULT_PLATFORM = 'chip8'
+
+def quirk_profile(quirks=None, legacy_shift=False):
+    '''
+    Quirks for a profile name, a Quirks or None for the default profile.
+    Legacy_shift turns shift_vy on whatever the profile says.
+    '''
+    if quirks is None:
+        quirks = DEFAULT_QUIRK_PROFILE
+    if isinstance(quirks, str):
+        if quirks not in QUIRK_PROFILES:
+            raise RuntimeError("Unknown quirk profile '" + quirks + "', use one of " + \
+                               ", ".join(QUIRK_PROFILES))
+        quirks = QUIRK_PROFILES[quirks]
+    return quirks._replace(shift_vy=True) if legacy_shift else quirks
@@ -8,6 +8,13 @@ REGISTERS = ('v0','v1','v2','v3',
             'v8','v9','va','vb',
             'vc','vd','ve','vf')
 
+# Super Chip-8 RPL user flags, see ld r,vx
+NUMB_OF_RPL_FLAGS = 16
+
+# XO-Chip audio, a 1 bit pattern of 128 samples and its pitch register
+AUDIO_PATTERN_SIZE = 16
+DEFAULT_PITCH      = 64
+
 # ROM Memory Addresses and Related
 BYTES_OF_RAM = 4096
 MAX_ROM_SIZE = 3232
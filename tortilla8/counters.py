@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+
+from . import export
+from array import array
+from .constants.opcodes import OP_VARIANTS, VARIANT_IDS
+from .constants.reg_rom_stack import BYTES_OF_RAM
+__all__ = []
+
+CALL_VARIANT  = VARIANT_IDS['2xxx']
+DRAW_VARIANTS = frozenset( VARIANT_IDS[k] for k in ('Dxyz', 'Dxy0') )
+
+@export
+class Counters:
+    '''
+    Execution counters kept by an instrumented Guacamole, see
+    Guacamole.set_instrumented(). Counts are held in preallocated arrays:
+    variants is indexed by Instruction.variant (zero counts data and
+    Super8 words), addresses and calls by RAM address. Sprite rows are
+    counted per plane drawn to, so framebuffer is the emulator's, None on
+    chip8 where drw vx,vy,0 draws nothing.
+    '''
+    def __init__(self, framebuffer=None):
+        self.framebuffer = framebuffer
+        self.variants  = array('Q', bytes(8 * (len(OP_VARIANTS) + 1)))
+        self.addresses = array('Q', bytes(8 * BYTES_OF_RAM))
+        self.calls     = array('Q', bytes(8 * BYTES_OF_RAM))
+        self.key_wait_cycles = 0
+        self.sprite_rows     = 0
+
+    def count(self, ins, address, times=1):
+        '''
+        Counts times executions of the Instruction ins at address.
+        '''
+        variant = ins.variant if ins.is_valid else 0
+        self.variants[variant] += times
+        self.addresses[address] += times
+        if variant == CALL_VARIANT:
+            self.calls[ins.nnn] += times
+        elif variant in DRAW_VARIANTS:
+            if self.framebuffer is None:
+                self.sprite_rows += ins.n * times
+            else:
+                self.sprite_rows += (ins.n or 16) * len(self.framebuffer.active) * times
+
+    def reset(self):
+        '''
+        Sets every count back to zero.
+        '''
+        self.variants[:]  = array('Q', bytes(8 * len(self.variants)))
+        self.addresses[:] = array('Q', bytes(8 * BYTES_OF_RAM))
+        self.calls[:]     = array('Q', bytes(8 * BYTES_OF_RAM))
+        self.key_wait_cycles = 0
+        self.sprite_rows     = 0
+
+    def snapshot(self):
+        '''
+        Dictionary of the non-zero counts. Variants are keyed by mnemonic and
+        OP_CODES hex template (i.e. 'ld 6xyy'), 'data' for data words.
+        '''
+        variants = {}
+        for variant, times in enumerate(self.variants):
+            if times:
+                name = 'data' if variant == 0 else \
+                       OP_VARIANTS[variant-1][0] + ' ' + OP_VARIANTS[variant-1][1].hex
+                variants[name] = times
+        return {
+            'variants':  variants,
+            'addresses': { a:t for a,t in enumerate(self.addresses) if t },
+            'calls':     { a:t for a,t in enumerate(self.calls) if t },
+            'key_wait_cycles': self.key_wait_cycles,
+            'sprite_rows':     self.sprite_rows }
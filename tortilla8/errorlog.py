@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+
+from . import export
+from . import EmulationError
+from collections import deque, namedtuple
+__all__ = []
+
+# Message of each log code, formatted with the record's args when read
+LOG_MESSAGES = (
+    "Initializing emulator at {0} hz",
+    "Rewind journal of {0} bytes",
+    "Rom file exceeds maximum rom size of {0} bytes",
+    "Rom file loaded",
+    "No instruction found at {0:#x}",
+    "Unoffical instruction '{0}' executed at {1:#x}",
+    "Super8 instruction {0:04x} at {1:#x}",
+    "Banned instruction (makes a modification to VF){0:04x} at {1:#x}",
+    "Unknown instruction {0:04x} at {1:#x}",
+    "Stack underflow",
+    "RCA 1802 call to {0:#x} was ignored.",
+    "Stack overflow. Stack is limited to {0} calls",
+    "Load from [i] reads past the end of RAM",
+    "BCD store writes past the end of RAM",
+    "Store to [i] writes past the end of RAM",
+    "Load from uninitialized RAM at {0:#x}",
+    "Sprite read from uninitialized RAM at {0:#x}",
+    "Instruction at {0:#x} accessed memory past the end of RAM",
+)
+
+LOG_INIT, LOG_REWIND, LOG_ROM_SIZE, LOG_ROM_LOADED, LOG_NO_INSTRUCTION, \
+LOG_UNOFFICIAL, LOG_SUPER8, LOG_BANNED, LOG_UNKNOWN, LOG_STACK_UNDERFLOW, \
+LOG_RCA_CALL, LOG_STACK_OVERFLOW, LOG_READ_PAST_RAM, LOG_BCD_PAST_RAM, \
+LOG_STORE_PAST_RAM, LOG_UNSET_LOAD, LOG_UNSET_SPRITE, LOG_PAST_RAM = range(len(LOG_MESSAGES))
+
+DEFAULT_LOG_CAPACITY = 1024
+
+@export
+class LogRecord( namedtuple('LogRecord', 'error_type code pc opcode args') ):
+    '''
+    One logged EmulationError. Code indexes LOG_MESSAGES, pc and opcode are
+    of the instruction running when it was logged (for compiled blocks, of
+    the block), opcode is None before the first instruction.
+    '''
+    __slots__ = ()
+
+    @property
+    def message(self):
+        return LOG_MESSAGES[self.code].format(*self.args)
+
+    def __str__(self):
+        return str(self.error_type) + ": " + self.message
+
+@export
+class ErrorLog:
+    '''
+    Bounded log of emulation errors. The newest capacity LogRecords are kept,
+    dropped counts the ones pushed out, and records below level are never
+    created. Iterating gives (error type, message) pairs, messages are only
+    formatted then.
+    '''
+    def __init__(self, capacity=DEFAULT_LOG_CAPACITY, level=EmulationError._Information):
+        self.records  = deque(maxlen=capacity)
+        self.capacity = capacity
+        self.level    = level
+        self.dropped  = 0
+
+    def add(self, error_type, code, pc, opcode, args):
+        if error_type.value < self.level.value:
+            return
+        if len(self.records) == self.capacity:
+            self.dropped += 1
+        self.records.append( LogRecord(error_type, code, pc, opcode, args) )
+
+    def extend(self, records):
+        for rec in records:
+            self.add(*rec)
+
+    def clear(self):
+        self.records.clear()
+        self.dropped = 0
+
+    def copy(self):
+        log = ErrorLog(self.capacity, self.level)
+        log.records.extend(self.records)
+        log.dropped = self.dropped
+        return log
+
+    def __len__(self):
+        return len(self.records)
+
+    def __iter__(self):
+        for rec in self.records:
+            yield rec.error_type, rec.message
+
+    def __reversed__(self):
+        for rec in reversed(self.records):
+            yield rec.error_type, rec.message
@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+
+from . import export
+from .constants.graphics import GFX_WIDTH_PX, GFX_HEIGHT_PX, GFX_HIRES_WIDTH_PX, GFX_HIRES_HEIGHT_PX, \
+                                GFX_WIDTH
+__all__ = []
+
+@export
+class Framebuffer:
+    '''
+    Display of the Super Chip-8 and XO-Chip platforms. Each plane is a list
+    with one int per row, the leftmost pixel in the most significant of
+    width bits, so sprites, scrolls and clears work on whole rows and high
+    resolution costs no more per row than low. Instructions only touch the
+    planes in selected, a bitmask where plane 0 is bit 0. Sprites wrap at
+    the screen edges unless clip is set.
+    '''
+    def __init__(self, planes=1, clip=False):
+        self.planes   = []
+        self.active   = []
+        self.selected = 1
+        self.clip     = clip
+        self.draw     = self.draw_clipped if clip else self.draw_wrapped
+        self.plane_count = planes
+        self.set_resolution(False)
+
+    def set_resolution(self, hires):
+        '''
+        Switches between 64x32 and 128x64 pixels, clearing every plane.
+        '''
+        self.hires = hires
+        self.width, self.height = (GFX_HIRES_WIDTH_PX, GFX_HIRES_HEIGHT_PX) if hires else \
+                                  (GFX_WIDTH_PX, GFX_HEIGHT_PX)
+        self.mask = (1 << self.width) - 1
+        self.planes = [ [0] * self.height for _ in range(self.plane_count) ]
+        self.select(self.selected)
+
+    def select(self, selected):
+        '''
+        Sets the bitmask of planes drawn to.
+        '''
+        self.selected = selected
+        self.active = [ plane for i, plane in enumerate(self.planes) if selected >> i & 1 ]
+
+    def copy(self):
+        fb = Framebuffer(self.plane_count, self.clip)
+        fb.set_resolution(self.hires)
+        for plane, rows in zip(fb.planes, self.planes):
+            plane[:] = rows
+        fb.select(self.selected)
+        return fb
+
+    def rows(self):
+        '''
+        The display as one int per row with the planes combined.
+        '''
+        if self.plane_count == 1:
+            return list(self.planes[0])
+        return [ a | b for a, b in zip(*self.planes) ]
+
+    # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+    # Drawing, sprite holds rows rows of sprite_width bits for each active
+    # plane in turn. Returns 1 if a set pixel was erased, 0 otherwise.
+
+    def draw_wrapped(self, sprite, x, y, rows, sprite_width):
+        width, height, mask = self.width, self.height, self.mask
+        shift = 2 * width - sprite_width - x % width
+        step = sprite_width // 8
+        collided = 0
+        offset = 0
+        for plane in self.active:
+            for r in range(rows):
+                bits = int.from_bytes(sprite[offset:offset + step], 'big') << shift
+                bits = (bits >> width | bits) & mask
+                row = (y + r) % height
+                if plane[row] & bits:
+                    collided = 1
+                plane[row] ^= bits
+                offset += step
+        return collided
+
+    def draw_clipped(self, sprite, x, y, rows, sprite_width):
+        width, height = self.width, self.height
+        x, y = x % width, y % height
+        shift = width - sprite_width - x
+        step = sprite_width // 8
+        visible = min(rows, height - y)
+        collided = 0
+        offset = 0
+        for plane in self.active:
+            for r in range(visible):
+                data = int.from_bytes(sprite[offset:offset + step], 'big')
+                bits = data << shift if shift >= 0 else data >> -shift
+                if plane[y + r] & bits:
+                    collided = 1
+                plane[y + r] ^= bits
+                offset += step
+            offset += (rows - visible) * step
+        return collided
+
+    # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+    # Whole screen operations on the active planes
+
+    def clear(self):
+        for plane in self.active:
+            plane[:] = [0] * self.height
+
+    def scroll_down(self, n):
+        n = min(n, self.height)
+        for plane in self.active:
+            plane[:] = [0] * n + plane[:self.height - n]
+
+    def scroll_up(self, n):
+        n = min(n, self.height)
+        for plane in self.active:
+            plane[:] = plane[n:] + [0] * n
+
+    def scroll_right(self, n):
+        for plane in self.active:
+            plane[:] = [ row >> n for row in plane ]
+
+    def scroll_left(self, n):
+        mask = self.mask
+        for plane in self.active:
+            plane[:] = [ (row << n) & mask for row in plane ]
+
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+# The chip8 screen stays in the RAM at GFX_ADDRESS so ROMs and tools reading
+# it see what was drawn. Its rows are still worked on whole, a run of rows
+# is read as one int of GFX_WIDTH_PX bits per row, the top row most
+# significant, and written back the same way.
+
+def xor_rows(gfx, bits, row, count):
+    '''
+    XORs bits into count rows of gfx from row on, wrapping past the bottom.
+    Returns the set pixels that were erased.
+    '''
+    if row + count > GFX_HEIGHT_PX:
+        below = (row + count - GFX_HEIGHT_PX) * GFX_WIDTH_PX
+        return xor_rows(gfx, bits >> below, row, GFX_HEIGHT_PX - row) << below | \
+               xor_rows(gfx, bits & ((1 << below) - 1), 0, row + count - GFX_HEIGHT_PX)
+    start, end = row * GFX_WIDTH, (row + count) * GFX_WIDTH
+    screen = int.from_bytes(gfx[start:end], 'big')
+    gfx[start:end] = (screen ^ bits).to_bytes(end - start, 'big')
+    return screen & bits
@@ -4,22 +4,50 @@ from . import export
 from . import EmulationError
 from os.path import getsize
 from time import time
-from .salsa import Salsa
-from collections import namedtuple, deque
+from random import Random
+from functools import partial
+from .salsa import decode_opcode
+from array import array
+from heapq import heappush, heappop
+from collections import deque
 from .instructions import *
-from .constants.reg_rom_stack import BYTES_OF_RAM, PROGRAM_BEGIN_ADDRESS, \
-                                     NUMB_OF_REGS, MAX_ROM_SIZE
-from .constants.graphics import GFX_FONT, GFX_FONT_ADDRESS, GFX_RESOLUTION, GFX_ADDRESS
+from .compiler import BlockCompiler, wrap_stores
+from .counters import Counters
+from .breakpoints import READ_SETS, accessed
+from .savestate import pack_state, unpack_state
+from .movie import Movie, apply_edge
+from .framebuffer import Framebuffer
+from .sprites import SpriteCache
+from .errorlog import ErrorLog, LOG_MESSAGES, LOG_INIT, LOG_REWIND, LOG_ROM_SIZE, LOG_ROM_LOADED, \
+                       LOG_NO_INSTRUCTION, LOG_BANNED, LOG_UNKNOWN
+from .constants.opcodes import VARIANT_IDS
+from .constants.quirks import quirk_profile, PLATFORMS, DEFAULT_PLATFORM
+from .journal import RewindJournal, WRITE_SETS, NOTHING, ENTRY, LOC_REGISTER, LOC_STACK, \
+                     FLAG_DRAW, FLAG_WAITING, FLAG_SPINNING
+from .constants.reg_rom_stack import BYTES_OF_RAM, PROGRAM_BEGIN_ADDRESS, NUMB_OF_REGS, MAX_ROM_SIZE, \
+                                     STACK_SIZE, NUMB_OF_RPL_FLAGS, AUDIO_PATTERN_SIZE, DEFAULT_PITCH
+from .constants.graphics import GFX_FONT, GFX_FONT_ADDRESS, GFX_RESOLUTION, GFX_ADDRESS, GFX_WIDTH, \
+                                GFX_WIDTH_PX, GFX_HEIGHT_PX, GFX_BIG_FONT, GFX_BIG_FONT_ADDRESS, GFX_XO_PLANES
 __all__ = []
 
-# TODO Rewind bug when waiting for keypress
-# TODO Rewind isn't storing all of RAM, so ld [i], reg will break rewind
+# Most wall clock time run() will catch up on after a stall, in seconds
+MAX_CATCH_UP = 0.25
 
-@export
-class RewindData( namedtuple('RewindData', 'gfx_buffer register index_register ' + \
-    'delay_timer_register sound_timer_register program_counter calling_pc ' + \
-    'dis_ins stack stack_pointer draw_flag waiting_for_key spinning') ):
-    pass
+# Events hooks can be registered for, see add_hook()
+HOOK_EVENTS = ('draw', 'clear', 'sound_start', 'sound_stop', 'key_wait', 'spin', 'fatal', 'reset', 'break')
+
+# Hook events raised by instructions, the others cost nothing per instruction
+TICK_EVENTS = ('draw', 'clear', 'sound_start', 'key_wait', 'spin')
+
+# Instructions the draw and clear hooks are called for, the other platforms
+# also draw by scrolling and switching resolution
+DRAW_VARIANTS = frozenset( VARIANT_IDS[k] for k in ('Dxyz',) )
+SCREEN_DRAW_VARIANTS = frozenset( VARIANT_IDS[k] for k in
+    ('Dxyz', 'Dxy0', '00Cx', '00Dx', '00FB', '00FC', '00FE', '00FF') )
+CLEAR_VARIANT = VARIANT_IDS['00E0']
+
+# Default size of the rewind journal in bytes, most instructions use 15 to 30
+DEFAULT_REWIND_BUDGET = 65536
 
 @export
 class Guacamole:
@@ -29,7 +57,8 @@ class Guacamole:
     '''
     def __init__(self, rom=None, cpuhz=200, audiohz=60, delayhz=60,
                  init_ram=False, legacy_shift=False, err_unoffical="None",
-                 rewind_frames=1000):
+                 rewind_budget=DEFAULT_REWIND_BUDGET, compiled=False, seed=None, quirks=None,
+                 platform=DEFAULT_PLATFORM):
         '''
         Init the RAM, registers, instruction information, IO, load the ROM etc. ROM
         is a path to a chip-8 rom, *hz is the frequency to target for for the cpu,
@@ -38,17 +67,31 @@ class Guacamole:
         incorrect RAM accesses. Legacy Shift can be set to true to use the older
         'Store shift Y to X' rather than 'Shift X' method of bitshifting. Lastly,
         err_unoffical can be used to log an error when an offical instruction is
-        found in the program.
+        found in the program. Rewind_budget is the number of bytes kept for
+        undoing instructions, zero disables rewind. Compiled selects the basic-block compiler instead
+        of the interpreter for execute(), see set_compiled(). Seed makes rnd repeatable.
+        Quirks is a quirk profile name from QUIRK_PROFILES or a Quirks, the
+        platform's profile if None, legacy_shift is applied on top of it.
+        Platform is one of PLATFORMS, schip and xochip draw to a Framebuffer
+        and can not be rewound or saved.
         '''
+        if platform not in PLATFORMS:
+            raise RuntimeError("Unknown platform '" + str(platform) + "', use one of " + \
+                               ", ".join(PLATFORMS))
 
         # # # # # # # # # # # # # # # # # # # # # # # #
         # Public
 
-        # RAM
-        self.ram = [0x00] * BYTES_OF_RAM if init_ram else [None] * BYTES_OF_RAM
+        # RAM, the graphics buffer is a view into it
+        self.ram = bytearray(BYTES_OF_RAM)
+        self.gfx = memoryview(self.ram)[GFX_ADDRESS:GFX_ADDRESS + GFX_RESOLUTION]
+
+        # Shadow map of written RAM addresses, only kept when RAM is not
+        # initialized so reads of unset memory can be reported.
+        self.ram_init_map = None if init_ram else bytearray(BYTES_OF_RAM)
 
         # Registers
-        self.register = [0x00] * NUMB_OF_REGS
+        self.register = bytearray(NUMB_OF_REGS)
         self.index_register = 0x000
         self.delay_timer_register = 0x00
         self.sound_timer_register = 0x00
@@ -60,61 +103,120 @@ class Guacamole:
         self.program_counter = PROGRAM_BEGIN_ADDRESS
         self.calling_pc      = PROGRAM_BEGIN_ADDRESS
 
-        # I/O
-        self.keypad      = [False] * 16
-        self.prev_keypad = 0
+        # I/O. The keypad is a bitmask, key 0 is the most significant of 16
+        # bits. Key_queue holds (cycle, key, pressed) events from press()
+        # and release() that are applied before the next instruction.
+        self.keypad      = 0x0000
+        self.prev_keypad = 0x0000
+        self.key_queue   = deque()
+        self.key_cycle   = -1
         self.draw_flag   = False
         self.waiting_for_key = False
         self.spinning = False
 
-        # Stack
-        self.stack = []
+        # Stack, entries past stack_pointer are stale
+        self.stack = array('H', bytes(2 * STACK_SIZE))
         self.stack_pointer = 0
 
-        # Instruction modification settings
-        self.legacy_shift = legacy_shift
+        # Random number generator used by rnd, part of the saved state. The
+        # seed is kept for reset().
+        self.seed = seed
+        self.rng = Random(seed)
+
+        # Instruction modification settings, all are baked into ins_tbl
+        self.platform = platform
+        self.quirks = quirk_profile(PLATFORMS[platform] if quirks is None else quirks, legacy_shift)
         self.warn_exotic_ins = EmulationError.from_string(err_unoffical)
 
-        # Rewind Info
-        self.rewind_frames = None if rewind_frames == 0 else deque(maxlen=rewind_frames)
+        # Super Chip-8 and XO-Chip state. The screen is a Framebuffer rather
+        # than the RAM at GFX_ADDRESS, None on chip8.
+        self.framebuffer = None if platform == 'chip8' else \
+            Framebuffer(GFX_XO_PLANES if platform == 'xochip' else 1, self.quirks.clip_sprites)
+        self.rpl = bytearray(NUMB_OF_RPL_FLAGS)
+        self.audio_pattern = bytearray(AUDIO_PATTERN_SIZE)
+        self.pitch = DEFAULT_PITCH
+        self.draw_variants = DRAW_VARIANTS if self.framebuffer is None else SCREEN_DRAW_VARIANTS
+
+        # Pre-shifted sprites for drw, dropped by stores that overwrite them
+        self.sprites = SpriteCache()
+
+        # Rewind Info, a journal of the bytes each instruction overwrote. The
+        # framebuffer is not journaled.
+        if self.framebuffer is not None:
+            rewind_budget = 0
+        self.journal = None if rewind_budget == 0 else RewindJournal(rewind_budget)
+
+        # Execution counters, see set_instrumented()
+        self.counters = None
+
+        # Callbacks by event name, see add_hook()
+        self.hooks = {}
+
+        # Breakpoints and watchpoints, see set_breakpoints()
+        self.breakpoints = None
+
+        # Instruction trace recorder, see set_tracer()
+        self.tracer = None
+
+        # Movie being recorded and the inputs last recorded, see record_movie()
+        self.movie = None
+        self.movie_inputs = None
 
         # # # # # # # # # # # # # # # # # # # # # # # #
         # Private (ish)
 
-        # Warning control
+        # Warning control. Debug checks only what each instruction wrote, the
+        # whole state is checked every sweep_interval cycles, zero never.
         self.debug = False
-        self.error_log = []
+        self.sweep_interval = 0
+        self.error_log = ErrorLog()
 
         # Timming variables
         self.cpu_hz     = cpuhz
         self.cpu_wait   = 1/cpuhz
-        self.cpu_time   = 0
         self.audio_hz   = audiohz
-        self.audio_wait = 1/audiohz
-        self.audio_time = 0
         self.delay_hz   = delayhz
-        self.delay_wait = 1/delayhz
-        self.delay_time = 0
+        self.wall_time  = None
+
+        # Virtual clock. Cycles counts executed CPU cycles, the timers fire at
+        # fixed cycle counts measured from timer_base (cycle, audio ticks,
+        # delay ticks) and events is a heap of (cycle, seq, callback).
+        self.cycles      = 0
+        self.audio_ticks = 0
+        self.delay_ticks = 0
+        self.timer_base  = (0, 0, 0)
+        self.events      = []
+        self.event_seq   = 0
+        self.stopped     = False
+
+        # Busy waits are skipped over by run_cycles() when fast_forward is
+        # set, idle_cycles counts the cycles that were skipped.
+        self.fast_forward = True
+        self.idle_cycles  = 0
 
-        # Load Font, clear screen
-        self.ram[GFX_FONT_ADDRESS:GFX_FONT_ADDRESS + len(GFX_FONT)] = GFX_FONT
-        self.ram[GFX_ADDRESS:GFX_ADDRESS + GFX_RESOLUTION] = [0x00] * GFX_RESOLUTION
+        # Load Font, clear screen. rom_image is the RAM before anything has
+        # run, save states only store the bytes that differ from it.
+        self.ram[GFX_FONT_ADDRESS:GFX_FONT_ADDRESS + len(GFX_FONT)] = bytes(GFX_FONT)
+        self.mark_ram(GFX_FONT_ADDRESS, len(GFX_FONT))
+        if self.framebuffer is not None:
+            self.ram[GFX_BIG_FONT_ADDRESS:GFX_BIG_FONT_ADDRESS + len(GFX_BIG_FONT)] = bytes(GFX_BIG_FONT)
+            self.mark_ram(GFX_BIG_FONT_ADDRESS, len(GFX_BIG_FONT))
+        self.mark_ram(GFX_ADDRESS, GFX_RESOLUTION)
+        self.rom_image = bytes(self.ram)
 
         # Notification
-        self.log("Initializing emulator at " + str(cpuhz) + " hz" ,EmulationError._Information)
-        self.log("Max Rewind of " + str(rewind_frames) + " instructions" ,EmulationError._Information)
+        self.log(LOG_INIT, EmulationError._Information, cpuhz)
+        self.log(LOG_REWIND, EmulationError._Information, rewind_budget)
 
         # Load Rom
         if rom is not None:
             self.load_rom(rom)
 
-        # Instruction lookup table
-        self.ins_tbl={
-        'cls' :i_cls, 'ret' :i_ret,  'sys' :i_sys, 'call':i_call,
-        'skp' :i_skp, 'sknp':i_sknp, 'se'  :i_se,  'sne' :i_sne,
-        'add' :i_add, 'or'  :i_or,   'and' :i_and, 'xor' :i_xor,
-        'sub' :i_sub, 'subn':i_subn, 'shr' :i_shr, 'shl' :i_shl,
-        'rnd' :i_rnd, 'jp'  :i_jp,   'ld'  :i_ld,  'drw' :i_drw}
+        # Instruction lookup table, indexed by Instruction.variant
+        self.ins_tbl = None
+        self.compiler = None
+        self.set_compiled(compiled)
+        self.select_tick()
 
     def load_rom(self, file_path):
         '''
@@ -122,179 +224,832 @@ class Guacamole:
         '''
         file_size = getsize(file_path)
         if file_size > MAX_ROM_SIZE:
-            self.log("Rom file exceeds maximum rom size of " + str(MAX_ROM_SIZE) + \
-                " bytes" , EmulationError._Fatal)
+            self.log(LOG_ROM_SIZE, EmulationError._Fatal, MAX_ROM_SIZE)
             return
 
         with open(file_path, "rb") as fh:
-            self.ram[PROGRAM_BEGIN_ADDRESS:PROGRAM_BEGIN_ADDRESS + file_size] = \
-                [int.from_bytes(fh.read(1), 'big') for i in range(file_size)]
-            self.log("Rom file loaded" , EmulationError._Information)
+            self.ram[PROGRAM_BEGIN_ADDRESS:PROGRAM_BEGIN_ADDRESS + file_size] = fh.read()
+            self.mark_ram(PROGRAM_BEGIN_ADDRESS, file_size)
+            self.rom_image = bytes(self.ram)
+            self.log(LOG_ROM_LOADED, EmulationError._Information)
 
     def reset(self, rom=None, cpuhz=None, audiohz=None, delayhz=None,
               init_ram=None, legacy_shift=None, err_unoffical="None",
-              rewind_frames=1000):
+              rewind_budget=DEFAULT_REWIND_BUDGET, compiled=None, seed=None, quirks=None,
+              platform=None):
         '''
-        Resets the emulator to run another game. By default all frequencies
-        and the init_ram flag are preserved.
+        Resets the emulator to run another game. By default all frequencies,
+        the platform, the quirks, the seed and the init_ram flag are
+        preserved, as are hooks and breakpoints. A new platform brings its
+        own quirks.
         '''
         if cpuhz is None: cpuhz = self.cpu_hz
         if audiohz is None: audiohz = self.audio_hz
         if delayhz is None: delayhz = self.delay_hz
-        if init_ram is None: init_ram = True if self.ram[0] == 0 else False
-        if legacy_shift is None: legacy_shift = self.legacy_shift
+        if init_ram is None: init_ram = self.ram_init_map is None
+        if platform is None: platform = self.platform
+        if quirks is None:
+            quirks = self.quirks if platform == self.platform else PLATFORMS.get(platform)
+        if legacy_shift is not None:
+            quirks = quirk_profile(quirks)._replace(shift_vy=legacy_shift)
         if err_unoffical is None: err_unoffical = str(self.warn_exotic_ins)
-        if rewind_frames is None:
-            rewind_frames =  0 if self.rewind_frames == None else self.rewind_frames.maxlen
+        if rewind_budget is None:
+            rewind_budget = 0 if self.journal is None else self.journal.budget
+        if compiled is None: compiled = self.compiler is not None
+        if seed is None: seed = self.seed
 
+        hooks, breakpoints, error_log = self.hooks, self.breakpoints, self.error_log
         self.__init__(rom, cpuhz, audiohz, delayhz,
-                      init_ram, legacy_shift, err_unoffical,
-                      rewind_frames)
+                      init_ram, False, err_unoffical,
+                      rewind_budget, compiled, seed, quirks, platform)
+        error_log.clear()
+        error_log.extend(self.error_log.records)
+        self.hooks, self.breakpoints, self.error_log = hooks, breakpoints, error_log
+        self.select_tick()
+        self.emit('reset')
+
+    def clone(self):
+        '''
+        Returns an independent copy of the running emulator for branching a
+        state. Rewind history, scheduled events, hooks, breakpoints, the trace
+        recorder, the movie being recorded and the error log are not copied.
+        Settings, the dispatch table and compiled blocks are shared with or
+        cheaply copied from the parent.
+        '''
+        child = Guacamole.__new__(Guacamole)
+        child.__dict__.update(self.__dict__)
+
+        child.ram = bytearray(self.ram)
+        child.gfx = memoryview(child.ram)[GFX_ADDRESS:GFX_ADDRESS + GFX_RESOLUTION]
+        if self.ram_init_map is not None:
+            child.ram_init_map = bytearray(self.ram_init_map)
+        child.register = bytearray(self.register)
+        if self.framebuffer is not None:
+            child.framebuffer = self.framebuffer.copy()
+        child.rpl = bytearray(self.rpl)
+        child.sprites = self.sprites.copy()
+        child.audio_pattern = bytearray(self.audio_pattern)
+        child.stack = array('H', self.stack)
+        child.key_queue = deque(self.key_queue)
+        child.rng = Random.__new__(Random)
+        child.rng.setstate(self.rng.getstate())
+
+        child.journal = None
+        child.counters = None
+        child.hooks = {}
+        child.breakpoints = None
+        child.tracer = None
+        child.movie = None
+        child.events = []
+        child.error_log = ErrorLog(self.error_log.capacity, self.error_log.level)
+        if self.compiler is not None:
+            child.compiler = self.compiler.fork(child)
+        child.select_tick()
+        return child
+
+    def set_compiled(self, compiled):
+        '''
+        Switches execute() between the interpreter and the basic-block
+        compiler. Both give the same results, compiled blocks are only
+        used while rewind recording and debug output are off.
+        '''
+        self.ins_tbl = wrap_stores(build_dispatch_table(self.ram_init_map is not None, self.quirks,
+                                                        self.warn_exotic_ins, self.platform))
+        self.compiler = BlockCompiler(self) if compiled else None
+
+    def invalidate(self, address, length):
+        '''
+        Drops the cached sprites and compiled blocks read from length bytes
+        at address. Called by the store instructions, anything else writing
+        to ram outside of them should call it too.
+        '''
+        self.sprites.invalidate(address, length)
+        if self.compiler is not None:
+            self.compiler.invalidate(address, length)
+
+    def set_instrumented(self, instrumented):
+        '''
+        Turns the execution counters on or off. While on, counters holds a
+        Counters that is updated every instruction. While off, the counting
+        is not in the execution path at all.
+        '''
+        self.counters = Counters(self.framebuffer) if instrumented else None
+        self.select_tick()
+
+    def select_tick(self):
+        '''
+        Binds cpu_tick to the plain tick, or to a chain of wrappers for the
+        per instruction features that are on (rewind journal, counters, trace,
+        movie, hooks, breakpoints).
+        Features that are off are not in the chain and cost nothing. When
+        breakpoints are the only layer, block_guard lets execute() keep
+        running compiled blocks that have no breakpoint in them.
+        '''
+        self.__dict__.pop('cpu_tick', None)
+        tick, layers = self.cpu_tick, []
+        for enabled, layer in ( (self.journal is not None, self.journaled_tick),
+                                (self.counters is not None, self.instrumented_tick),
+                                (self.tracer is not None, self.traced_tick),
+                                (self.movie is not None, self.recorded_tick),
+                                (any(e in self.hooks for e in TICK_EVENTS), self.hooked_tick),
+                                (self.breakpoints is not None, self.checked_tick) ):
+            if enabled:
+                tick = partial(layer, tick)
+                layers.append(layer)
+        self.plain_tick = not layers
+        self.block_guard = self.breakpoints if layers == [self.checked_tick] else None
+        if layers:
+            self.cpu_tick = tick
+
+    def set_breakpoints(self, breakpoints):
+        '''
+        Attaches a Breakpoints, or detaches them with None. Runs stop when
+        one is hit and the break hook is called. With only execution
+        breakpoints set compiled blocks are still used.
+        '''
+        self.breakpoints = breakpoints
+        self.select_tick()
+
+    def set_tracer(self, tracer):
+        '''
+        Attaches a TraceRecorder that records every executed instruction,
+        or detaches it with None. Busy waits skipped by fast forward show
+        up as gaps in the cycle count. Reset() detaches it, closing it is
+        left to the caller.
+        '''
+        self.tracer = tracer
+        if tracer is not None:
+            tracer.attach(self)
+        self.select_tick()
+
+    def record_movie(self):
+        '''
+        Starts recording the inputs into a Movie that begins at the current
+        state, see stop_movie(). Busy waits are not fast forwarded while
+        recording.
+        '''
+        self.movie = Movie( pack_state(self) )
+        self.movie_inputs = (self.keypad, self.prev_keypad, self.timer_base)
+        self.select_tick()
+
+    def stop_movie(self):
+        '''
+        Stops recording and returns the Movie, or None if none was recorded.
+        '''
+        movie, self.movie = self.movie, None
+        if movie is not None:
+            movie.end = self.cycles
+            self.select_tick()
+        return movie
+
+    def play_movie(self, movie):
+        '''
+        Restores the state a Movie starts at and schedules its inputs, which
+        replaces any scheduled events. Running to movie.end with
+        run_cycles() then repeats the recorded run exactly.
+        '''
+        unpack_state(self, movie.state)
+        self.events = []
+        for cycle, keys, prev_keys, hz in movie.edges:
+            self.schedule(cycle, partial(apply_edge, keys, prev_keys, hz))
+
+    def add_hook(self, event, callback):
+        '''
+        Registers callback for one of HOOK_EVENTS. Callbacks are called as
+        callback(emulator), fatal ones as callback(emulator, message):
+          draw, clear     after a sprite is drawn or the screen is cleared
+          sound_start     when the sound timer is set from zero
+          sound_stop      when the sound timer runs out
+          key_wait        when ld reg,k starts waiting
+          spin            when a jump to itself is first found
+          fatal           when a fatal error is logged
+          reset           after reset()
+          break           after a run stops on a breakpoint
+        '''
+        if event not in HOOK_EVENTS:
+            raise RuntimeError("Unknown hook event '" + str(event) + "'")
+        self.hooks.setdefault(event, []).append(callback)
+        self.select_tick()
+
+    def remove_hook(self, event, callback):
+        '''
+        Unregisters a callback added with add_hook(). With no hooks left
+        the per instruction checks are dropped.
+        '''
+        callbacks = self.hooks.get(event, [])
+        if callback in callbacks:
+            callbacks.remove(callback)
+        if not callbacks:
+            self.hooks.pop(event, None)
+        self.select_tick()
+
+    def emit(self, event, *args):
+        '''
+        Calls the hooks registered for event.
+        '''
+        for callback in self.hooks.get(event, ()):
+            callback(self, *args)
 
     def run(self):
         '''
-        Attempt to run the next instruction. This should be called as a part
-        of the main loop, it insures that the CPU and timers execute at the
-        target frequency.
+        Runs every cycle that is due since the last call. This should be called
+        as a part of the main loop, it insures that the CPU and timers execute
+        at the target frequency. Backlogs longer than MAX_CATCH_UP seconds are
+        dropped rather than run.
+        '''
+        now = time()
+        if self.wall_time is None:
+            self.wall_time = now - self.cpu_wait
+        due = int( (now - self.wall_time) * self.cpu_hz )
+        if due > MAX_CATCH_UP * self.cpu_hz:
+            due = int(MAX_CATCH_UP * self.cpu_hz)
+            self.wall_time = now - due / self.cpu_hz
+        if due > 0:
+            self.wall_time += self.run_cycles(due) / self.cpu_hz
+
+    def set_frequency(self, cpuhz):
+        '''
+        Changes the CPU frequency. Timers keep their own frequency, measured
+        in cycles from this point on.
+        '''
+        self.cpu_hz = cpuhz
+        self.cpu_wait = 1/cpuhz
+        self.wall_time = None
+        self.timer_base = (self.cycles, self.audio_ticks, self.delay_ticks)
+
+    # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+    # Virtual clock
+
+    def run_cycles(self, count):
+        '''
+        Runs count CPU cycles without reading the wall clock, decrementing the
+        timers and firing scheduled events at their exact cycles. Returns the
+        number of cycles run, which is short of count if stop() was called.
+        '''
+        start = self.cycles
+        end = start + count
+        self.stopped = False
+        while self.cycles < end and not self.stopped:
+            until = min( end, self.next_audio_cycle(), self.next_delay_cycle() )
+            if self.events and self.events[0][0] < until:
+                until = max( self.events[0][0], self.cycles )
+            if until > self.cycles and self.fast_forward and self.may_skip():
+                self.skip_idle(until, end if not self.events else min(end, self.events[0][0]))
+            if until > self.cycles:
+                self.execute(until - self.cycles)
+            self.fire_events()
+        return self.cycles - start
+
+    def run_frames(self, count):
+        '''
+        Runs until the delay timer has ticked count more times, 60 frames per
+        second at the default delayhz. Never reads the wall clock.
+        '''
+        end = self.next_delay_cycle(count - 1)
+        return self.run_cycles(end - self.cycles)
+
+    def schedule(self, cycle, callback):
+        '''
+        Calls callback(emulator) once the virtual clock reaches cycle, before
+        the instruction at that cycle runs. Used for input events and stop
+        conditions in headless runs.
+        '''
+        heappush(self.events, (cycle, self.event_seq, callback))
+        self.event_seq += 1
+
+    def stop(self):
+        '''
+        Ends the current run_cycles() or run_frames() call after the current
+        instruction, usually called from a scheduled callback or a hook.
+        '''
+        self.stopped = True
+
+    def next_audio_cycle(self, ahead=0):
+        base_cycle, base_ticks, _ = self.timer_base
+        return base_cycle + int( -(-(self.audio_ticks - base_ticks + ahead + 1) * self.cpu_hz // self.audio_hz) )
+
+    def next_delay_cycle(self, ahead=0):
+        base_cycle, _, base_ticks = self.timer_base
+        return base_cycle + int( -(-(self.delay_ticks - base_ticks + ahead + 1) * self.cpu_hz // self.delay_hz) )
+
+    def skip_idle(self, until, limit):
+        '''
+        Advances the clock toward until, the next timer tick, without
+        executing anything if the CPU is in a busy wait that can not end
+        before then. Recognized waits are a jump to itself, ld reg,k with no
+        new key pressed, and polling the delay timer with ld vx,dt / se vx,kk
+        / jp back. Only steady state loops are skipped, ones whose iterations
+        no longer change anything, a delay timer poll is run to its ld first
+        for that, so the state afterwards is the same as running every cycle. Waits that do not read the timers skip ahead to
+        limit, the next event, when both timers are at zero.
+        '''
+        pc, ram = self.program_counter, self.ram
+        if self.waiting_for_key:
+            if (self.keypad ^ self.prev_keypad) & self.keypad:
+                return
+            skipped = self.idle_target(until, limit) - self.cycles
+            if self.counters is not None:
+                self.counters.key_wait_cycles += skipped
+
+        elif pc + 6 > BYTES_OF_RAM:
+            return
+
+        # jp / jp v0 to itself, after the first time through
+        elif self.calling_pc == pc and self.dis_ins is not None and \
+             self.dis_ins.opcode == (ram[pc] << 8 | ram[pc+1]) and \
+             ( (ram[pc] >> 4 == 0x1 and self.dis_ins.nnn == pc) or \
+               (ram[pc] >> 4 == 0xB and self.dis_ins.nnn + self.register[0] == pc) ):
+            if self.prev_keypad != self.keypad:
+                return
+            skipped = self.idle_target(until, limit) - self.cycles
+            if self.counters is not None:
+                self.counters.count(self.dis_ins, pc, skipped)
+
+        # ld vx,dt / se vx,kk / jp back, after the first time through. The
+        # timer has usually just ticked, so the loop is run up to the ld and
+        # vx holds the timer once anything is skipped. The rewind journal
+        # records every iteration, so not while it is on.
+        else:
+            top = None if self.journal is not None else self.delay_poll()
+            if top is None or self.prev_keypad != self.keypad:
+                return
+            lead = (top + 6 - pc) % 6 // 2
+            if lead:
+                if self.cycles + lead >= until:
+                    return
+                self.execute(lead)
+                if self.program_counter != top:
+                    return
+            if self.delay_timer_register == ram[top+3]:
+                return
+            skipped = (until - self.cycles) // 3 * 3
+            if skipped:
+                self.register[ram[top] & 0xF] = self.delay_timer_register
+            if self.counters is not None:
+                for address in (top, top + 2, top + 4):
+                    self.counters.count(decode_opcode(ram[address] << 8 | ram[address+1]), address, skipped // 3)
+
+        self.cycles += skipped
+        self.idle_cycles += skipped
+
+    def delay_poll(self):
+        '''
+        Address of the ld vx,dt / se vx,kk / jp back loop the CPU is going
+        around, at any of its three instructions, or None.
+        '''
+        pc, ram = self.program_counter, self.ram
+        for top, last in ((pc, pc + 4), (pc - 2, pc - 2), (pc - 4, pc - 2)):
+            if self.calling_pc == last and 0 <= top and top + 6 <= BYTES_OF_RAM and \
+               ram[top] >> 4 == 0xF and ram[top+1] == 0x07 and ram[top+2] == 0x30 | (ram[top] & 0xF) and \
+               ram[top+4:top+6] == bytes((0x10 | top >> 8, top & 0xFF)):
+                return top
+        return None
+
+    def may_skip(self):
+        '''
+        True unless something needs every cycle of a busy wait executed.
+        '''
+        return not self.debug and self.movie is None and not self.key_queue and \
+               (self.breakpoints is None or self.breakpoints.allows_skip(self.program_counter))
+
+    def idle_target(self, until, limit):
+        '''
+        Cycle to skip a wait to. Past until only if both timers are zero, the
+        timer ticks in between are counted without running them.
         '''
-        if self.cpu_wait <= (time() - self.cpu_time):
-            self.cpu_time = time()
-            self.cpu_tick()
+        if self.delay_timer_register or self.sound_timer_register or limit <= until:
+            return until
+        base_cycle, base_audio, base_delay = self.timer_base
+        self.audio_ticks = max( self.audio_ticks, self.ticks_before(limit, base_cycle, base_audio, self.audio_hz) )
+        self.delay_ticks = max( self.delay_ticks, self.ticks_before(limit, base_cycle, base_delay, self.delay_hz) )
+        return limit
 
-        if self.audio_wait <= (time() - self.audio_time):
-            self.audio_time = time()
-            self.sound_timer_register -= 1 if self.sound_timer_register != 0 else 0
+    def ticks_before(self, cycle, base_cycle, base_ticks, hz):
+        '''
+        The tick count of a hz timer once every tick due before cycle has
+        happened, the inverse of next_audio_cycle() and next_delay_cycle().
+        '''
+        return base_ticks + int( (cycle - base_cycle - 1) * hz // self.cpu_hz )
 
-        if self.delay_wait <= (time() - self.delay_time):
-            self.delay_time = time()
+    def fire_events(self):
+        '''
+        Decrements timers and calls events that are due at the current cycle.
+        '''
+        if self.cycles >= self.next_audio_cycle():
+            self.audio_ticks += 1
+            if self.sound_timer_register != 0:
+                self.sound_timer_register -= 1
+                if self.sound_timer_register == 0 and self.hooks:
+                    self.emit('sound_stop')
+        if self.cycles >= self.next_delay_cycle():
+            self.delay_ticks += 1
             self.delay_timer_register -= 1 if self.delay_timer_register != 0 else 0
+        while self.events and self.events[0][0] <= self.cycles:
+            heappop(self.events)[2](self)
+
+    def execute(self, count):
+        '''
+        Executes count instructions back to back with the selected engine,
+        without regard for the target frequency.
+        '''
+        guard = self.block_guard
+        if self.compiler is None or self.debug or not \
+           (self.plain_tick or (guard is not None and guard.exec_only())):
+            for _ in range(count):
+                self.cpu_tick()
+                if self.stopped:
+                    return
+            return
+
+        # Blocks longer than the cycles left, or running into an execution
+        # breakpoint, are run up to there. Queued key changes are applied one
+        # cycle at a time by the interpreter.
+        lookup, cache, register = self.compiler.lookup, self.compiler.cache, self.register
+        while count > 0 and not self.stopped:
+            pc = self.program_counter
+            if self.waiting_for_key or self.key_queue:
+                block = None
+            else:
+                block = cache[pc] if pc in cache else lookup(pc)
+            n = 0 if block is None else block.length if block.length < count else count
+            if n and guard is not None:
+                hit = guard.exec_map.find(1, pc, pc + 2 * n)
+                if hit != -1:
+                    n = (hit - pc) // 2
+            if n == 0:
+                self.cpu_tick()
+                count -= 1
+                continue
+            self.prev_keypad = self.keypad
+            self.program_counter = block.run(self, register, n)
+            self.cycles += n
+            self.calling_pc = pc + 2 * n - 2
+            self.dis_ins = block.decoded[n - 1]
+            count -= n
 
     def cpu_tick(self):
         '''
         Ticks the CPU forward a cycle without regard for the target frequency.
         '''
+        if self.key_queue and self.key_cycle != self.cycles:
+            self.take_keys()
+        self.cycles += 1
+
         # Handle the ld reg,k instruction
         if self.waiting_for_key:
             self.handle_load_key()
             return
         else:
-            self.prev_keypad = self.decode_keypad()
+            self.prev_keypad = self.keypad
 
         # Record current PC, Reset error log
         self.calling_pc = self.program_counter
         self.error = []
 
-        # Dissassemble next instruction
+        # Decode next instruction
         self.dis_ins = None
-        try:
-            self.dis_ins = Salsa(self.ram[self.program_counter:self.program_counter+2])
-        except TypeError:
-            self.log("No instruction found at " + hex(self.program_counter), EmulationError._Fatal)
+        if self.program_counter + 2 > BYTES_OF_RAM or \
+           (self.ram_init_map is not None and self.ram_unset(self.program_counter, 2)):
+            self.log(LOG_NO_INSTRUCTION, EmulationError._Fatal, self.program_counter)
             return
+        self.dis_ins = decode_opcode( (self.ram[self.program_counter] << 8) | \
+                                       self.ram[self.program_counter+1] )
+
+        # What the instruction may write, for the debug checks
+        if self.debug:
+            write_set = WRITE_SETS[self.dis_ins.variant] if self.dis_ins.is_valid else None
+            touched = NOTHING if write_set is None else write_set(self, self.dis_ins)
 
         # Execute instruction
         if self.dis_ins.is_valid:
-            if self.warn_exotic_ins and self.dis_ins.unoffical_op:
-                self.log("Unoffical instruction '" + self.dis_ins.mnemonic + \
-                    "' executed at " + hex(self.program_counter), self.warn_exotic_ins)
-            self.ins_tbl[self.dis_ins.mnemonic](self)
-
-        # Error out. NOTE: to add new instruction update OP_CODES and self.ins_tbl
-        elif self.dis_ins.is_super8:
-            self.log("Super8 instruction " + self.dis_ins.hex_instruction + " at " + \
-                hex(self.program_counter), EmulationError._Fatal)
+            self.ins_tbl[self.dis_ins.variant](self, self.dis_ins)
+
+        # Error out. NOTE: to add new instruction update OP_CODES and instructions.HANDLERS
         elif self.dis_ins.is_banned:
-            self.log("Banned instruction (makes a modification to VF)" + self.dis_ins.hex_instruction + \
-                " at " + hex(self.program_counter), EmulationError._Fatal)
+            self.log(LOG_BANNED, EmulationError._Fatal, self.dis_ins.opcode, self.program_counter)
         else:
-            self.log("Unknown instruction " + self.dis_ins.hex_instruction + " at " + \
-                hex(self.program_counter), EmulationError._Fatal)
+            self.log(LOG_UNKNOWN, EmulationError._Fatal, self.dis_ins.opcode, self.program_counter)
 
         # Print what was processed to screen
         if self.debug:
-            self.enforce_rules()
+            sweep = self.sweep_interval and self.cycles % self.sweep_interval == 0
+            self.enforce_rules(None if sweep else touched)
             print( hex(self.calling_pc) + " " + self.dis_ins.hex_instruction + " " + self.dis_ins.mnemonic )
 
-        # Increment the PC, Store Rewind Data
+        # Increment the PC
         self.program_counter += 2
-        self.store_RewindData()
 
-    def store_RewindData(self):
+    # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+    # Instrumentation
+
+    def instrumented_tick(self, tick):
+        '''
+        Wraps tick, see select_tick(), to update the counters.
+        '''
+        if self.waiting_for_key:
+            self.counters.key_wait_cycles += 1
+            tick()
+            return
+        pc = self.program_counter
+        tick()
+        if self.dis_ins is not None and self.calling_pc == pc:
+            self.counters.count(self.dis_ins, pc)
+
+    def hooked_tick(self, tick):
+        '''
+        Wraps tick, see select_tick(), to call the hooks for what the
+        instruction did. Fatal errors are reported by log().
+        '''
+        if self.waiting_for_key:
+            tick()
+            return
+        spinning, sound = self.spinning, self.sound_timer_register
+        tick()
+        ins = self.dis_ins
+        if ins is None or not ins.is_valid:
+            return
+        if ins.variant in self.draw_variants:
+            self.emit('draw')
+        elif ins.variant == CLEAR_VARIANT:
+            self.emit('clear')
+        elif self.waiting_for_key:
+            self.emit('key_wait')
+        elif self.spinning and not spinning:
+            self.emit('spin')
+        elif self.sound_timer_register and not sound:
+            self.emit('sound_start')
+
+    def traced_tick(self, tick):
+        '''
+        Wraps tick, see select_tick(), to record the instruction in the trace.
+        '''
+        if self.waiting_for_key:
+            tick()
+            return
+        pc = self.program_counter
+        tick()
+        if self.dis_ins is not None and self.calling_pc == pc:
+            self.tracer.record(self.cycles, pc, self.dis_ins.opcode, self.register, self.index_register)
+
+    def recorded_tick(self, tick):
+        '''
+        Wraps tick, see select_tick(), to add an edge to the movie when the
+        inputs were changed since the last tick. Queued key events are applied
+        first so the edge holds them.
+        '''
+        if self.key_queue and self.key_cycle != self.cycles:
+            self.take_keys()
+        keypad, prev_keypad, timer_base = self.movie_inputs
+        if self.keypad != keypad or self.prev_keypad != prev_keypad or self.timer_base != timer_base:
+            self.movie.edges.append( (self.cycles, self.keypad, self.prev_keypad,
+                                      0 if self.timer_base == timer_base else self.cpu_hz) )
+            keypad, timer_base = self.keypad, self.timer_base
+        tick()
+        self.movie_inputs = (keypad, self.prev_keypad, timer_base)
+
+    # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+    # Breakpoints
+
+    def checked_tick(self, tick):
         '''
-        Save the current state of the emulator.
-        Without rewind guac/platter use 7.6 megs of RAM. Using rewind uses
-        2.64 kB of ram per frame.
+        Wraps tick, see select_tick(), to stop the run on breakpoints. The
+        instruction at an execution breakpoint is not run, it runs when the
+        emulator is resumed.
         '''
-        if self.rewind_frames is None:
+        bp, pc = self.breakpoints, self.program_counter
+        if self.waiting_for_key or pc + 2 > BYTES_OF_RAM:
+            ins = None
+        else:
+            if bp.exec_map[pc] and pc != bp.skip:
+                condition = bp.exec_conditions.get(pc)
+                if condition is None or condition(self, self.register, self.ram):
+                    bp.skip = pc
+                    self.hit_breakpoint('exec', pc)
+                    return
+            ins = decode_opcode( (self.ram[pc] << 8) | self.ram[pc+1] ) if bp.watch_ram else None
+        bp.skip = None
+        if bp.exec_only():
+            tick()
             return
-        gfx_buffer = self.ram[GFX_ADDRESS:GFX_ADDRESS + GFX_RESOLUTION]
-        self.rewind_frames.append( RewindData(gfx_buffer, self.register.copy(), self.index_register,
-            self.delay_timer_register, self.sound_timer_register, self.program_counter, self.calling_pc,
-            self.dis_ins + (), self.stack.copy(), self.stack_pointer, self.draw_flag, self.waiting_for_key,
-            self.spinning ) )
+
+        read = write = None
+        if ins is not None and ins.is_valid:
+            read  = accessed(self, ins, bp.read_map, READ_SETS)
+            write = accessed(self, ins, bp.write_map, WRITE_SETS)
+        before = [ (name, get(self, self.register, self.ram)) for name, get in bp.registers.items() ]
+
+        tick()
+
+        hit = ('read', read) if read is not None else \
+              ('write', write) if write is not None else None
+        for name, value in before:
+            if hit is None and bp.registers[name](self, self.register, self.ram) != value:
+                hit = ('register', name)
+        for entry in bp.conditions:
+            source, condition, was_true = entry
+            entry[2] = condition(self, self.register, self.ram)
+            if hit is None and entry[2] and not was_true:
+                hit = ('condition', source)
+        if hit is not None:
+            self.hit_breakpoint(*hit)
+
+    def hit_breakpoint(self, kind, where):
+        '''
+        Stops the run and calls the break hooks.
+        '''
+        self.breakpoints.hit = (kind, where)
+        self.stop()
+        self.emit('break')
+
+    # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+    # Rewind
+
+    def journaled_tick(self, tick):
+        '''
+        Wraps tick, see select_tick(), to record an undo frame in the journal. Only the bytes
+        the instruction can write are saved, ticks that change nothing (waiting
+        for a key) are not recorded.
+        '''
+        reg, ram, stack = self.register, self.ram, self.stack
+        before = self.journal_footer()
+
+        if self.waiting_for_key:
+            regs, addresses, slot = (self.dis_ins.x,), (), None
+        elif self.program_counter + 2 <= BYTES_OF_RAM:
+            ins = decode_opcode( (ram[self.program_counter] << 8) | ram[self.program_counter+1] )
+            write_set = WRITE_SETS[ins.variant] if ins.is_valid else None
+            regs, addresses, slot = NOTHING if write_set is None else write_set(self, ins)
+        else:
+            regs, addresses, slot = NOTHING
+
+        old_regs = [ reg[r] for r in regs ]
+        old_ram  = [ ram[a] for a in addresses ]
+        old_slot = None if slot is None else stack[slot]
+
+        tick()
+
+        entries = bytearray()
+        for r, old in zip(regs, old_regs):
+            if reg[r] != old:
+                entries += ENTRY.pack(LOC_REGISTER + r, old)
+        for a, old in zip(addresses, old_ram):
+            if ram[a] != old:
+                entries += ENTRY.pack(a, old)
+        if slot is not None and stack[slot] != old_slot:
+            entries += ENTRY.pack(LOC_STACK + 2 * slot, old_slot >> 8)
+            entries += ENTRY.pack(LOC_STACK + 2 * slot + 1, old_slot & 0xFF)
+
+        if entries or self.journal_footer() != before:
+            self.journal.record(entries, len(entries) // ENTRY.size, before)
+
+    def journal_footer(self):
+        '''
+        Scalar state saved with each journal frame.
+        '''
+        return (self.program_counter, self.calling_pc, self.index_register,
+                self.delay_timer_register, self.sound_timer_register, self.stack_pointer,
+                (FLAG_DRAW if self.draw_flag else 0) | \
+                (FLAG_WAITING if self.waiting_for_key else 0) | \
+                (FLAG_SPINNING if self.spinning else 0))
 
     def rewind(self, depth):
         '''
-        "Un-ticks" the CPU depth many times.
+        "Un-ticks" the CPU depth many times, or as many as the journal holds.
         '''
-        frame = None
-        try:
-            for _ in range(depth):
-                frame = self.rewind_frames.pop()
-        except IndexError:
+        if self.journal is None:
+            return
+        for _ in range(depth):
+            frame = self.journal.pop()
             if frame is None:
-                return
-        self.ram[GFX_ADDRESS:GFX_ADDRESS + GFX_RESOLUTION] = \
-            frame.gfx_buffer
-        self.register, self.index_register = \
-            frame.register, frame.index_register
-        self.delay_timer_register, self.sound_timer_register = \
-            frame.delay_timer_register, frame.sound_timer_register
-        self.program_counter, self.calling_pc = \
-            frame.program_counter, frame.calling_pc
-        self.dis_ins, self.stack, self.stack_pointer = \
-            self.dis_ins, frame.stack, frame.stack_pointer
-        self.draw_flag, self.waiting_for_key, self.spinning = \
-            frame.draw_flag, frame.waiting_for_key, frame.spinning
+                break
+            entries, footer = frame
+            for loc, old in entries:
+                if loc < LOC_REGISTER:
+                    self.ram[loc] = old
+                elif loc < LOC_STACK:
+                    self.register[loc - LOC_REGISTER] = old
+                else:
+                    slot, low = divmod(loc - LOC_STACK, 2)
+                    self.stack[slot] = (self.stack[slot] & 0xFF00) | old if low else \
+                                       (self.stack[slot] & 0x00FF) | (old << 8)
+            self.program_counter, self.calling_pc, self.index_register, \
+                self.delay_timer_register, self.sound_timer_register, \
+                self.stack_pointer, flags, _ = footer
+            self.draw_flag       = bool(flags & FLAG_DRAW)
+            self.waiting_for_key = bool(flags & FLAG_WAITING)
+            self.spinning        = bool(flags & FLAG_SPINNING)
+
+        if self.calling_pc + 2 <= BYTES_OF_RAM:
+            self.dis_ins = decode_opcode( (self.ram[self.calling_pc] << 8) | self.ram[self.calling_pc+1] )
+        self.sprites.flush()
+        if self.compiler is not None:
+            self.compiler.flush()
+
+    def screen_size(self):
+        '''
+        Width and height of the screen in pixels.
+        '''
+        if self.framebuffer is None:
+            return GFX_WIDTH_PX, GFX_HEIGHT_PX
+        return self.framebuffer.width, self.framebuffer.height
+
+    def screen_rows(self):
+        '''
+        The screen as one int per row, the leftmost pixel most significant.
+        The XO-Chip planes are combined.
+        '''
+        if self.framebuffer is None:
+            return [ int.from_bytes(self.gfx[i:i + GFX_WIDTH], 'big')
+                     for i in range(0, GFX_RESOLUTION, GFX_WIDTH) ]
+        return self.framebuffer.rows()
 
     def graphics(self):
         '''
-        Generator that returns true/false if the nth pixel is set.
+        Generator that returns true/false if the nth pixel is set, row by
+        row, see screen_size().
         '''
-        for i in self.ram[GFX_ADDRESS:GFX_ADDRESS + GFX_RESOLUTION]:
-            for j in bin(i)[2:].zfill(8):
+        width, _ = self.screen_size()
+        for row in self.screen_rows():
+            for j in bin(row)[2:].zfill(width):
                 yield j=='1'
 
-    def log(self, message, error_type):
+    def log(self, code, error_type, *args):
         '''
         Logs an EmulationError that can be latter addressed by the instantiator
-        or prints it to screen if called from command line.
+        or prints it to screen if called from command line. Code is one of the
+        LOG_* codes from errorlog, its message is formatted with args only
+        when it is read.
         '''
         if self.debug:
-            print(str(error_type) + ": " + message)
+            print(str(error_type) + ": " + LOG_MESSAGES[code].format(*args))
             if error_type is EmulationError._Fatal:
                 print("Fatal error has occured, please reset.")
         else:
-            self.error_log.append( (error_type, message) )
+            self.error_log.add(error_type, code, self.program_counter,
+                               None if self.dis_ins is None else self.dis_ins.opcode, args)
+        if error_type is EmulationError._Fatal and self.hooks:
+            self.emit('fatal', LOG_MESSAGES[code].format(*args))
 
     # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
-    # Helpers for Load Key ( Private )
+    # Helpers for uninitialized RAM tracking
+
+    def mark_ram(self, address, length):
+        '''
+        Flags a range of RAM as written. Does nothing if RAM was initialized.
+        '''
+        if self.ram_init_map is not None:
+            self.ram_init_map[address:address + length] = b'\x01' * length
+
+    def ram_unset(self, address, length):
+        '''
+        True if any address in the range has never been written.
+        '''
+        return self.ram_init_map.find(0, address, address + length) != -1 or \
+               address + length > BYTES_OF_RAM
+
+    # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+    # Input
+
+    def press(self, key):
+        '''
+        Queues a press of key 0x0-0xF, it is applied before the next
+        instruction. Presses released before then are still seen.
+        '''
+        self.key_queue.append( (self.cycles, key, True) )
+
+    def release(self, key):
+        '''
+        Queues a release of key 0x0-0xF, see press().
+        '''
+        self.key_queue.append( (self.cycles, key, False) )
 
-    def decode_keypad(self):
+    def take_keys(self):
         '''
-        Helper method to decode the current keypad into a binary string
+        Applies queued key events in order up to the first one for a key
+        already changed, so every press and release lasts an instruction.
         '''
-        return int(''.join(['1' if x else '0' for x in self.keypad]),2)
+        keypad, changed, queue = self.keypad, 0, self.key_queue
+        while queue:
+            bit = 0x8000 >> queue[0][1]
+            if changed & bit:
+                break
+            if bool(keypad & bit) != queue.popleft()[2]:
+                keypad ^= bit
+                changed |= bit
+        self.keypad = keypad
+        self.key_cycle = self.cycles
+
+    # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+    # Helpers for Load Key ( Private )
 
     def handle_load_key(self):
         '''
         Helper method to check if keys have changed and, if so, load the
-        key per the ld reg,k instruction.
+        lowest newly pressed key per the ld reg,k instruction.
         '''
-        k = self.decode_keypad()
-        nk = bin( (k ^ self.prev_keypad) & k )[2:].zfill(16).find('1')
-        if nk != -1:
-            self.register[ self.get_reg1() ] = nk
+        pressed = (self.keypad ^ self.prev_keypad) & self.keypad
+        if pressed:
+            self.register[ self.dis_ins.x ] = 16 - pressed.bit_length()
             self.program_counter += 2
             self.waiting_for_key = False
 
@@ -303,16 +1058,16 @@ class Guacamole:
 
     def dump_ram(self):
         for i,val in enumerate(self.ram):
-            if val is None:
+            if self.ram_init_map is not None and not self.ram_init_map[i]:
                 print('0x' + hex(i)[2:].zfill(3))
             else:
                 print('0x' + hex(i)[2:].zfill(3) + '  ' + '0x' + hex(val)[2:].zfill(2))
 
     def dump_gfx(self):
-        for i,b in enumerate(self.ram[ GFX_ADDRESS : GFX_ADDRESS + GFX_RESOLUTION ]):
-            if i%8 == 0:
-                print()
-            print( bin(b)[2:].zfill(8).replace('1','X').replace('0','.'), end='')
+        width, _ = self.screen_size()
+        for row in self.screen_rows():
+            print()
+            print( bin(row)[2:].zfill(width).replace('1','X').replace('0','.'), end='')
         print()
 
     def dump_reg(self):
@@ -324,27 +1079,40 @@ class Guacamole:
 
     def dump_keypad(self):
         r_val = ''
-        for i,val in enumerate(self.keypad):
-            if val:
+        for i in range(16):
+            if self.keypad & (0x8000 >> i):
                 r_val += hex(i) + " "
         return r_val
 
-    def enforce_rules(self):
-        assert(self.index_register is not None)
+    def enforce_rules(self, touched=None):
+        '''
+        Asserts I, the timers, the stack and the map of written RAM are
+        consistent. RAM that was never marked as written must still be zero.
+        Touched limits the RAM and stack checks to the (registers, RAM
+        addresses, stack slot) an instruction wrote, see journal.WRITE_SETS,
+        by default everything is checked.
+        '''
         assert(self.index_register <= 0xFFF)
         assert(self.index_register >= 0x000)
         assert(self.delay_timer_register <= 0xFF)
         assert(self.delay_timer_register >= 0x00)
         assert(self.sound_timer_register <= 0xFF)
         assert(self.sound_timer_register >= 0x00)
-        for i,val in enumerate(self.register):
-            assert val is not None, "Register " + hex(i) + " has value 'None'" + self.dump_pc()
-            assert val >= 0x00, "Register " + hex(i) + "is less than 0x00" + self.dump_pc()
-            assert val <= 0xFF, "Register " + hex(i) + "is greater than 0xFF" + self.dump_pc()
-        for i,val in enumerate(self.ram):
-            if val is None: continue
-            assert val >= 0x00, "Ram Address " + hex(i) + "is less than 0x00" + self.dump_pc()
-            assert val <= 0xFF, "Ram Address " + hex(i) + "is greater than 0xFF" + self.dump_pc()
+        assert self.stack_pointer <= STACK_SIZE, "Stack pointer past the stack" + self.dump_pc()
+
+        if touched is None:
+            addresses, slots = range(BYTES_OF_RAM), range(self.stack_pointer)
+        else:
+            _, addresses, slot = touched
+            slots = () if slot is None else (slot,)
+
+        if self.ram_init_map is not None:
+            for i in addresses:
+                if i < BYTES_OF_RAM and not self.ram_init_map[i]:
+                    assert self.ram[i] == 0x00, "Ram Address " + hex(i) + \
+                                                " was written without being marked" + self.dump_pc()
+        for i in slots:
+            assert self.stack[i] < BYTES_OF_RAM, "Stack entry " + str(i) + " is past the end of RAM" + self.dump_pc()
 
     def dump_pc(self):
         return "\nPC: " + hex(self.program_counter) + " INS: " + self.dis_ins.hex_instruction
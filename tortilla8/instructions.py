@@ -1,217 +1,532 @@
 #!/usr/bin/env python3
 
-from random import randint
 from . import EmulationError
-from .constants.reg_rom_stack import STACK_ADDRESS, STACK_SIZE
+from .errorlog import LOG_UNOFFICIAL, LOG_STACK_UNDERFLOW, LOG_RCA_CALL, LOG_STACK_OVERFLOW, LOG_READ_PAST_RAM, \
+                       LOG_BCD_PAST_RAM, LOG_STORE_PAST_RAM, LOG_UNSET_LOAD, LOG_UNSET_SPRITE, \
+                       LOG_SUPER8, LOG_UNKNOWN, LOG_PAST_RAM
+from .framebuffer import xor_rows
+from .sprites import sprite_row
+from .constants.opcodes import OP_VARIANTS, VARIANT_IDS, UNOFFICIAL_OP_CODES, \
+                               SUPER_CHIP_OP_CODES, XO_CHIP_OP_CODES
+from .constants.quirks import Quirks, QUIRK_PROFILES, DEFAULT_QUIRK_PROFILE, DEFAULT_PLATFORM
+from .constants.reg_rom_stack import STACK_ADDRESS, STACK_SIZE, BYTES_OF_RAM
 from .constants.graphics import GFX_FONT_ADDRESS, GFX_RESOLUTION, GFX_ADDRESS, \
-                                GFX_WIDTH, GFX_HEIGHT_PX, GFX_WIDTH_PX, \
-                                SET_VF_ON_GFX_OVERFLOW
+                                GFX_WIDTH_PX, GFX_HEIGHT_PX, GFX_BIG_FONT_ADDRESS
 
-# Instructions - All 20 mnemonics, 35 total instructions
-# Add-3 SE-2 SNE-2 LD-11 JP-2 (mnemonics w/ extra instructions)
+GFX_BLANK = bytes(GFX_RESOLUTION)
 
-def i_cls(emu):
-    emu.ram[GFX_ADDRESS:GFX_ADDRESS + GFX_RESOLUTION] = [0x00] * GFX_RESOLUTION
+# Instructions - All 33 mnemonics, 54 total instructions, 17 of them from the
+# Super Chip-8 and XO-Chip (see Platforms below)
+# Add-3 SE-2 SNE-2 LD-14 JP-2 DRW-2 SHL-2 SHR-2 (mnemonics w/ extra instructions)
+# Every handler takes the emulator and the decoded Instruction, mnemonics
+# with several versions have one handler per version. Behaviour that
+# depends on the quirk profile or the platform is in the handlers further
+# down.
+
+def i_cls(emu, ins):
+    emu.gfx[:] = GFX_BLANK
     emu.draw_flag = True
 
-def i_ret(emu):
+def i_ret(emu, ins):
+    if emu.stack_pointer == 0:
+        emu.log(LOG_STACK_UNDERFLOW, EmulationError._Fatal)
+        return
     emu.stack_pointer -= 1
-    if emu.stack_pointer < 0:
-        emu.log("Stack underflow", EmulationError._Fatal)
-    emu.program_counter = emu.stack.pop()
+    emu.program_counter = emu.stack[emu.stack_pointer]
 
-def i_sys(emu):
-    emu.log("RCA 1802 call to " + hex( get_address(emu) ) + " was ignored.", EmulationError._Warning)
+def i_sys(emu, ins):
+    emu.log(LOG_RCA_CALL, EmulationError._Warning, ins.nnn)
 
-def i_call(emu):
+def i_call(emu, ins):
+    if emu.stack_pointer == STACK_SIZE:
+        emu.log(LOG_STACK_OVERFLOW, EmulationError._Fatal, STACK_SIZE)
+        return
     if STACK_ADDRESS:
-        emu.ram[stack_pointer] = emu.program_counter
+        emu.ram[STACK_ADDRESS + 2 * emu.stack_pointer : STACK_ADDRESS + 2 * emu.stack_pointer + 2] = \
+            emu.program_counter.to_bytes(2, 'big')
+    emu.stack[emu.stack_pointer] = emu.program_counter
     emu.stack_pointer += 1
-    emu.stack.append(emu.program_counter)
-    if emu.stack_pointer > STACK_SIZE:
-        emu.log("Stack overflow. Stack is now size " + emu.stack_pointer, EmulationError._Warning)
-    emu.program_counter = get_address(emu) - 2
+    emu.program_counter = ins.nnn - 2
 
-def i_skp(emu):
-    if emu.keypad[ get_reg1_val(emu) & 0x0F ]:
+def i_skp(emu, ins):
+    if emu.keypad & (0x8000 >> (emu.register[ins.x] & 0x0F)):
         emu.program_counter += 2
 
-def i_sknp(emu):
-    if not emu.keypad[ get_reg1_val(emu) & 0x0F ]:
+def i_sknp(emu, ins):
+    if not emu.keypad & (0x8000 >> (emu.register[ins.x] & 0x0F)):
         emu.program_counter += 2
 
-def i_se(emu):
-    comp = get_lower_byte(emu) if 'byte' is emu.dis_ins.mnemonic_arg_types[1] else get_reg2_val(emu)
-    if get_reg1_val(emu) == comp:
+def i_se_byte(emu, ins):
+    if emu.register[ins.x] == ins.kk:
         emu.program_counter += 2
 
-def i_sne(emu):
-    comp = get_lower_byte(emu) if 'byte' is emu.dis_ins.mnemonic_arg_types[1] else get_reg2_val(emu)
-    if get_reg1_val(emu) != comp:
+def i_se_reg(emu, ins):
+    if emu.register[ins.x] == emu.register[ins.y]:
         emu.program_counter += 2
 
-def i_shl(emu):
-    if emu.legacy_shift:
-        emu.register[0xF] = 0x01 if get_reg2_val(emu) >= 0x80 else 0x0
-        emu.register[ get_reg1(emu) ] = ( get_reg2_val(emu) << 1 ) & 0xFF
-    else:
-        emu.register[0xF] = 0x01 if get_reg1_val(emu) >= 0x80 else 0x0
-        emu.register[ get_reg1(emu) ] = ( get_reg1_val(emu) << 1 ) & 0xFF
-
-def i_shr(emu):
-    if emu.legacy_shift:
-        emu.register[0xF] = 0x01 if ( get_reg2_val(emu) % 2) == 1 else 0x0
-        emu.register[ get_reg1(emu) ] = get_reg2_val(emu) >> 1
-    else:
-        emu.register[0xF] = 0x01 if ( get_reg1_val(emu) % 2) == 1 else 0x0
-        emu.register[ get_reg1(emu) ] = get_reg1_val(emu) >> 1
-
-def i_or(emu):
-    emu.register[ get_reg1(emu) ] = get_reg1_val(emu) | get_reg2_val(emu)
-
-def i_and(emu):
-    emu.register[ get_reg1(emu) ] = get_reg1_val(emu) & get_reg2_val(emu)
-
-def i_xor(emu):
-    emu.register[ get_reg1(emu) ] = get_reg1_val(emu) ^ get_reg2_val(emu)
-
-def i_sub(emu):
-    emu.register[0xF] = 0x01 if get_reg1_val(emu) >= get_reg2_val(emu) else 0x00
-    emu.register[ get_reg1(emu) ] = get_reg1_val(emu) - get_reg2_val(emu)
-    emu.register[ get_reg1(emu) ] &= 0xFF
-
-def i_subn(emu):
-    emu.register[0xF] = 0x01 if get_reg2_val(emu) >= get_reg1_val(emu) else 0x00
-    emu.register[ get_reg1(emu) ] = get_reg2_val(emu) - get_reg1_val(emu)
-    emu.register[ get_reg1(emu) ] &= 0xFF
-
-def i_jp(emu):
-    init_pc = emu.program_counter
-    numb_args = len(emu.dis_ins.mnemonic_arg_types)
+def i_sne_byte(emu, ins):
+    if emu.register[ins.x] != ins.kk:
+        emu.program_counter += 2
+
+def i_sne_reg(emu, ins):
+    if emu.register[ins.x] != emu.register[ins.y]:
+        emu.program_counter += 2
+
+def i_shl(emu, ins):
+    emu.register[0xF] = 0x01 if emu.register[ins.x] >= 0x80 else 0x0
+    emu.register[ins.x] = ( emu.register[ins.x] << 1 ) & 0xFF
+
+def i_shr(emu, ins):
+    emu.register[0xF] = emu.register[ins.x] & 0x01
+    emu.register[ins.x] = emu.register[ins.x] >> 1
+
+def i_or(emu, ins):
+    emu.register[ins.x] |= emu.register[ins.y]
 
-    if 'v0' is emu.dis_ins.mnemonic_arg_types[0] and numb_args == 2:
-        emu.program_counter = get_address(emu) + emu.register[0] - 2
-    elif numb_args == 1:
-        emu.program_counter = get_address(emu) - 2
-    else:
-        emu.log("Unknown argument at address " + hex(emu.program_counter), EmulationError._Fatal)
+def i_and(emu, ins):
+    emu.register[ins.x] &= emu.register[ins.y]
 
+def i_xor(emu, ins):
+    emu.register[ins.x] ^= emu.register[ins.y]
+
+def i_sub(emu, ins):
+    reg = emu.register
+    reg[0xF] = 0x01 if reg[ins.x] >= reg[ins.y] else 0x00
+    reg[ins.x] = ( reg[ins.x] - reg[ins.y] ) & 0xFF
+
+def i_subn(emu, ins):
+    reg = emu.register
+    reg[0xF] = 0x01 if reg[ins.y] >= reg[ins.x] else 0x00
+    reg[ins.x] = ( reg[ins.y] - reg[ins.x] ) & 0xFF
+
+def i_jp(emu, ins):
+    if emu.program_counter == ins.nnn:
+        emu.spinning = True
+    emu.program_counter = ins.nnn - 2
+
+def i_jp_v0(emu, ins):
+    init_pc = emu.program_counter
+    emu.program_counter = ins.nnn + emu.register[0] - 2
     if init_pc == emu.program_counter + 2:
         emu.spinning = True
 
-def i_rnd(emu):
-    emu.register[ get_reg1(emu) ] = randint(0, 255) & get_lower_byte(emu)
-
-def i_add(emu):
-    arg1 = emu.dis_ins.mnemonic_arg_types[0]
-    arg2 = emu.dis_ins.mnemonic_arg_types[1]
-
-    if 'reg' is arg1:
-
-        if 'byte' is arg2:
-            emu.register[ get_reg1(emu) ] = get_reg1_val(emu) + get_lower_byte(emu)
-            emu.register[ get_reg1(emu) ] &= 0xFF
-        elif 'reg' is arg2:
-            emu.register[ get_reg1(emu) ] = get_reg1_val(emu) + get_reg2_val(emu)
-            emu.register[0xF] = 0x01 if emu.register[ get_reg1(emu) ] > 0xFF else 0x00
-            emu.register[ get_reg1(emu) ] &= 0xFF
-        else:
-            emu.log("Unknown argument at address " + hex(emu.program_counter), EmulationError._Fatal)
-
-    elif 'i' in arg1 and 'reg' is arg2:
-        emu.index_register += get_reg1_val(emu)
-        if (emu.index_register > 0xFF) and SET_VF_ON_GFX_OVERFLOW:
-            emu.register[0xF] = 0x01
-        emu.index_register &= 0xFFF
-
-    else:
-        emu.log("Unknown argument at address " + hex(emu.program_counter), EmulationError._Fatal)
-
-def i_ld(emu):
-    arg1 = emu.dis_ins.mnemonic_arg_types[0]
-    arg2 = emu.dis_ins.mnemonic_arg_types[1]
-
-    if 'reg' is arg1:
-        if   'byte'     is arg2:
-            emu.register[ get_reg1(emu) ] = get_lower_byte(emu)
-        elif 'reg' is arg2:
-            emu.register[ get_reg1(emu) ] = get_reg2_val(emu)
-        elif 'dt'       is arg2:
-            emu.register[ get_reg1(emu) ] = emu.delay_timer_register
-        elif 'k'        is arg2:
-            emu.waiting_for_key = True
-            emu.program_counter -= 2
-        elif '[i]' == arg2:
-            emu.register[0: get_reg1(emu) + 1] = emu.ram[ emu.index_register : emu.index_register + get_reg1(emu) + 1]
-        else:
-            emu.log("Loads with second argument type '" + arg2 + \
-                "' are not supported.", EmulationError._Fatal)
-
-    elif 'reg' is arg2:
-        if   'dt' is arg1:
-            emu.delay_timer_register =  get_reg1_val(emu)
-        elif 'st' is arg1:
-            emu.sound_timer_register =  get_reg1_val(emu)
-        elif 'f'  is arg1:
-            emu.index_register = GFX_FONT_ADDRESS + ( 5 * get_reg1_val(emu) )
-        elif 'b'  is arg1:
-            bcd = [int(f) for f in list(str( get_reg1_val(emu) ).zfill(3))]
-            emu.ram[ emu.index_register : emu.index_register + len(bcd)] = bcd
-        elif '[i]' == arg1:
-            emu.ram[ emu.index_register : emu.index_register + get_reg1(emu) + 1] = emu.register[0: get_reg1(emu) + 1]
-        else:
-            emu.log("Unknown argument at address " + hex(emu.program_counter), EmulationError._Fatal)
-
-    elif 'i' is arg1 and 'addr' is arg2:
-        emu.index_register =  get_address(emu)
-
-    else:
-        emu.log("Unknown argument at address " + hex(emu.program_counter), EmulationError._Fatal)
-
-def i_drw(emu):
+def i_rnd(emu, ins):
+    emu.register[ins.x] = emu.rng.randint(0, 255) & ins.kk
+
+def i_add_byte(emu, ins):
+    emu.register[ins.x] = (emu.register[ins.x] + ins.kk) & 0xFF
+
+def i_add_reg(emu, ins):
+    total = emu.register[ins.x] + emu.register[ins.y]
+    emu.register[ins.x] = total & 0xFF
+    emu.register[0xF] = 0x01 if total > 0xFF else 0x00
+
+def i_add_i(emu, ins):
+    emu.index_register = (emu.index_register + emu.register[ins.x]) & 0xFFF
+
+def i_ld_byte(emu, ins):
+    emu.register[ins.x] = ins.kk
+
+def i_ld_reg(emu, ins):
+    emu.register[ins.x] = emu.register[ins.y]
+
+def i_ld_get_dt(emu, ins):
+    emu.register[ins.x] = emu.delay_timer_register
+
+def i_ld_k(emu, ins):
+    emu.waiting_for_key = True
+    emu.program_counter -= 2
+
+def i_ld_read(emu, ins):
+    if emu.index_register + ins.x >= BYTES_OF_RAM:
+        emu.log(LOG_READ_PAST_RAM, EmulationError._Fatal)
+        return
+    emu.register[0: ins.x + 1] = emu.ram[ emu.index_register : emu.index_register + ins.x + 1]
+
+def i_ld_i(emu, ins):
+    emu.index_register = ins.nnn
+
+def i_ld_set_dt(emu, ins):
+    emu.delay_timer_register = emu.register[ins.x]
+
+def i_ld_set_st(emu, ins):
+    emu.sound_timer_register = emu.register[ins.x]
+
+def i_ld_f(emu, ins):
+    emu.index_register = GFX_FONT_ADDRESS + ( 5 * emu.register[ins.x] )
+
+def i_ld_b(emu, ins):
+    if emu.index_register + 2 >= BYTES_OF_RAM:
+        emu.log(LOG_BCD_PAST_RAM, EmulationError._Fatal)
+        return
+    val = emu.register[ins.x]
+    emu.ram[ emu.index_register : emu.index_register + 3] = bytes((val // 100, val // 10 % 10, val % 10))
+
+def i_ld_write(emu, ins):
+    if emu.index_register + ins.x >= BYTES_OF_RAM:
+        emu.log(LOG_STORE_PAST_RAM, EmulationError._Fatal)
+        return
+    emu.ram[ emu.index_register : emu.index_register + ins.x + 1] = emu.register[0: ins.x + 1]
+
+def i_drw(emu, ins):
+    if emu.index_register + ins.n > BYTES_OF_RAM:
+        emu.log(LOG_PAST_RAM, EmulationError._Fatal, emu.program_counter)
+        return
     emu.draw_flag = True
-    height = int(emu.dis_ins.hex_instruction[3],16)
-    x_origin_byte = int( get_reg1_val(emu) / 8 ) % GFX_WIDTH
-    y_origin_byte = (get_reg2_val(emu) % GFX_HEIGHT_PX) * GFX_WIDTH
-    shift_amount = get_reg1_val(emu) % GFX_WIDTH_PX % 8
-    next_byte_offset = 1 if x_origin_byte + 1 != GFX_WIDTH else 1-GFX_WIDTH
+    erased = draw_sprite(emu, emu.register[ins.x] % GFX_WIDTH_PX, emu.register[ins.y] % GFX_HEIGHT_PX,
+                         ins.n, False)
+    emu.register[0xF] = 0x01 if erased else 0x00
+
+def draw_sprite(emu, x, y, height, clip):
+    '''
+    XORs the height byte sprite at I into the screen at x,y, all its rows
+    at once when it is cached. Returns the set pixels that were erased.
+    Rows past the end of RAM are never read, the handlers log those.
+    '''
+    sprite = emu.sprites.block(emu.ram, emu.index_register, height, x, clip)
+    if sprite is not None:
+        return xor_rows(emu.gfx, sprite, y, height)
+    erased = 0
+    for address in range(emu.index_register, min(emu.index_register + height, BYTES_OF_RAM)):
+        erased |= xor_rows(emu.gfx, sprite_row(emu.ram[address], x, clip), y, 1)
+        y = (y + 1) % GFX_HEIGHT_PX
+    return erased
+
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+# Quirks, the handlers swapped in by a quirk profile
 
+def i_shl_vy(emu, ins):
+    emu.register[0xF] = 0x01 if emu.register[ins.y] >= 0x80 else 0x0
+    emu.register[ins.x] = ( emu.register[ins.y] << 1 ) & 0xFF
+
+def i_shr_vy(emu, ins):
+    emu.register[0xF] = emu.register[ins.y] & 0x01
+    emu.register[ins.x] = emu.register[ins.y] >> 1
+
+def i_ld_read_increment(emu, ins):
+    i_ld_read(emu, ins)
+    emu.index_register = (emu.index_register + ins.x + 1) & 0xFFF
+
+def i_ld_write_increment(emu, ins):
+    i_ld_write(emu, ins)
+    emu.index_register = (emu.index_register + ins.x + 1) & 0xFFF
+
+def i_jp_vx(emu, ins):
+    init_pc = emu.program_counter
+    emu.program_counter = ins.nnn + emu.register[ins.x] - 2
+    if init_pc == emu.program_counter + 2:
+        emu.spinning = True
+
+def i_or_vf_reset(emu, ins):
+    emu.register[ins.x] |= emu.register[ins.y]
     emu.register[0xF] = 0x00
-    for y in range(height):
-        sprite =  emu.ram[ emu.index_register + y ] << (8-shift_amount)
 
-        working_bytes = (
-            GFX_ADDRESS + (( x_origin_byte + y_origin_byte + (y * GFX_WIDTH) ) % GFX_RESOLUTION) ,
-            GFX_ADDRESS + (( x_origin_byte + y_origin_byte + (y * GFX_WIDTH) + next_byte_offset ) % GFX_RESOLUTION)
-        )
+def i_and_vf_reset(emu, ins):
+    emu.register[ins.x] &= emu.register[ins.y]
+    emu.register[0xF] = 0x00
+
+def i_xor_vf_reset(emu, ins):
+    emu.register[ins.x] ^= emu.register[ins.y]
+    emu.register[0xF] = 0x00
 
-        original = ( emu.ram[ working_bytes[0] ], emu.ram[ working_bytes[1] ] )
-        xor = (original[0]*256 + original[1]) ^ sprite
-        emu.ram[ working_bytes[0] ], emu.ram[ working_bytes[1] ] = xor >> 8, xor & 0x00FF
+def i_drw_clip(emu, ins):
+    y = emu.register[ins.y] % GFX_HEIGHT_PX
+    height = min(ins.n, GFX_HEIGHT_PX - y)
+    if emu.index_register + height > BYTES_OF_RAM:
+        emu.log(LOG_PAST_RAM, EmulationError._Fatal, emu.program_counter)
+        return
+    emu.draw_flag = True
+    erased = draw_sprite(emu, emu.register[ins.x] % GFX_WIDTH_PX, y, height, True)
+    emu.register[0xF] = 0x01 if erased else 0x00
 
-        if (bin( ( emu.ram[ working_bytes[0] ] ^ original[0] ) & original[0] ) + \
-            bin( ( emu.ram[ working_bytes[1] ] ^ original[1] ) & original[1] )).find('1') != -1:
-            emu.register[0xF] = 0x01
+def i_add_i_overflow(emu, ins):
+    emu.index_register += emu.register[ins.x]
+    if emu.index_register > 0xFF:
+        emu.register[0xF] = 0x01
+    emu.index_register &= 0xFFF
 
 # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
-# Hex Extraction
+# Platforms, the Super Chip-8 and XO-Chip instructions. The screen is the
+# emulator's Framebuffer rather than the RAM at GFX_ADDRESS. On the chip8
+# platform their opcodes are errors.
 
-def get_address(emu):
-    return int(emu.dis_ins.hex_instruction[1:4], 16)
+def i_super8(emu, ins):
+    emu.log(LOG_SUPER8, EmulationError._Fatal, ins.opcode, emu.program_counter)
 
-def get_reg1(emu):
-    return int(emu.dis_ins.hex_instruction[1],16)
+def i_unknown(emu, ins):
+    emu.log(LOG_UNKNOWN, EmulationError._Fatal, ins.opcode, emu.program_counter)
 
-def get_reg2(emu):
-    return int(emu.dis_ins.hex_instruction[2],16)
+def i_cls_screen(emu, ins):
+    emu.framebuffer.clear()
+    emu.draw_flag = True
 
-def get_reg1_val(emu):
-    return emu.register[int(emu.dis_ins.hex_instruction[1],16)]
+def sprite_length(emu, ins):
+    '''
+    Bytes of sprite data read by drw, drw vx,vy,0 draws 16x16 sprites. The
+    data for each selected plane follows the last.
+    '''
+    return (32 if ins.n == 0 else ins.n) * len(emu.framebuffer.active)
+
+def i_drw_screen(emu, ins):
+    end = emu.index_register + sprite_length(emu, ins)
+    if end > BYTES_OF_RAM:
+        emu.log(LOG_PAST_RAM, EmulationError._Fatal, emu.program_counter)
+        return
+    emu.draw_flag = True
+    emu.register[0xF] = emu.framebuffer.draw( emu.ram[emu.index_register:end],
+        emu.register[ins.x], emu.register[ins.y], 16 if ins.n == 0 else ins.n, 16 if ins.n == 0 else 8 )
 
-def get_reg2_val(emu):
-    return emu.register[int(emu.dis_ins.hex_instruction[2],16)]
+def i_scd(emu, ins):
+    emu.framebuffer.scroll_down(ins.n)
+    emu.draw_flag = True
 
-def get_lower_byte(emu):
-    return int(emu.dis_ins.hex_instruction[2:4], 16)
+def i_scu(emu, ins):
+    emu.framebuffer.scroll_up(ins.n)
+    emu.draw_flag = True
 
+def i_scr(emu, ins):
+    emu.framebuffer.scroll_right(4)
+    emu.draw_flag = True
+
+def i_scl(emu, ins):
+    emu.framebuffer.scroll_left(4)
+    emu.draw_flag = True
+
+def i_exit(emu, ins):
+    emu.spinning = True
+    emu.program_counter -= 2
+
+def i_low(emu, ins):
+    emu.framebuffer.set_resolution(False)
+    emu.draw_flag = True
+
+def i_high(emu, ins):
+    emu.framebuffer.set_resolution(True)
+    emu.draw_flag = True
 
+def i_ld_hf(emu, ins):
+    emu.index_register = GFX_BIG_FONT_ADDRESS + ( 10 * (emu.register[ins.x] & 0xF) )
+
+def i_ld_set_r(emu, ins):
+    emu.rpl[0: ins.x + 1] = emu.register[0: ins.x + 1]
+
+def i_ld_get_r(emu, ins):
+    emu.register[0: ins.x + 1] = emu.rpl[0: ins.x + 1]
+
+def i_save(emu, ins):
+    step = 1 if ins.x <= ins.y else -1
+    if emu.index_register + abs(ins.y - ins.x) >= BYTES_OF_RAM:
+        emu.log(LOG_STORE_PAST_RAM, EmulationError._Fatal)
+        return
+    for offset, r in enumerate(range(ins.x, ins.y + step, step)):
+        emu.ram[emu.index_register + offset] = emu.register[r]
+
+def i_load(emu, ins):
+    step = 1 if ins.x <= ins.y else -1
+    if emu.index_register + abs(ins.y - ins.x) >= BYTES_OF_RAM:
+        emu.log(LOG_READ_PAST_RAM, EmulationError._Fatal)
+        return
+    for offset, r in enumerate(range(ins.x, ins.y + step, step)):
+        emu.register[r] = emu.ram[emu.index_register + offset]
+
+def i_long(emu, ins):
+    if emu.program_counter + 4 > BYTES_OF_RAM:
+        emu.log(LOG_PAST_RAM, EmulationError._Fatal, emu.program_counter)
+        return
+    emu.program_counter += 2
+    emu.index_register = ( (emu.ram[emu.program_counter] << 8) | emu.ram[emu.program_counter + 1] ) & 0xFFF
+
+def i_plane(emu, ins):
+    emu.framebuffer.select(ins.x & 0x3)
+
+def i_audio(emu, ins):
+    if emu.index_register + len(emu.audio_pattern) > BYTES_OF_RAM:
+        emu.log(LOG_READ_PAST_RAM, EmulationError._Fatal)
+        return
+    emu.audio_pattern[:] = emu.ram[ emu.index_register : emu.index_register + len(emu.audio_pattern) ]
+
+def i_pitch(emu, ins):
+    emu.pitch = emu.register[ins.x]
+
+def skips_long(handler):
+    '''
+    Wraps a skip so it also steps over the address of a long instruction.
+    '''
+    def skip(emu, ins):
+        pc = emu.program_counter
+        handler(emu, ins)
+        if emu.program_counter != pc and emu.program_counter + 1 < BYTES_OF_RAM and \
+           emu.ram[emu.program_counter] == 0xF0 and emu.ram[emu.program_counter + 1] == 0x00:
+            emu.program_counter += 2
+    return skip
+
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+# Uninitialized RAM tracking, wrapped around the handlers when the RAM is
+# not zeroed. I is read before the handler runs, it may move I.
+
+def tracked_read(handler):
+    def read(emu, ins):
+        if emu.ram_unset(emu.index_register, ins.x + 1):
+            emu.log(LOG_UNSET_LOAD, EmulationError._Fatal, emu.index_register)
+            return
+        handler(emu, ins)
+    return read
+
+def tracked_bcd(handler):
+    def bcd(emu, ins):
+        index = emu.index_register
+        handler(emu, ins)
+        emu.mark_ram(index, 3)
+    return bcd
+
+def tracked_write(handler):
+    def write(emu, ins):
+        index = emu.index_register
+        handler(emu, ins)
+        emu.mark_ram(index, ins.x + 1)
+    return write
+
+def tracked_save(handler):
+    def save(emu, ins):
+        index = emu.index_register
+        handler(emu, ins)
+        emu.mark_ram(index, abs(ins.y - ins.x) + 1)
+    return save
+
+def tracked_load(handler):
+    def load(emu, ins):
+        if emu.ram_unset(emu.index_register, abs(ins.y - ins.x) + 1):
+            emu.log(LOG_UNSET_LOAD, EmulationError._Fatal, emu.index_register)
+            return
+        handler(emu, ins)
+    return load
+
+def tracked_drw(handler):
+    def drw(emu, ins):
+        if emu.ram_unset(emu.index_register, ins.n):
+            emu.log(LOG_UNSET_SPRITE, EmulationError._Fatal, emu.index_register)
+            return
+        handler(emu, ins)
+    return drw
+
+def tracked_sprite(handler):
+    def drw(emu, ins):
+        if emu.ram_unset(emu.index_register, sprite_length(emu, ins)):
+            emu.log(LOG_UNSET_SPRITE, EmulationError._Fatal, emu.index_register)
+            return
+        handler(emu, ins)
+    return drw
+
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+# Unofficial instruction warning, wrapped around the handlers of
+# UNOFFICIAL_OP_CODES when err_unoffical is set. Banned versions that
+# write VF share the handlers and are not warned about.
+
+def warned(handler, error_type):
+    def warn(emu, ins):
+        if ins.unoffical_op:
+            emu.log(LOG_UNOFFICIAL, error_type, ins.mnemonic, emu.program_counter)
+        handler(emu, ins)
+    return warn
+
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+# Dispatch
+
+# Handler for each version of each mnemonic, keyed by the OP_CODES hex template
+HANDLERS = {
+    '00E0':i_cls,      '00EE':i_ret,     '0xxx':i_sys,       '2xxx':i_call,
+    'Ex9E':i_skp,      'ExA1':i_sknp,    '3xyy':i_se_byte,   '5xy0':i_se_reg,
+    '4xyy':i_sne_byte, '9xy0':i_sne_reg, '7xyy':i_add_byte,  '8xy4':i_add_reg,
+    'Fy1E':i_add_i,    '8xy1':i_or,      '8xy2':i_and,       '8xy3':i_xor,
+    '8xy5':i_sub,      '8xy7':i_subn,    '8x06':i_shr,       '8xy6':i_shr,
+    '8x0E':i_shl,      '8xyE':i_shl,     'Cxyy':i_rnd,       'Byyy':i_jp_v0,
+    '1xxx':i_jp,       '6xyy':i_ld_byte, '8xy0':i_ld_reg,    'Fx07':i_ld_get_dt,
+    'Fx0A':i_ld_k,     'Fx65':i_ld_read, 'Ayyy':i_ld_i,      'Fy15':i_ld_set_dt,
+    'Fy18':i_ld_set_st,'Fy29':i_ld_f,    'Fy33':i_ld_b,      'Fy55':i_ld_write,
+    'Dxyz':i_drw }
+
+# Handlers replaced when a Quirks field is on, keyed by the field
+QUIRK_HANDLERS = {
+    'shift_vy':       {'8x06':i_shr_vy, '8xy6':i_shr_vy, '8x0E':i_shl_vy, '8xyE':i_shl_vy},
+    'load_increment': {'Fx65':i_ld_read_increment, 'Fy55':i_ld_write_increment},
+    'jump_vx':        {'Byyy':i_jp_vx},
+    'vf_reset':       {'8xy1':i_or_vf_reset, '8xy2':i_and_vf_reset, '8xy3':i_xor_vf_reset},
+    'clip_sprites':   {'Dxyz':i_drw_clip},
+    'index_overflow': {'Fy1E':i_add_i_overflow} }
+
+# Handlers of each platform, applied over the quirk handlers. Chip8 keeps
+# the instructions of the others as errors.
+PLATFORM_HANDLERS = {
+    'chip8':  dict( [ (k, i_super8) for k in SUPER_CHIP_OP_CODES ] +
+                    [ (k, i_unknown) for k in XO_CHIP_OP_CODES ] ),
+    'schip':  dict( [ (k, i_unknown) for k in XO_CHIP_OP_CODES ] ),
+    'xochip': {} }
+
+SCREEN_HANDLERS = {
+    '00E0':i_cls_screen, 'Dxyz':i_drw_screen, 'Dxy0':i_drw_screen, '00Cx':i_scd,
+    '00Dx':i_scu,        '00FB':i_scr,        '00FC':i_scl,        '00FD':i_exit,
+    '00FE':i_low,        '00FF':i_high,       'Fy30':i_ld_hf,      'Fy75':i_ld_set_r,
+    'Fx85':i_ld_get_r,   '5xy2':i_save,       '5xy3':i_load,       'F000':i_long,
+    'Fx01':i_plane,      'F002':i_audio,      'Fx3A':i_pitch }
+
+# Skips that step over a long instruction on the XO-Chip
+LONG_SKIPS = ('3xyy', '4xyy', '5xy0', '9xy0', 'Ex9E', 'ExA1')
+
+TRACKED_HANDLERS = {
+    'Fx65':tracked_read, 'Fy33':tracked_bcd,
+    'Fy55':tracked_write, 'Dxyz':tracked_drw }
+
+# Replacements of the above on each platform
+TRACKED_PLATFORM_HANDLERS = {
+    'chip8':  {},
+    'schip':  {'Dxyz':tracked_sprite, 'Dxy0':tracked_sprite},
+    'xochip': {'Dxyz':tracked_sprite, 'Dxy0':tracked_sprite,
+               '5xy2':tracked_save,   '5xy3':tracked_load} }
+
+def quirk_handlers(quirks):
+    '''
+    HANDLERS with the replacements of every Quirks field that is on.
+    '''
+    handlers = dict(HANDLERS)
+    for field, on in zip(Quirks._fields, quirks):
+        if on:
+            handlers.update(QUIRK_HANDLERS[field])
+    return handlers
+
+def platform_handlers(quirks, platform=DEFAULT_PLATFORM):
+    '''
+    quirk_handlers() for quirks with the handlers of platform, one of
+    PLATFORMS, applied over them.
+    '''
+    handlers = quirk_handlers(quirks)
+    if platform != 'chip8':
+        handlers.update(SCREEN_HANDLERS)
+    handlers.update(PLATFORM_HANDLERS[platform])
+    if platform == 'xochip':
+        for hex_template in LONG_SKIPS:
+            handlers[hex_template] = skips_long(handlers[hex_template])
+    return handlers
+
+def build_dispatch_table(track_ram=False, quirks=QUIRK_PROFILES[DEFAULT_QUIRK_PROFILE], warn_unofficial=None,
+                         platform=DEFAULT_PLATFORM):
+    '''
+    List of handlers indexed by Instruction.variant, slot zero is unused.
+    The handlers are picked for quirks, a Quirks, and platform. With
+    track_ram the handlers that touch [i] also check and update the
+    emulator's ram_init_map, with warn_unofficial, an EmulationError,
+    unofficial instructions are logged at that level.
+    '''
+    handlers = platform_handlers(quirks, platform)
+    if track_ram:
+        tracked = dict(TRACKED_HANDLERS)
+        tracked.update(TRACKED_PLATFORM_HANDLERS[platform])
+        for hex_template, wrap in tracked.items():
+            handlers[hex_template] = wrap(handlers[hex_template])
+    table = [None] * (len(VARIANT_IDS) + 1)
+    for hex_template, variant in VARIANT_IDS.items():
+        table[variant] = handlers[hex_template]
+    if warn_unofficial:
+        for variant, (mnemonic, _) in enumerate(OP_VARIANTS, 1):
+            if mnemonic in UNOFFICIAL_OP_CODES:
+                table[variant] = warned(table[variant], warn_unofficial)
+    return table
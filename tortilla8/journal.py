@@ -0,0 +1,156 @@
+#!/usr/bin/env python3
+
+from struct import Struct
+from .constants.opcodes import OP_VARIANTS
+from .constants.reg_rom_stack import BYTES_OF_RAM, STACK_ADDRESS
+from .constants.graphics import GFX_ADDRESS, GFX_RESOLUTION, GFX_WIDTH, GFX_HEIGHT_PX
+
+# Undo log used for rewinding. Each executed instruction appends a frame
+# holding the old value of every byte it changed plus the scalar state from
+# before it ran:
+#
+#   count (2) | count entries of loc (2), old value (1) | footer (12)
+#
+# Locations below BYTES_OF_RAM are RAM, then come the registers and the two
+# bytes of each stack slot. The footer ends with the entry count again so
+# frames can be walked from either end of the ring buffer.
+
+LOC_REGISTER = BYTES_OF_RAM
+LOC_STACK    = BYTES_OF_RAM + 16
+
+HEADER = Struct('>H')
+ENTRY  = Struct('>HB')
+FOOTER = Struct('>HHHBBBBH') # pc, calling pc, i, dt, st, sp, flags, count
+
+FLAG_DRAW, FLAG_WAITING, FLAG_SPINNING = 0x01, 0x02, 0x04
+
+class RewindJournal:
+    '''
+    Ring buffer of undo frames limited to budget bytes. The oldest frames
+    are dropped to make room for new ones.
+    '''
+    def __init__(self, budget):
+        self.budget = budget
+        self.buffer = bytearray(budget)
+        self.head   = 0 # Next byte to write
+        self.tail   = 0 # Start of the oldest frame
+        self.used   = 0
+        self.frames = 0
+
+    def __len__(self):
+        return self.frames
+
+    def record(self, entries, count, footer):
+        '''
+        Appends a frame. entries is the packed entry data, footer the
+        values for FOOTER without the count.
+        '''
+        frame = HEADER.pack(count) + entries + FOOTER.pack(*footer, count)
+        if len(frame) > self.budget:
+            self.clear()
+            return
+        while self.used + len(frame) > self.budget:
+            self.drop_oldest()
+        self.write(self.head, frame)
+        self.head = (self.head + len(frame)) % self.budget
+        self.used += len(frame)
+        self.frames += 1
+
+    def pop(self):
+        '''
+        Removes the newest frame and returns (entries, footer) or None.
+        Entries are returned newest first, the order they must be undone in.
+        '''
+        if not self.frames:
+            return None
+        footer = FOOTER.unpack(self.read(self.head - FOOTER.size, FOOTER.size))
+        count = footer[-1]
+        size = HEADER.size + count * ENTRY.size + FOOTER.size
+        entries = self.read(self.head - size + HEADER.size, count * ENTRY.size)
+        self.head = (self.head - size) % self.budget
+        self.used -= size
+        self.frames -= 1
+        return reversed(list(ENTRY.iter_unpack(entries))), footer
+
+    def drop_oldest(self):
+        count, = HEADER.unpack(self.read(self.tail, HEADER.size))
+        size = HEADER.size + count * ENTRY.size + FOOTER.size
+        self.tail = (self.tail + size) % self.budget
+        self.used -= size
+        self.frames -= 1
+
+    def clear(self):
+        self.head = self.tail = self.used = self.frames = 0
+
+    def write(self, pos, data):
+        first = min(len(data), self.budget - pos)
+        self.buffer[pos:pos + first] = data[:first]
+        self.buffer[:len(data) - first] = data[first:]
+
+    def read(self, pos, length):
+        pos %= self.budget
+        first = min(length, self.budget - pos)
+        return bytes(self.buffer[pos:pos + first]) + bytes(self.buffer[:length - first])
+
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+# Write sets, what each instruction may change besides the footer values.
+# Each returns (register indices, RAM addresses, stack slot or None).
+
+NOTHING = ((), (), None)
+
+def regs_x(emu, ins):
+    return (ins.x,), (), None
+
+def regs_x_vf(emu, ins):
+    return (ins.x, 0xF), (), None
+
+def regs_to_x(emu, ins):
+    return range(ins.x + 1), (), None
+
+def regs_vf(emu, ins):
+    return (0xF,), (), None
+
+def ram_bcd(emu, ins):
+    return (), range(emu.index_register, min(emu.index_register + 3, BYTES_OF_RAM)), None
+
+def ram_to_x(emu, ins):
+    return (), range(emu.index_register, min(emu.index_register + ins.x + 1, BYTES_OF_RAM)), None
+
+def regs_x_to_y(emu, ins):
+    return range(min(ins.x, ins.y), max(ins.x, ins.y) + 1), (), None
+
+def ram_x_to_y(emu, ins):
+    return (), range(emu.index_register, min(emu.index_register + abs(ins.y - ins.x) + 1, BYTES_OF_RAM)), None
+
+def ram_gfx(emu, ins):
+    return (), range(GFX_ADDRESS, GFX_ADDRESS + GFX_RESOLUTION), None
+
+def ram_sprite(emu, ins):
+    x_origin_byte = ( emu.register[ins.x] // 8 ) % GFX_WIDTH
+    y_origin_byte = ( emu.register[ins.y] % GFX_HEIGHT_PX ) * GFX_WIDTH
+    next_byte_offset = 1 if x_origin_byte + 1 != GFX_WIDTH else 1-GFX_WIDTH
+    addresses = []
+    for y in range(ins.n):
+        offset = x_origin_byte + y_origin_byte + (y * GFX_WIDTH)
+        addresses.append( GFX_ADDRESS + offset % GFX_RESOLUTION )
+        addresses.append( GFX_ADDRESS + (offset + next_byte_offset) % GFX_RESOLUTION )
+    return (0xF,), addresses, None
+
+def stack_push(emu, ins):
+    if emu.stack_pointer >= len(emu.stack):
+        return NOTHING
+    addresses = () if not STACK_ADDRESS else \
+        range(STACK_ADDRESS + 2 * emu.stack_pointer, STACK_ADDRESS + 2 * emu.stack_pointer + 2)
+    return (), addresses, emu.stack_pointer
+
+WRITE_SETS_BY_TEMPLATE = {
+    '00E0':ram_gfx,    '2xxx':stack_push, '7xyy':regs_x,    '8xy4':regs_x_vf,
+    'Fy1E':regs_vf,    '8xy1':regs_x_vf,  '8xy2':regs_x_vf, '8xy3':regs_x_vf,
+    '8xy5':regs_x_vf,  '8xy7':regs_x_vf,  '8x06':regs_x_vf, '8xy6':regs_x_vf,
+    '8x0E':regs_x_vf,  '8xyE':regs_x_vf,  'Cxyy':regs_x,    '6xyy':regs_x,
+    '8xy0':regs_x,     'Fx07':regs_x,     'Fx65':regs_to_x, 'Fy33':ram_bcd,
+    'Fy55':ram_to_x,   'Dxyz':ram_sprite, 'Dxy0':regs_vf,   'Fx85':regs_to_x,
+    '5xy2':ram_x_to_y, '5xy3':regs_x_to_y }
+
+# Write set functions indexed by Instruction.variant, slot zero is unused
+WRITE_SETS = [None] + [ WRITE_SETS_BY_TEMPLATE.get(opdata.hex) for _,opdata in OP_VARIANTS ]
@@ -0,0 +1,216 @@
+#!/usr/bin/env python3
+
+from . import export
+from io import StringIO, BytesIO
+from random import Random
+from .blackbean import Blackbean
+from .guacamole import Guacamole
+from .savestate import pack_state
+from .constants.reg_rom_stack import STACK_SIZE, PROGRAM_BEGIN_ADDRESS
+__all__ = []
+
+# Operations mixed into ALU loops, none of them write VF themselves
+ALU_OPS = ('add {0}, {1}', 'or {0}, {1}', 'and {0}, {1}', 'xor {0}, {1}',
+           'sub {0}, {1}', 'subn {0}, {1}', 'shr {0}', 'shl {0}', 'ld {0}, {1}',
+           'add {0}, #{2}')
+
+@export
+class Masa:
+    '''
+    Masa generates synthetic CHIP-8 programs for benchmarking and parity
+    testing. Each workload is built from its parameters, see WORKLOADS for
+    the workloads and their defaults, and loops forever so it can be run
+    for any number of cycles. The assembly is kept in source and can be
+    assembled with Blackbean in memory.
+    '''
+    def __init__(self, workload, **params):
+        if workload not in WORKLOADS:
+            raise RuntimeError("Unknown workload '" + workload + "'")
+        generator, defaults = WORKLOADS[workload]
+        for name in params:
+            if name not in defaults:
+                raise RuntimeError("Unknown parameter '" + name + "' for workload '" + workload + "'")
+        self.workload = workload
+        self.params = dict(defaults)
+        self.params.update(params)
+        self.source = '\n'.join( generator(**self.params) ) + '\n'
+
+    def assemble(self):
+        '''
+        Returns the program as ROM bytes.
+        '''
+        bean = Blackbean()
+        bean.assemble( StringIO(self.source) )
+        out = BytesIO()
+        bean.export_binary(out)
+        return out.getvalue()
+
+    def export_source(self, file_handler):
+        file_handler.write(self.source)
+
+    def export_binary(self, file_handler):
+        file_handler.write( self.assemble() )
+
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+# Workloads, each returns a list of lines of assembly
+
+def check_range(name, value, low, high):
+    if not low <= value <= high:
+        raise RuntimeError("Parameter '" + name + "' must be from " + str(low) + " to " + str(high))
+
+def reg(r):
+    return 'v' + hex(r)[2:]
+
+def alu_loop(length, registers, seed):
+    '''
+    Tight loop of length ALU instructions over v0 to the given number of
+    registers, picked by seed.
+    '''
+    check_range('length', length, 1, 1000)
+    check_range('registers', registers, 2, 15)
+    rng = Random(seed)
+    lines = ['; ALU loop, ' + str(length) + ' instructions', 'loop:']
+    for _ in range(length):
+        x, y = rng.sample(range(registers), 2)
+        lines.append( '    ' + rng.choice(ALU_OPS).format(reg(x), reg(y), hex(rng.randrange(1, 0x100))[2:].zfill(2)) )
+    lines.append('    jp loop')
+    return lines
+
+def sprite_storm(sprites, height, step):
+    '''
+    Draws sprites sprites of the given height per loop, moving each by step
+    pixels so every shift within a byte is drawn.
+    '''
+    check_range('sprites', sprites, 1, 200)
+    check_range('height', height, 1, 15)
+    check_range('step', step, 1, 0xFF)
+    lines = ['; Sprite storm, ' + str(sprites) + ' sprites of ' + str(height) + ' rows',
+             '    ld i, sprite', 'loop:']
+    for s in range(sprites):
+        lines.append( '    add v0, #' + hex(step)[2:].zfill(2) )
+        lines.append( '    add v1, #' + hex(s % 7 + 1)[2:].zfill(2) )
+        lines.append( '    drw v0, v1, ' + str(height) )
+    lines.append('    jp loop')
+    lines.append('sprite:')
+    lines.append( '    db ' + ', '.join( '#' + hex((0xA5 << (r % 8) | 0xA5 >> (8 - r % 8)) & 0xFF)[2:].zfill(2)
+                                         for r in range(height) ) )
+    return lines
+
+def call_recursion(depth, calls):
+    '''
+    Recurses depth calls deep, calls times per loop.
+    '''
+    check_range('depth', depth, 1, STACK_SIZE - 1)
+    check_range('calls', calls, 1, 200)
+    lines = ['; Call recursion, ' + str(calls) + ' times ' + str(depth) + ' deep', 'loop:']
+    for _ in range(calls):
+        lines.append( '    ld v0, ' + str(depth) )
+        lines.append( '    call recurse' )
+    lines += ['    jp loop',
+              'recurse:',
+              '    sne v0, 0',
+              '    ret',
+              '    add v0, #ff',
+              '    call recurse',
+              '    ret']
+    return lines
+
+def memory_traffic(stores, registers):
+    '''
+    Per loop, stores times a BCD conversion and a store and load of
+    registers registers through I.
+    '''
+    check_range('stores', stores, 1, 200)
+    check_range('registers', registers, 1, 15)
+    last = reg(registers - 1)
+    lines = ['; Memory traffic, ' + str(stores) + ' stores of ' + str(registers) + ' registers', 'loop:']
+    for s in range(stores):
+        lines.append( '    add ' + reg(s % registers) + ', #' + hex(s % 0xFF + 1)[2:].zfill(2) )
+        lines.append( '    ld i, buffer' )
+        lines.append( '    ld b, ' + reg(s % registers) )
+        lines.append( '    ld [i], ' + last )
+        lines.append( '    ld ' + last + ', [i]' )
+    lines.append('    jp loop')
+    lines.append('buffer:')
+    lines.append( '    db ' + ', '.join( ['#00'] * 16 ) )
+    return lines
+
+def self_modifying(patches):
+    '''
+    Loop that rewrites the immediate of patches of its own add instructions
+    every time around.
+    '''
+    check_range('patches', patches, 1, 100)
+    lines = ['; Self modifying code, ' + str(patches) + ' patched instructions', 'loop:']
+    for p in range(patches):
+        lines.append( '    ld i, patch' + str(p) )
+        lines.append( '    ld v1, [i]' )
+        lines.append( '    add v1, #' + hex(p % 0x0F + 1)[2:].zfill(2) )
+        lines.append( '    ld [i], v1' )
+        lines.append( 'patch' + str(p) + ':' )
+        lines.append( '    add ' + reg(p % 13 + 2) + ', #01' )
+    lines.append('    jp loop')
+    return lines
+
+def timer_wait(frames, work):
+    '''
+    Per loop, work ALU instructions then a wait of frames delay timer ticks
+    polling the timer with ld vx,dt / se vx,0 / jp back.
+    '''
+    check_range('frames', frames, 1, 0xFF)
+    check_range('work', work, 0, 200)
+    lines = ['; Timer wait, ' + str(work) + ' instructions then ' + str(frames) + ' frames', 'loop:']
+    for w in range(work):
+        lines.append( '    add ' + reg(w % 13 + 1) + ', #01' )
+    lines += ['    ld v0, ' + str(frames),
+              '    ld dt, v0',
+              'wait:',
+              '    ld ve, dt',
+              '    se ve, 0',
+              '    jp wait',
+              '    jp loop']
+    return lines
+
+# Workload generators and their default parameters
+WORKLOADS = {
+    'alu':     (alu_loop,       {'length':64, 'registers':8, 'seed':0}),
+    'sprites': (sprite_storm,   {'sprites':16, 'height':8, 'step':5}),
+    'calls':   (call_recursion, {'depth':8, 'calls':4}),
+    'memory':  (memory_traffic, {'stores':8, 'registers':8}),
+    'selfmod': (self_modifying, {'patches':4}),
+    'timer':   (timer_wait,     {'frames':2, 'work':16}),
+}
+
+# Workloads that spend most of their time in busy waits run_cycles() skips
+WAITING_WORKLOADS = ('timer',)
+
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+# Checks
+
+# How often, in CPU cycles, fast_forward_check() compares the two emulators
+CHECK_CYCLES = 1000
+
+@export
+def fast_forward_check(workload, cycles, cpuhz=200, **params):
+    '''
+    Runs a workload for cycles with busy waits skipped and with every cycle
+    executed, comparing the two states every CHECK_CYCLES. Returns the cycle
+    count the states first differed at, None if they never did, and the
+    number of cycles the first one skipped.
+    '''
+    code = Masa(workload, **params).assemble()
+    emus = []
+    for fast_forward in (True, False):
+        emu = Guacamole(None, cpuhz, init_ram=True, rewind_budget=0, seed=0)
+        emu.ram[PROGRAM_BEGIN_ADDRESS:PROGRAM_BEGIN_ADDRESS + len(code)] = code
+        emu.rom_image = bytes(emu.ram)
+        emu.fast_forward = fast_forward
+        emus.append(emu)
+    fast, slow = emus
+    while fast.cycles < cycles:
+        step = min(CHECK_CYCLES, cycles - fast.cycles)
+        fast.run_cycles(step)
+        slow.run_cycles(step)
+        if pack_state(fast) != pack_state(slow) or list(fast.error_log) != list(slow.error_log):
+            return fast.cycles, fast.idle_cycles
+    return None, fast.idle_cycles
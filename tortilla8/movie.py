@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+
+from . import export
+from struct import Struct, error as struct_error
+from .savestate import whole
+__all__ = []
+
+# Movie layout, all values big endian:
+#
+#   header | save state | edges
+#
+# The save state is the emulator when recording started, see savestate.
+# Each edge is a change of the inputs, applied before the instruction at
+# its cycle runs: the keypad, the previous keypad ld reg,k compares against
+# and the CPU frequency if set_frequency() was called, otherwise zero.
+
+MOVIE_MAGIC   = b'T8MV'
+MOVIE_VERSION = 1
+
+HEADER = Struct('>4sBIIQ') # magic, version, state length, edge count, end cycle
+EDGE   = Struct('>QHHd')   # cycle, keypad, previous keypad, cpu hz
+
+@export
+class Movie:
+    '''
+    Recorded inputs of a run, see Guacamole.record_movie(). State is the
+    save state the run started from, edges a list of (cycle, keypad,
+    previous keypad, cpu hz or zero) and end the cycle recording stopped at.
+    '''
+    def __init__(self, state, edges=None, end=None):
+        self.state = state
+        self.edges = [] if edges is None else edges
+        self.end   = end
+
+@export
+def save_movie(movie, file_path):
+    '''
+    Writes a Movie to file_path.
+    '''
+    with open(file_path, 'wb') as fh:
+        fh.write( HEADER.pack(MOVIE_MAGIC, MOVIE_VERSION, len(movie.state),
+                              len(movie.edges), movie.end or 0) )
+        fh.write(movie.state)
+        for edge in movie.edges:
+            fh.write( EDGE.pack(*edge) )
+
+@export
+def load_movie(file_path):
+    '''
+    Reads a Movie written by save_movie(). Raises RuntimeError if the file
+    is damaged or from another version.
+    '''
+    with open(file_path, 'rb') as fh:
+        data = fh.read()
+    try:
+        magic, version, state_length, count, end = HEADER.unpack_from(data)
+    except struct_error:
+        raise RuntimeError("Movie is truncated")
+    if magic != MOVIE_MAGIC:
+        raise RuntimeError("Not a tortilla8 movie")
+    if version != MOVIE_VERSION:
+        raise RuntimeError("Movie version " + str(version) + " is not supported")
+    pos = HEADER.size + state_length
+    if len(data) != pos + count * EDGE.size:
+        raise RuntimeError("Movie is damaged")
+    edges = [ (cycle, keys, prev_keys, whole(hz)) for cycle, keys, prev_keys, hz in EDGE.iter_unpack(data[pos:]) ]
+    return Movie(data[HEADER.size:pos], edges, end)
+
+def apply_edge(keys, prev_keys, hz, emu):
+    '''
+    Scheduled callback that sets the inputs of one edge.
+    '''
+    emu.keypad, emu.prev_keypad = keys, prev_keys
+    if hz:
+        emu.set_frequency(hz)
@@ -117,7 +117,10 @@ class Nacho(Frame):
         file_path = filedialog.askopenfilename()
         if file_path:
             self.emu = Guacamole(rom=file_path, cpuhz=Nacho.DEFAULT_FREQ, audiohz=60, delayhz=60,
-                       init_ram=True, legacy_shift=False, err_unoffical="None", rewind_frames=0)
+                       init_ram=True, legacy_shift=False, err_unoffical="None", rewind_budget=0)
+            self.emu.add_hook('draw', self.on_draw)
+            self.emu.add_hook('clear', self.on_draw)
+            self.emu.add_hook('fatal', self.on_fatal)
             self.run_time = 1 # 1khz
             self.emu_event()
             self.timers_event()
@@ -181,23 +184,25 @@ class Nacho(Frame):
         if self.emu is not None:
             val = self.controls.get(key.keysym)
             if val:
-                self.emu.keypad[val] = True
+                self.emu.press(val)
 
     def key_up(self, key):
         if self.emu is not None:
             val = self.controls.get(key.keysym)
             if val:
-                self.emu.keypad[val] = False
+                self.emu.release(val)
 
     def draw(self):
         self.screen.delete("all")
         self.screen.create_rectangle( 0, 0, Nacho.X_SIZE*self.scale,
             Nacho.Y_SIZE*self.scale, fill=self.color_back )
+        width, _ = self.emu.screen_size()
+        size = self.scale * Nacho.X_SIZE / width # High resolution pixels are half size
         for i,pix in enumerate(self.emu.graphics()):
             if pix:
-                x = self.scale*(i%Nacho.X_SIZE)
-                y = self.scale*(i//Nacho.X_SIZE)
-                self.screen.create_rectangle( x, y, x+self.scale, y+self.scale,
+                x = size*(i%width)
+                y = size*(i//width)
+                self.screen.create_rectangle( x, y, x+size, y+size,
                     fill=self.color_fill, outline=self.color_border )
 
     def timers_event(self):
@@ -213,29 +218,29 @@ class Nacho(Frame):
 
         self.root.after(Nacho.TIMER_REFRESH, self.timers_event)
 
-    def emu_event(self):
-        self.emu.cpu_tick()
+    def on_draw(self, emu):
+        if not self.antiflicker.get():
+            self.draw()
+        else:
+            cur_screen = ''
+            for i,pix in enumerate(emu.graphics()):
+                cur_screen += '1' if pix else '0'
+            cur_screen = int(cur_screen,2)
+
+            if ( ( self.prev_screen ^ cur_screen ) & self.prev_screen ) != ( self.prev_screen ^ cur_screen ):
+                self.draw()
+            self.prev_screen = cur_screen
 
-        for err in self.emu.error_log:
-            print( str(err[0]) + ": " + err[1] )
-            if err[0] is EmulationError._Fatal:
-                self.fatal = True
-            self.emu.error_log = []
+    def on_fatal(self, emu, message):
+        self.fatal = True
 
-        if self.emu.draw_flag:
-            self.emu.draw_flag = False
+    def emu_event(self):
+        self.emu.cpu_tick()
 
-            if not self.antiflicker.get():
-                self.draw()
-            else:
-                cur_screen = ''
-                for i,pix in enumerate(self.emu.graphics()):
-                    cur_screen += '1' if pix else '0'
-                cur_screen = int(cur_screen,2)
-
-                if ( ( self.prev_screen ^ cur_screen ) & self.prev_screen ) != ( self.prev_screen ^ cur_screen ):
-                    self.draw()
-                self.prev_screen = cur_screen
+        if self.emu.error_log:
+            for err in self.emu.error_log:
+                print( str(err[0]) + ": " + err[1] )
+            self.emu.error_log.clear()
 
         if not self.fatal:
             self.root.after(self.run_time, self.emu_event)
@@ -30,8 +30,9 @@ from collections import deque
 from .constants.curses import *
 from .guacamole import Guacamole
 from .guacamole import EmulationError
+from .movie import save_movie
 from .constants.reg_rom_stack import PROGRAM_BEGIN_ADDRESS, NUMB_OF_REGS
-from .constants.graphics import GFX_RESOLUTION, GFX_ADDRESS, GFX_HEIGHT_PX, GFX_WIDTH
+from .constants.graphics import GFX_HEIGHT_PX, GFX_WIDTH, GFX_WIDTH_PX
 from resource import getrusage, RUSAGE_SELF
 
 # TODO Prevent menu from drawing when screen is small
@@ -44,9 +45,10 @@ class Platter:
 
     def __init__(self, rom, cpuhz, audiohz, delayhz,
                  init_ram, legacy_shift, enforce_ins,
-                 rewind_depth, drawfix,
+                 rewind_budget, drawfix,
                  enable_screen_unicode, enable_menu_unicode,
-                 wave_file=None):
+                 wave_file=None, breakpoints=None, seed=None, movie_file=None, quirks=None,
+                 platform='chip8'):
 
         # Check if windows (no unicode in their Curses)
         self.screen_unicode = enable_screen_unicode
@@ -60,7 +62,7 @@ class Platter:
 
         # Used for graphics "smoothing" w/ -d flag
         self.draw_fix = drawfix
-        self.prev_board=[0x00]*GFX_RESOLUTION
+        self.prev_board=[0x00]*GFX_HEIGHT_PX
 
         # General Prep
         self.rom = rom
@@ -95,9 +97,27 @@ class Platter:
                     "Unable to load default 'play.wav' from sound directory.")
 
         # Init the emulator
-        self.emu = Guacamole(rom, cpuhz, audiohz, delayhz, init_ram, legacy_shift, enforce_ins, rewind_depth)
+        self.emu = Guacamole(rom, cpuhz, audiohz, delayhz, init_ram, legacy_shift, enforce_ins,
+                             rewind_budget, seed=seed, quirks=quirks, platform=platform)
         self.check_log()
         self.init_emu_status()
+        self.emu.add_hook('draw', self.on_draw)
+        self.emu.add_hook('clear', self.on_draw)
+        self.emu.add_hook('key_wait', self.on_key_wait)
+        self.emu.add_hook('spin', self.on_spin)
+        self.emu.add_hook('fatal', self.on_fatal)
+        self.emu.add_hook('reset', self.on_reset)
+        self.emu.add_hook('break', self.on_break)
+        if breakpoints is not None:
+            self.emu.set_breakpoints(breakpoints)
+
+        # Record the inputs, saved on exit
+        self.movie_file = movie_file
+        if movie_file:
+            self.emu.record_movie()
+        if self.wave_obj is not None:
+            self.emu.add_hook('sound_start', self.on_sound_start)
+            self.emu.add_hook('sound_stop', self.on_sound_stop)
         self.rewind_size = 5
 
         # Curses settings
@@ -108,6 +128,7 @@ class Platter:
     def init_emu_status(self):
         self.previous_pc = PROGRAM_BEGIN_ADDRESS
         self.halt        = False
+        self.game_dirty  = True
 
     def init_logs(self):
         self.instr_history   = deque(maxlen = self.w_instr.getmaxyx()[0] - BORDERS)
@@ -120,7 +141,6 @@ class Platter:
 
     def start(self, step_mode=False):
         key_press_time = 0
-        key_msg_displayed = False
 
         if step_mode:
             self.console_print("Emulator started in step mode. Press '" + \
@@ -143,11 +163,9 @@ class Platter:
 
                 # Freq modifications
                 if key == 'up':
-                    self.emu.cpu_hz *= 1.05
-                    self.emu.cpu_wait = 1/self.emu.cpu_hz
+                    self.emu.set_frequency(self.emu.cpu_hz * 1.05)
                 if key == 'down':
-                    self.emu.cpu_hz = 1 if self.emu.cpu_hz * .95 < 1 else self.emu.cpu_hz * .95
-                    self.emu.cpu_wait = 1/self.emu.cpu_hz
+                    self.emu.set_frequency(1 if self.emu.cpu_hz * .95 < 1 else self.emu.cpu_hz * .95)
 
                 # Rewind modifications
                 if key == 'left':
@@ -157,28 +175,29 @@ class Platter:
 
                 # Update Keypad press
                 if time() - key_press_time > 0.5: #TODO Better input?
-                    self.emu.prev_keypad = 0
-                    self.emu.keypad = [False] * 16
+                    for k in range(16):
+                        self.emu.release(k)
                     key_press_time = time()
                 if key in KEY_CONTROLS:
-                    self.emu.keypad[KEY_CONTROLS[key]] = True
+                    self.emu.press(KEY_CONTROLS[key])
 
                 # Exit check
                 if key == KEY_EXIT:
                     break
 
                 # Rewind check:
+                if key == KEY_REWIN and self.movie_file:
+                    self.console_print("Rewind is disabled while recording a movie.")
+                    continue
                 if key == KEY_REWIN:
                     self.emu.rewind(self.rewind_size)
                     self.instr_history.appendleft("rewind: " + hex3(self.emu.program_counter))
+                    self.game_dirty = True
                     continue
 
                 # Reset check
                 if key == KEY_RESET:
                     self.emu.reset( self.rom )
-                    self.init_emu_status()
-                    self.init_logs()
-                    self.clear_all_windows()
                     continue
 
                 # Step check
@@ -191,44 +210,26 @@ class Platter:
                     step_mode = False
                     self.halt = False
 
-                # Try to tick the cpu
+                # Try to tick the cpu, one cycle at a time in step mode
                 if not self.halt:
-                    self.emu.run()
-
-                # Update Display if we executed
-                if self.emu.program_counter != self.previous_pc:
+                    if step_mode:
+                        self.emu.run_cycles(1)
+                    else:
+                        self.emu.run()
+
+                # Update Display if we executed. Key waits, spins, fatal
+                # errors and sound are reported by the emulator's hooks.
+                if self.emu.program_counter != self.previous_pc and not self.emu.waiting_for_key:
                     self.previous_pc = self.emu.program_counter
                     self.update_instr_history()
-                    key_msg_displayed = False
-
-                # Watch for spin for key
-                elif self.emu.waiting_for_key and not key_msg_displayed:
-                    self.instr_history.appendleft(hex3(self.emu.program_counter) + " key  ld")
-                    self.console_print("Program is trying to load a key press.")
-                    key_msg_displayed = True
-
-                # Detect jp Spinning
-                elif not self.halt and self.emu.spinning:
-                    self.instr_history.appendleft(hex3(self.emu.program_counter) + " spin jp")
-                    self.console_print("Spin detected. Press '" + chr(KEY_EXIT).upper() + "' to exit")
-                    self.halt  = True
 
                 # Toggle for Step Mode
                 if step_mode:
                     self.halt = True
 
-                # Start/stop Audio
-                if sa is not None and self.wave_obj is not None:
-                    self.audio_playing = False if self.emu.sound_timer_register == 0 else True
-                    if not self.audio_playing and self.play_obj is None:
-                        pass
-                    elif self.audio_playing and self.play_obj is None:
-                        self.play_obj = self.wave_obj.play()
-                    elif not self.audio_playing and self.play_obj is not None:
-                        self.play_obj.stop()
-                        self.play_obj = None
-                    elif self.audio_playing and not self.play_obj.is_playing():
-                        self.play_obj = self.wave_obj.play()
+                # Keep the sound looping while the timer runs
+                if self.wave_obj is not None and self.audio_playing and not self.play_obj.is_playing():
+                    self.play_obj = self.wave_obj.play()
 
                 # Check if screen was re-sized
                 if platform != 'win32':
@@ -256,18 +257,65 @@ class Platter:
             raise
         finally:
             self.cleanup()
+            if self.movie_file:
+                save_movie(self.emu.stop_movie(), self.movie_file)
 
     def check_log(self):
         # Print all logged errors in the emu
         for err in reversed(self.emu.error_log):
             self.console_print( str(err[0]) + ": " + err[1] )
             if err[0] is EmulationError._Fatal:
-                self.halt = True
                 self.console_print( "Fatal error has occured. Press '" + \
                     chr(KEY_RESET).upper() + "' to reset" )
 
         # Manually reset
-        self.emu.error_log = []
+        self.emu.error_log.clear()
+
+    # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+    # Emulator hooks
+
+    def on_draw(self, emu):
+        self.game_dirty = True
+
+    def on_key_wait(self, emu):
+        self.update_instr_history()
+        self.previous_pc = emu.program_counter
+        self.console_print("Program is trying to load a key press.")
+
+    def on_spin(self, emu):
+        self.instr_history.appendleft(hex3(emu.calling_pc) + " spin jp")
+        self.console_print("Spin detected. Press '" + chr(KEY_EXIT).upper() + "' to exit")
+        self.halt = True
+        emu.stop()
+
+    def on_break(self, emu):
+        kind, where = emu.breakpoints.hit
+        self.console_print("Stopped on " + kind + " " + (hex3(where) if isinstance(where, int) else where) + \
+            ". Press '" + chr(KEY_STEP).upper() + "' to step or '" + chr(KEY_RESUM).upper() + "' to resume")
+        self.halt = True
+
+    def on_fatal(self, emu, message):
+        self.halt = True
+        emu.stop()
+
+    def on_reset(self, emu):
+        if self.movie_file:
+            emu.record_movie()
+        self.on_sound_stop(emu)
+        self.init_emu_status()
+        self.init_logs()
+        self.clear_all_windows()
+
+    def on_sound_start(self, emu):
+        self.audio_playing = True
+        if self.play_obj is None:
+            self.play_obj = self.wave_obj.play()
+
+    def on_sound_stop(self, emu):
+        self.audio_playing = False
+        if self.wave_obj is not None and self.play_obj is not None:
+            self.play_obj.stop()
+            self.play_obj = None
 
     def cleanup(self):
         curses.nocbreak()
@@ -335,27 +383,24 @@ class Platter:
             pass
 
     def display_game(self):
-        if not self.w_game or not self.emu.draw_flag: return
-        self.emu.draw_flag = False
+        if not self.w_game or not self.game_dirty: return
+        self.game_dirty = False
+
+        rows = self.emu.screen_rows()
+        if len(rows) != GFX_HEIGHT_PX:
+            rows = halve_rows(rows)
 
         if self.draw_fix:
-            prev_str = ""
-            curr_str = ""
-            for val in self.prev_board:
-                prev_str += bin(val)[2:].zfill(8)
-            for val in self.emu.ram[GFX_ADDRESS:GFX_ADDRESS+GFX_RESOLUTION]:
-                curr_str += bin(val)[2:].zfill(8)
-            int_prev = int(prev_str,2)
-            int_curr = int(curr_str,2)
-            self.prev_board = self.emu.ram[GFX_ADDRESS:GFX_ADDRESS+GFX_RESOLUTION]
-            if ( ( int_prev ^ int_curr ) & int_prev ) == ( int_prev ^ int_curr ):
+            prev_rows, self.prev_board = self.prev_board, rows
+            if all( ( ( prev ^ curr ) & prev ) == ( prev ^ curr ) for prev, curr in zip(prev_rows, rows) ):
                 #Only 1s were changed to 0s, skip the draw to prevent SOME flicker
                 return
 
         for y in range( int(GFX_HEIGHT_PX / 2) ):
             for x in range(GFX_WIDTH):
-                upper_chunk = int( bin( self.emu.ram[ GFX_ADDRESS + ( (y * 2 + 0) * GFX_WIDTH) + x ] )[2:] )
-                lower_chunk = int( bin( self.emu.ram[ GFX_ADDRESS + ( (y * 2 + 1) * GFX_WIDTH) + x ] )[2:].replace('1','2') )
+                shift = GFX_WIDTH_PX - 8 * (x + 1)
+                upper_chunk = int( bin( rows[y * 2 + 0] >> shift & 0xFF )[2:] )
+                lower_chunk = int( bin( rows[y * 2 + 1] >> shift & 0xFF )[2:].replace('1','2') )
                 total_chunk  = str(upper_chunk + lower_chunk).zfill(8) \
                     .replace('3', self.draw_char.both ).replace('2', self.draw_char.lower ) \
                     .replace('1', self.draw_char.upper ).replace('0', self.draw_char.empty )
@@ -380,7 +425,7 @@ class Platter:
         if top > 3:
             self.w_stack.addstr( top - 2, 1, " " * 10 )
         self.w_stack.addstr( top - 1, 2, str(self.emu.stack_pointer).zfill(2) + ": sp   ")
-        for i,val in enumerate(reversed(self.emu.stack)):
+        for i,val in enumerate(reversed(self.emu.stack[:self.emu.stack_pointer])):
             if i == self.w_stack.getmaxyx()[0] - 4: break
             self.w_stack.addstr(top + i, 2, str(self.emu.stack_pointer - i - 1).zfill(2) + ": " + hex2(val))
         self.w_stack.noutrefresh()
@@ -441,6 +486,17 @@ class Platter:
 # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
 # Helper functions
 
+def halve_rows(rows):
+    '''
+    Scales a high resolution screen down to 64x32, a pixel is set if any of
+    the four it covers are.
+    '''
+    halved = []
+    for top, bottom in zip(rows[0::2], rows[1::2]):
+        row = top | bottom
+        halved.append( sum( 1 << i for i in range(GFX_WIDTH_PX) if row >> (2 * i) & 0x3 ) )
+    return halved
+
 def hex2(integer):
     return "0x" + hex(integer)[2:].zfill(2)
 
@@ -2,29 +2,189 @@
 
 from . import export
 from re import match
+from zlib import crc32
+from os import makedirs
+from os.path import join, dirname, expanduser, isfile
 from collections import namedtuple
-from .constants.opcodes import OP_CODES, UNOFFICIAL_OP_CODES, \
-                               BANNED_OP_CODES_EXPLODED, SUPER_CHIP_OP_CODES_EXPLODED
+from .constants.opcodes import UNOFFICIAL_OP_CODES, OP_VARIANTS, BANNED_OP_CODES, \
+                               SUPER_CHIP_OP_CODES, BANNED_OP_CODES_EXPLODED
+from .constants.reg_rom_stack import ARG_SUB
 __all__ = []
 
+# Decode table layout. One byte per opcode, the low 7 bits hold the variant
+# number (1 + index into OP_VARIANTS), zero is a data declaration. The high
+# bit flags banned opcodes.
+TBL_DATA   = 0x00
+TBL_BANNED = 0x80
+TBL_SIZE   = 0x10000
+TBL_MAGIC  = b'T8DT'
+TBL_VERSION = 2
+TBL_HEADER_SIZE = len(TBL_MAGIC) + 1 + 4
+DECODE_TABLE_FILE = join(expanduser('~'), '.cache', 'tortilla8', 'decode.tbl')
+
+# Mnemonic of data words, they disassemble to their hex instead
+DATA_MNEMONIC = ''
+
+# Variants of the Super Chip-8 instructions
+SUPER8_VARIANTS = frozenset( i+1 for i,(_,opdata) in enumerate(OP_VARIANTS)
+                             if opdata.hex in SUPER_CHIP_OP_CODES )
+
 @export
 class ASMdata( namedtuple('ASMdata', 'hex_instruction is_valid mnemonic\
     mnemonic_arg_types disassembled_line unoffical_op is_banned is_super8') ):
     pass
 
+@export
+class Instruction:
+    '''
+    Decoded form of an opcode used by the emulator. Operands are held as
+    ints, variant is the decode table entry without the banned flag (an
+    index into OP_VARIANTS plus one). Text is only built when asked for.
+    '''
+    __slots__ = ('opcode', 'x', 'y', 'n', 'kk', 'nnn', 'variant', 'mnemonic',
+                 'is_valid', 'unoffical_op', 'is_banned', 'is_super8')
+
+    def __init__(self, opcode, entry):
+        self.opcode  = opcode
+        self.x       = (opcode >> 8) & 0xF
+        self.y       = (opcode >> 4) & 0xF
+        self.n       = opcode & 0xF
+        self.kk      = opcode & 0xFF
+        self.nnn     = opcode & 0xFFF
+        self.variant = entry & ~TBL_BANNED
+        self.is_valid  = entry != TBL_DATA
+        self.is_super8 = self.variant in SUPER8_VARIANTS
+        self.is_banned = bool(entry & TBL_BANNED)
+        self.mnemonic  = OP_VARIANTS[self.variant - 1][0] if self.is_valid else DATA_MNEMONIC
+        self.unoffical_op = self.is_valid and not self.is_banned and \
+                            self.mnemonic in UNOFFICIAL_OP_CODES
+
+    @property
+    def hex_instruction(self):
+        return hex(self.opcode)[2:].zfill(4)
+
+    @property
+    def mnemonic_arg_types(self):
+        return Salsa( (self.opcode >> 8, self.kk) ).mnemonic_arg_types
+
+    @property
+    def disassembled_line(self):
+        return Salsa( (self.opcode >> 8, self.kk) ).disassembled_line
+
 class EarlyExit(Exception):
     pass
 
+_decode_table = None
+_asm_cache = [None] * TBL_SIZE
+_ins_cache = [None] * TBL_SIZE
+
 @export
 def Salsa(byte_list):
     '''
     Salsa is a one line (2 byte) dissassembler function for CHIP-8 Rom It
-    returns a named tuple with various information on the line.
+    returns a named tuple with various information on the line. Lines are
+    looked up in the decode table, see decode_table().
+    '''
+    opcode = (byte_list[0] << 8) | byte_list[1]
+    asm = _asm_cache[opcode]
+    if asm is None:
+        asm = _asm_cache[opcode] = _build_asmdata(opcode, decode_table()[opcode])
+    return asm
+
+@export
+def decode_opcode(opcode):
+    '''
+    Returns the Instruction for an int opcode, via the decode table.
+    '''
+    ins = _ins_cache[opcode]
+    if ins is None:
+        ins = _ins_cache[opcode] = Instruction(opcode, decode_table()[opcode])
+    return ins
+
+@export
+def decode_table(file_path=DECODE_TABLE_FILE):
+    '''
+    Returns the 64K decode table, building it on first use. The table is
+    loaded from file_path if a valid copy exists there, otherwise it is
+    built and an attempt is made to save it for the next process.
+    '''
+    global _decode_table
+    if _decode_table is None:
+        table = load_decode_table(file_path) if file_path else None
+        if table is None:
+            table = build_decode_table()
+            if file_path:
+                try:
+                    save_decode_table(file_path, table)
+                except OSError:
+                    pass
+        _decode_table = table
+    return _decode_table
+
+@export
+def build_decode_table():
+    '''
+    Decodes every possible opcode via the regex index in OP_CODES. Takes
+    a few seconds, which is why the result is cached to disk.
     '''
-    hex_instruction =  hex( byte_list[0] )[2:].zfill(2)
-    hex_instruction += hex( byte_list[1] )[2:].zfill(2)
+    table = bytearray(TBL_SIZE)
+    variant_ids = { id(opdata):i+1 for i,(_,opdata) in enumerate(OP_VARIANTS) }
+    for opcode in range(TBL_SIZE):
+        hex_instruction = hex(opcode)[2:].zfill(4)
+        for _, opdata in OP_VARIANTS:
+            if match(opdata.regular, hex_instruction):
+                table[opcode] = variant_ids[id(opdata)]
+                break
+
+    for hex_instruction in BANNED_OP_CODES_EXPLODED:
+        opcode = int(hex_instruction, 16)
+        if table[opcode] != TBL_DATA:
+            table[opcode] |= TBL_BANNED
+    return table
+
+@export
+def save_decode_table(file_path, table=None):
+    '''
+    Writes the decode table to file_path, tagged with a fingerprint of the
+    opcode definitions it was built from.
+    '''
+    if table is None:
+        table = decode_table()
+    makedirs(dirname(file_path), exist_ok=True)
+    with open(file_path, 'wb') as fh:
+        fh.write(TBL_MAGIC + bytes([TBL_VERSION]) + \
+            _op_code_fingerprint().to_bytes(4, 'big') + table)
+
+@export
+def load_decode_table(file_path):
+    '''
+    Reads a decode table from file_path. None is returned if the file is
+    missing, damaged, or was built from different opcode definitions.
+    '''
+    if not isfile(file_path):
+        return None
+    with open(file_path, 'rb') as fh:
+        blob = fh.read()
+    if len(blob) != TBL_HEADER_SIZE + TBL_SIZE or \
+       blob[:len(TBL_MAGIC)] != TBL_MAGIC or \
+       blob[len(TBL_MAGIC)] != TBL_VERSION or \
+       int.from_bytes(blob[len(TBL_MAGIC)+1:TBL_HEADER_SIZE], 'big') != _op_code_fingerprint():
+        return None
+    return bytearray(blob[TBL_HEADER_SIZE:])
+
+def _op_code_fingerprint():
+    '''
+    CRC of everything the decode table is derived from.
+    '''
+    return crc32(repr( (OP_VARIANTS, BANNED_OP_CODES) ).encode())
+
+def _build_asmdata(opcode, entry):
+    '''
+    Expands a decode table entry into the ASMdata for opcode.
+    '''
+    hex_instruction = hex(opcode)[2:].zfill(4)
     is_valid = False
-    mnemonic = None
+    mnemonic = DATA_MNEMONIC
     mnemonic_arg_types = None
     disassembled_line = ""
     unoffical_op = False
@@ -32,34 +192,18 @@ def Salsa(byte_list):
     is_super8 = False
 
     try:
-        # Check if the Op-Code a Super-8 instruction
-        if hex_instruction in SUPER_CHIP_OP_CODES_EXPLODED:
-            mnemonic = 'SPR'
-            is_super8 = True
-            raise EarlyExit
-
-        # Match the instruction via a regex index
-        for mnemonic, reg_patterns in OP_CODES.items():
-
-            if type(reg_patterns) is not tuple:
-                reg_patterns = (reg_patterns,)
-            for pattern_version in reg_patterns:
-                if not match(pattern_version.regular, hex_instruction):
-                    continue
-                mnemonic = mnemonic
-                mnemonic_arg_types = pattern_version.args
-                is_valid = True
-                break
-            if is_valid:
-                break
-
         # If not a valid instruction, assume data
-        if not is_valid:
+        if entry == TBL_DATA:
             disassembled_line = hex_instruction
             raise EarlyExit
 
+        is_valid = True
+        mnemonic, opdata = OP_VARIANTS[(entry & ~TBL_BANNED) - 1]
+        mnemonic_arg_types = opdata.args
+        is_super8 = opdata.hex in SUPER_CHIP_OP_CODES
+
         # If banned, flag and exit.
-        if hex_instruction in BANNED_OP_CODES_EXPLODED:
+        if entry & TBL_BANNED:
             is_banned = True
             raise EarlyExit
 
@@ -72,22 +216,20 @@ def Salsa(byte_list):
             disassembled_line = mnemonic
             raise EarlyExit
 
-        # Parse Args
+        # Parse Args, registers and nibbles are found by their place in the hex template
         tmp = ''
-        reg_numb = 1
-        for arg_type in mnemonic_arg_types:
-            if arg_type is 'reg':
-                tmp = 'v'+hex_instruction[reg_numb]
-            elif arg_type is 'byte':
+        for i, arg_type in enumerate(mnemonic_arg_types):
+            if arg_type == 'reg':
+                tmp = 'v'+hex_instruction[opdata.hex.index(ARG_SUB[i])]
+            elif arg_type == 'byte':
                 tmp = '#'+hex_instruction[2:]
-            elif arg_type is 'addr':
+            elif arg_type == 'addr':
                 tmp = '#'+hex_instruction[1:]
-            elif arg_type is 'nibble':
-                tmp = '#'+hex_instruction[3]
+            elif arg_type == 'nibble':
+                tmp = '#'+hex_instruction[opdata.hex.index(ARG_SUB[i])]
             else:
                 tmp = arg_type
             disassembled_line += tmp.ljust(5) + ','
-            reg_numb = 2
 
         disassembled_line = (mnemonic.ljust(5) + disassembled_line[:-1]).rstrip()
     except EarlyExit:
@@ -96,4 +238,3 @@ def Salsa(byte_list):
         return ASMdata(hex_instruction, is_valid, mnemonic,
             mnemonic_arg_types, disassembled_line, unoffical_op,
             is_banned, is_super8)
-
@@ -0,0 +1,237 @@
+#!/usr/bin/env python3
+
+from . import export
+from mmap import mmap, ACCESS_READ
+from zlib import crc32
+from array import array
+from struct import Struct, error as struct_error
+from collections import namedtuple
+from .salsa import decode_opcode
+from .constants.reg_rom_stack import BYTES_OF_RAM, STACK_SIZE
+__all__ = []
+
+# Save state layout, all values big endian:
+#
+#   header | core | registers | stack | rng | ram spans | init map spans
+#
+# The header holds a CRC of the emulator's rom_image, states can only be
+# loaded into an emulator with the same ROM. RAM is stored as spans of
+# (address, length, bytes) that differ from the rom_image. The init map
+# spans (address, length) are only present if uninitialized RAM is tracked.
+
+STATE_MAGIC   = b'T8SS'
+STATE_VERSION = 1
+
+HEADER    = Struct('>4sBI')
+CORE      = Struct('>HHHHBBBBHHQQQQQQddd')
+REGISTERS = Struct('>16s')
+STACK     = Struct('>' + str(STACK_SIZE) + 'H')
+RNG       = Struct('>B625IBd')
+COUNT     = Struct('>H')
+SPAN      = Struct('>HH')
+
+FLAG_DRAW, FLAG_WAITING, FLAG_SPINNING, FLAG_DIS_INS, FLAG_TRACKED = 0x01, 0x02, 0x04, 0x08, 0x10
+
+# RAM is compared in chunks of this many bytes, adjacent dirty chunks are
+# merged into one span.
+CHUNK = 16
+
+@export
+def pack_state(emu):
+    '''
+    Returns the state of a Guacamole instance as bytes. Only the chip8
+    platform can be saved, RuntimeError is raised for the others.
+    '''
+    if emu.framebuffer is not None:
+        raise RuntimeError("Save states of the " + emu.platform + " platform are not supported")
+    flags = (FLAG_DRAW if emu.draw_flag else 0) | \
+            (FLAG_WAITING if emu.waiting_for_key else 0) | \
+            (FLAG_SPINNING if emu.spinning else 0) | \
+            (FLAG_DIS_INS if emu.dis_ins is not None else 0) | \
+            (FLAG_TRACKED if emu.ram_init_map is not None else 0)
+    rng_version, mt, gauss = emu.rng.getstate()
+
+    data = bytearray( HEADER.pack(STATE_MAGIC, STATE_VERSION, crc32(emu.rom_image)) )
+    data += CORE.pack(emu.program_counter, emu.calling_pc, emu.index_register,
+        0 if emu.dis_ins is None else emu.dis_ins.opcode,
+        emu.delay_timer_register, emu.sound_timer_register, emu.stack_pointer, flags,
+        emu.keypad, emu.prev_keypad, emu.cycles, emu.audio_ticks, emu.delay_ticks,
+        *emu.timer_base, emu.cpu_hz, emu.audio_hz, emu.delay_hz)
+    data += emu.register
+    data += STACK.pack(*emu.stack)
+    data += RNG.pack(rng_version, *mt, gauss is not None, gauss or 0.0)
+
+    spans = diff_spans(emu.ram, emu.rom_image)
+    data += COUNT.pack(len(spans))
+    for address, length in spans:
+        data += SPAN.pack(address, length)
+        data += emu.ram[address:address + length]
+
+    if emu.ram_init_map is not None:
+        spans = set_spans(emu.ram_init_map)
+        data += COUNT.pack(len(spans))
+        for span in spans:
+            data += SPAN.pack(*span)
+    return bytes(data)
+
+@export
+def unpack_state(emu, buffer):
+    '''
+    Restores a Guacamole instance from a buffer made by pack_state(). Any
+    object supporting the buffer protocol works, nothing but the RAM spans
+    is copied out of it. Raises RuntimeError if the state is damaged, from
+    another version, or was saved with a different ROM loaded.
+    '''
+    if emu.framebuffer is not None:
+        raise RuntimeError("Save states of the " + emu.platform + " platform are not supported")
+    with memoryview(buffer) as view:
+        fields = parse_state(view, crc32(emu.rom_image))
+        pc, calling_pc, index, opcode, dt, st, sp, flags, keypad, prev_keypad, cycles, \
+            audio_ticks, delay_ticks, base_cycle, base_audio, base_delay, cpuhz, audiohz, \
+            delayhz = fields.core
+
+        # Nothing below can fail, the emulator is never left half loaded
+        emu.ram[:] = emu.rom_image
+        for address, length, offset in fields.spans:
+            emu.ram[address:address + length] = view[offset:offset + length]
+
+    if emu.ram_init_map is not None:
+        emu.ram_init_map[:] = bytes(BYTES_OF_RAM)
+        for address, length in fields.init_spans or ( (0, BYTES_OF_RAM), ):
+            emu.mark_ram(address, length)
+
+    emu.register[:] = fields.register
+    emu.stack[:] = array('H', fields.stack)
+    emu.program_counter, emu.calling_pc, emu.index_register = pc, calling_pc, index
+    emu.delay_timer_register, emu.sound_timer_register, emu.stack_pointer = dt, st, sp
+    emu.dis_ins = decode_opcode(opcode) if flags & FLAG_DIS_INS else None
+    emu.draw_flag       = bool(flags & FLAG_DRAW)
+    emu.waiting_for_key = bool(flags & FLAG_WAITING)
+    emu.spinning        = bool(flags & FLAG_SPINNING)
+    emu.keypad, emu.prev_keypad = keypad, prev_keypad
+    emu.key_queue.clear()
+
+    emu.set_frequency(whole(cpuhz))
+    emu.audio_hz, emu.delay_hz = whole(audiohz), whole(delayhz)
+    emu.cycles, emu.audio_ticks, emu.delay_ticks = cycles, audio_ticks, delay_ticks
+    emu.timer_base = (base_cycle, base_audio, base_delay)
+    rng = fields.rng
+    emu.rng.setstate( (rng[0], tuple(rng[1:626]), rng[627] if rng[626] else None) )
+
+    if emu.journal is not None:
+        emu.journal.clear()
+    emu.sprites.flush()
+    if emu.compiler is not None:
+        emu.compiler.flush()
+
+@export
+def save_state(emu, file_path):
+    '''
+    Writes the state of a Guacamole instance to file_path.
+    '''
+    with open(file_path, 'wb') as fh:
+        fh.write(pack_state(emu))
+
+@export
+def load_state(emu, file_path):
+    '''
+    Restores a Guacamole instance from a file written by save_state(). The
+    file is memory mapped rather than read.
+    '''
+    with open(file_path, 'rb') as fh:
+        with mmap(fh.fileno(), 0, access=ACCESS_READ) as mm:
+            unpack_state(emu, mm)
+
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+# Helpers
+
+class StateFields( namedtuple('StateFields', 'core register stack rng spans init_spans') ):
+    pass
+
+def parse_state(view, rom_crc):
+    '''
+    Validates a save state and unpacks everything but the RAM, which is
+    returned as (address, length, offset into view) spans.
+    '''
+    if len(view) < HEADER.size + CORE.size:
+        raise RuntimeError("Save state is truncated")
+    magic, version, crc = HEADER.unpack_from(view)
+    if magic != STATE_MAGIC:
+        raise RuntimeError("Not a tortilla8 save state")
+    if version != STATE_VERSION:
+        raise RuntimeError("Save state version " + str(version) + " is not supported")
+    if crc != rom_crc:
+        raise RuntimeError("Save state was made with a different ROM")
+
+    try:
+        pos = HEADER.size
+        core = CORE.unpack_from(view, pos)
+        pos += CORE.size
+        register, = REGISTERS.unpack_from(view, pos)
+        pos += REGISTERS.size
+        stack = STACK.unpack_from(view, pos)
+        pos += STACK.size
+        rng = RNG.unpack_from(view, pos)
+        pos += RNG.size
+
+        spans = []
+        count, = COUNT.unpack_from(view, pos)
+        pos += COUNT.size
+        for _ in range(count):
+            address, length = SPAN.unpack_from(view, pos)
+            pos += SPAN.size
+            spans.append( (address, length, pos) )
+            pos += length
+
+        init_spans = None
+        if core[7] & FLAG_TRACKED:
+            count, = COUNT.unpack_from(view, pos)
+            pos += COUNT.size
+            init_spans = [ SPAN.unpack_from(view, pos + i * SPAN.size) for i in range(count) ]
+            pos += count * SPAN.size
+    except struct_error:
+        raise RuntimeError("Save state is truncated")
+
+    if pos > len(view) or any(a + l > BYTES_OF_RAM for a,l,_ in spans) or \
+       any(a + l > BYTES_OF_RAM for a,l in init_spans or ()):
+        raise RuntimeError("Save state is damaged")
+    return StateFields(core, register, stack, rng, spans, init_spans)
+
+def whole(value):
+    '''
+    Frequencies are stored as doubles but are usually ints, keep them ints.
+    '''
+    return int(value) if value.is_integer() else value
+
+def diff_spans(current, base):
+    '''
+    List of (address, length) covering every byte where current and base
+    differ, at CHUNK granularity.
+    '''
+    spans = []
+    start = None
+    for chunk in range(0, len(current), CHUNK):
+        if current[chunk:chunk + CHUNK] != base[chunk:chunk + CHUNK]:
+            if start is None:
+                start = chunk
+        elif start is not None:
+            spans.append( (start, chunk - start) )
+            start = None
+    if start is not None:
+        spans.append( (start, len(current) - start) )
+    return spans
+
+def set_spans(init_map):
+    '''
+    List of (address, length) runs of non-zero bytes in the init map.
+    '''
+    spans = []
+    end = 0
+    while True:
+        start = init_map.find(1, end)
+        if start == -1:
+            return spans
+        end = init_map.find(0, start)
+        if end == -1:
+            end = len(init_map)
+        spans.append( (start, end - start) )
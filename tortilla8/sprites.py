@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+
+from .constants.reg_rom_stack import BYTES_OF_RAM, STACK_ADDRESS
+from .constants.graphics import GFX_ADDRESS, GFX_WIDTH_PX
+
+# Pre-shifted sprites used by drw. Sprites get drawn from the same
+# addresses over and over (the font, a ROM's tiles), so each is shifted to
+# the column it is drawn at once and kept until a store writes over it.
+
+# Most entries kept, the cache is emptied when it grows past this
+MAX_CACHED_SPRITES = 4096
+
+# Sprites are only cached below the RAM the emulator writes itself, drw
+# and cls write the screen and call may write the stack.
+CACHE_LIMIT = GFX_ADDRESS if not STACK_ADDRESS else min(GFX_ADDRESS, STACK_ADDRESS)
+
+ROW_MASK = (1 << GFX_WIDTH_PX) - 1
+
+def sprite_row(byte, x, clip):
+    '''
+    A sprite byte as a screen row with its leftmost pixel at column x.
+    Pixels past the right edge wrap to the left one unless clip is set.
+    '''
+    if clip:
+        return byte << (GFX_WIDTH_PX - 8) >> x
+    bits = byte << (2 * GFX_WIDTH_PX - 8 - x)
+    return (bits >> GFX_WIDTH_PX | bits) & ROW_MASK
+
+class SpriteCache:
+    '''
+    Sprites keyed by source address, height, column and clipping. Each is
+    one int holding a screen row per sprite byte, the first row most
+    significant, so it lines up with the screen rows it covers read as one
+    int. Addresses covered by an entry are flagged in sprite_map so stores
+    only drop entries they hit.
+    '''
+    def __init__(self):
+        self.cache = {}
+        self.sprite_map = bytearray(BYTES_OF_RAM)
+
+    def block(self, ram, address, height, x, clip):
+        '''
+        Returns the height byte sprite at address drawn at column x, or None
+        for sprites past CACHE_LIMIT, drw reads those a row at a time as it
+        may be drawing over them.
+        '''
+        if address + height > CACHE_LIMIT:
+            return None
+        key = address << 11 | height << 7 | x << 1 | clip
+        sprite = self.cache.get(key)
+        if sprite is None:
+            if len(self.cache) >= MAX_CACHED_SPRITES:
+                self.flush()
+            sprite = 0
+            for byte in ram[address:address + height]:
+                sprite = sprite << GFX_WIDTH_PX | sprite_row(byte, x, clip)
+            self.cache[key] = sprite
+            self.sprite_map[address:address + height] = b'\x01' * height
+        return sprite
+
+    def invalidate(self, address, length):
+        '''
+        Drops every entry that overlaps the written range. Only the range the
+        dropped entries covered is cleared from sprite_map.
+        '''
+        if self.sprite_map.find(1, address, address + length) == -1:
+            return
+        end = address + length
+        low, high = end, address
+        for key in [k for k in self.cache if k >> 11 < end and (k >> 11) + (k >> 7 & 0xF) > address]:
+            del self.cache[key]
+            start = key >> 11
+            low, high = min(low, start), max(high, start + (key >> 7 & 0xF))
+        self.sprite_map[low:high] = bytes(high - low)
+        for key in self.cache:
+            start, height = key >> 11, key >> 7 & 0xF
+            if start < high and start + height > low:
+                self.sprite_map[start:start + height] = b'\x01' * height
+
+    def copy(self):
+        '''
+        Copy for a cloned emulator.
+        '''
+        sprites = SpriteCache.__new__(SpriteCache)
+        sprites.cache = dict(self.cache)
+        sprites.sprite_map = bytearray(self.sprite_map)
+        return sprites
+
+    def flush(self):
+        '''
+        Forgets every sprite, for when RAM is replaced wholesale.
+        '''
+        self.cache.clear()
+        self.sprite_map[:] = bytes(BYTES_OF_RAM)
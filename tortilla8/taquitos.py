@@ -0,0 +1,578 @@
+#!/usr/bin/env python3
+
+from . import export
+from . import EmulationError
+from random import Random
+from array import array
+from .salsa import decode_table, decode_opcode, TBL_DATA, TBL_BANNED
+from .guacamole import Guacamole
+from .errorlog import LOG_NO_INSTRUCTION, LOG_UNOFFICIAL, LOG_UNKNOWN
+from .instructions import build_dispatch_table
+from .sprites import SpriteCache
+from .constants.quirks import Quirks
+from .constants.opcodes import OP_VARIANTS, VARIANT_IDS, UNOFFICIAL_OP_CODES
+from .constants.reg_rom_stack import BYTES_OF_RAM, PROGRAM_BEGIN_ADDRESS, NUMB_OF_REGS, STACK_SIZE
+from .constants.graphics import GFX_FONT_ADDRESS, GFX_RESOLUTION, GFX_ADDRESS, \
+                                GFX_WIDTH, GFX_HEIGHT_PX, GFX_WIDTH_PX
+try:
+    import numpy as np
+except ImportError:
+    np = None
+__all__ = []
+
+@export
+class Taquitos:
+    '''
+    Taquitos runs many copies of one ROM in lockstep. The state of every
+    instance lives in NumPy arrays with one row per instance, each step
+    fetches and decodes for all instances and runs every distinct
+    instruction once over the instances that are on it. Instructions without
+    a vector form run per instance through the handlers in instructions.
+    RAM is always initialized, uninitialized RAM tracking is not supported.
+    Only the chip8 platform is run.
+    '''
+    def __init__(self, rom, count, seeds=None, cpuhz=200, audiohz=60, delayhz=60,
+                 legacy_shift=False, err_unoffical="None", quirks=None):
+        '''
+        Creates count instances of the ROM at path rom. Seeds is an optional
+        list of count seeds for the instances' random number generators, the
+        rest of the arguments are as for Guacamole.
+        '''
+        if np is None:
+            raise ImportError("NumPy is missing from your system. " + \
+                "You can install it via 'pip install numpy'.")
+
+        # A Guacamole does the ROM loading, every instance starts from its RAM
+        template = Guacamole(rom, cpuhz, audiohz, delayhz, True, legacy_shift,
+                             err_unoffical, 0, quirks=quirks)
+
+        # State, one row or entry per instance
+        self.count    = count
+        self.ram      = np.tile( np.frombuffer(template.rom_image, np.uint8), (count, 1) )
+        self.register = np.zeros( (count, NUMB_OF_REGS), np.uint8 )
+        self.stack    = np.zeros( (count, STACK_SIZE), np.uint16 )
+        self.keypad      = np.zeros( (count, 16), bool )
+        self.prev_keypad = np.zeros( (count, 16), bool )
+        self.index_register       = np.zeros(count, np.int32)
+        self.delay_timer_register = np.zeros(count, np.int32)
+        self.sound_timer_register = np.zeros(count, np.int32)
+        self.program_counter = np.full(count, PROGRAM_BEGIN_ADDRESS, np.int32)
+        self.calling_pc      = np.full(count, PROGRAM_BEGIN_ADDRESS, np.int32)
+        self.stack_pointer   = np.zeros(count, np.int32)
+        self.opcode          = np.full(count, -1, np.int32) # Last executed, -1 for none
+        self.draw_flag       = np.zeros(count, bool)
+        self.waiting_for_key = np.zeros(count, bool)
+        self.spinning        = np.zeros(count, bool)
+        self.rngs = [ Random(seed) for seed in seeds ] if seeds is not None else \
+                    [ Random() for _ in range(count) ]
+        self.error_logs = [ template.error_log.copy() for _ in range(count) ]
+
+        # Settings, the handlers are picked for the quirks. Unofficial
+        # instructions are logged by step() so ins_tbl does not warn.
+        self.quirks = template.quirks
+        self.warn_exotic_ins = EmulationError.from_string(err_unoffical)
+        self.ins_tbl = build_dispatch_table(quirks=self.quirks)
+        self.vector_tbl = vector_table(self.quirks)
+
+        # Virtual clock, shared by every instance. See Guacamole.
+        self.cpu_hz      = cpuhz
+        self.audio_hz    = audiohz
+        self.delay_hz    = delayhz
+        self.cycles      = 0
+        self.audio_ticks = 0
+        self.delay_ticks = 0
+
+    def run_cycles(self, count):
+        '''
+        Runs count CPU cycles on every instance, decrementing the timers at
+        the same cycles Guacamole.run_cycles() would.
+        '''
+        end = self.cycles + count
+        while self.cycles < end:
+            until = min( end, self.next_audio_cycle(), self.next_delay_cycle() )
+            while self.cycles < until:
+                self.step()
+            if self.cycles >= self.next_audio_cycle():
+                self.audio_ticks += 1
+                self.sound_timer_register -= self.sound_timer_register != 0
+            if self.cycles >= self.next_delay_cycle():
+                self.delay_ticks += 1
+                self.delay_timer_register -= self.delay_timer_register != 0
+
+    def run_frames(self, count):
+        '''
+        Runs until the delay timer has ticked count more times.
+        '''
+        self.run_cycles( -(-(self.delay_ticks + count) * self.cpu_hz // self.delay_hz) - self.cycles )
+
+    def next_audio_cycle(self):
+        return -(-(self.audio_ticks + 1) * self.cpu_hz // self.audio_hz)
+
+    def next_delay_cycle(self):
+        return -(-(self.delay_ticks + 1) * self.cpu_hz // self.delay_hz)
+
+    def step(self):
+        '''
+        Ticks every instance forward a cycle, the batch form of
+        Guacamole.cpu_tick().
+        '''
+        self.cycles += 1
+        pc = self.program_counter
+
+        # Handle the ld reg,k instruction
+        waiting = self.waiting_for_key.copy()
+        if waiting.any():
+            lanes = np.flatnonzero(waiting)
+            pressed = self.keypad[lanes] & ~self.prev_keypad[lanes]
+            loaded = pressed.any(axis=1)
+            lanes, pressed = lanes[loaded], pressed[loaded]
+            self.register[lanes, self.opcode[lanes] >> 8 & 0xF] = pressed.argmax(axis=1)
+            pc[lanes] += 2
+            self.waiting_for_key[lanes] = False
+
+        lanes = np.flatnonzero(~waiting)
+        if not len(lanes):
+            return
+        self.prev_keypad[lanes] = self.keypad[lanes]
+        self.calling_pc[lanes] = pc[lanes]
+
+        # Instances that ran off the end of RAM stay put
+        outside = pc[lanes] + 2 > BYTES_OF_RAM
+        if outside.any():
+            for lane in lanes[outside]:
+                self.log(lane, LOG_NO_INSTRUCTION, EmulationError._Fatal, int(pc[lane]))
+            lanes = lanes[~outside]
+
+        # Fetch and decode
+        opcode = self.ram[lanes, pc[lanes]].astype(np.int32) << 8 | self.ram[lanes, pc[lanes] + 1]
+        entry = DECODE_ENTRIES[opcode]
+        self.opcode[lanes] = opcode
+
+        invalid = entry == TBL_DATA
+        if invalid.any():
+            for lane, op in zip(lanes[invalid], opcode[invalid]):
+                self.log(lane, LOG_UNKNOWN, EmulationError._Fatal, int(op), int(pc[lane]))
+
+        if self.warn_exotic_ins:
+            for lane, op in zip(lanes[UNOFFICIAL_ENTRIES[entry]], opcode[UNOFFICIAL_ENTRIES[entry]]):
+                self.log(lane, LOG_UNOFFICIAL, self.warn_exotic_ins, decode_opcode(int(op)).mnemonic, int(pc[lane]))
+
+        # Execute, once per distinct instruction
+        variant = entry & (0xFF ^ TBL_BANNED)
+        valid = ~invalid
+        for v in np.unique(variant[valid]):
+            group = valid & (variant == v)
+            handler = self.vector_tbl[v]
+            if handler is None:
+                self.run_lanes(lanes[group], opcode[group])
+            else:
+                handler(self, lanes[group], opcode[group])
+
+        # Increment the PC
+        pc[lanes] += 2
+
+    def run_lanes(self, lanes, opcodes):
+        '''
+        Runs one instruction per instance through the instructions handlers.
+        '''
+        for lane, op in zip(lanes, opcodes):
+            ins = decode_opcode(int(op))
+            lane_view = Lane(self, lane)
+            self.ins_tbl[ins.variant](lane_view, ins)
+            lane_view.store()
+
+    def log(self, lane, code, error_type, *args):
+        opcode = int(self.opcode[lane])
+        self.error_logs[lane].add(error_type, code, int(self.program_counter[lane]),
+                                  None if opcode < 0 else opcode, args)
+
+    # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+    # Moving single instances in and out of the batch
+
+    def import_lane(self, lane, emu):
+        '''
+        Copies the state of a Guacamole into one instance of the batch.
+        '''
+        self.ram[lane] = np.frombuffer(emu.ram, np.uint8)
+        self.register[lane] = np.frombuffer(emu.register, np.uint8)
+        self.stack[lane] = emu.stack
+        self.keypad[lane] = mask_to_keys(emu.keypad)
+        self.prev_keypad[lane] = mask_to_keys(emu.prev_keypad)
+        self.index_register[lane] = emu.index_register
+        self.delay_timer_register[lane] = emu.delay_timer_register
+        self.sound_timer_register[lane] = emu.sound_timer_register
+        self.program_counter[lane] = emu.program_counter
+        self.calling_pc[lane] = emu.calling_pc
+        self.stack_pointer[lane] = emu.stack_pointer
+        self.opcode[lane] = -1 if emu.dis_ins is None else emu.dis_ins.opcode
+        self.draw_flag[lane] = emu.draw_flag
+        self.waiting_for_key[lane] = emu.waiting_for_key
+        self.spinning[lane] = emu.spinning
+        self.rngs[lane].setstate( emu.rng.getstate() )
+
+    def export_lane(self, lane, emu):
+        '''
+        Copies one instance of the batch into a Guacamole.
+        '''
+        emu.ram[:] = self.ram[lane].tobytes()
+        emu.register[:] = self.register[lane].tobytes()
+        emu.stack[:] = array('H', self.stack[lane].tolist())
+        emu.keypad = keys_to_mask(self.keypad[lane])
+        emu.prev_keypad = keys_to_mask(self.prev_keypad[lane])
+        emu.index_register = int(self.index_register[lane])
+        emu.delay_timer_register = int(self.delay_timer_register[lane])
+        emu.sound_timer_register = int(self.sound_timer_register[lane])
+        emu.program_counter = int(self.program_counter[lane])
+        emu.calling_pc = int(self.calling_pc[lane])
+        emu.stack_pointer = int(self.stack_pointer[lane])
+        emu.dis_ins = None if self.opcode[lane] < 0 else decode_opcode(int(self.opcode[lane]))
+        emu.draw_flag = bool(self.draw_flag[lane])
+        emu.waiting_for_key = bool(self.waiting_for_key[lane])
+        emu.spinning = bool(self.spinning[lane])
+        emu.rng.setstate( self.rngs[lane].getstate() )
+        emu.sprites.flush()
+        if emu.compiler is not None:
+            emu.compiler.flush()
+
+class Lane:
+    '''
+    Guacamole-like view of one instance of a Taquitos, so the handlers in
+    instructions can run on it. RAM, registers and the stack are views into
+    the batch arrays, the scalars are copied back by store().
+    '''
+    def __init__(self, batch, lane):
+        self.batch = batch
+        self.lane  = lane
+        self.ram      = memoryview(batch.ram[lane])
+        self.gfx      = self.ram[GFX_ADDRESS:GFX_ADDRESS + GFX_RESOLUTION]
+        self.register = memoryview(batch.register[lane])
+        self.stack    = memoryview(batch.stack[lane])
+        self.keypad   = keys_to_mask(batch.keypad[lane])
+        self.rng      = batch.rngs[lane]
+        self.index_register       = int(batch.index_register[lane])
+        self.delay_timer_register = int(batch.delay_timer_register[lane])
+        self.sound_timer_register = int(batch.sound_timer_register[lane])
+        self.program_counter = int(batch.program_counter[lane])
+        self.stack_pointer   = int(batch.stack_pointer[lane])
+        self.draw_flag       = bool(batch.draw_flag[lane])
+        self.waiting_for_key = bool(batch.waiting_for_key[lane])
+        self.spinning        = bool(batch.spinning[lane])
+        self.ram_init_map    = None
+        self.sprites         = SpriteCache()
+
+    def log(self, code, error_type, *args):
+        self.batch.log(self.lane, code, error_type, *args)
+
+    def store(self):
+        batch, lane = self.batch, self.lane
+        batch.index_register[lane]       = self.index_register
+        batch.delay_timer_register[lane] = self.delay_timer_register
+        batch.sound_timer_register[lane] = self.sound_timer_register
+        batch.program_counter[lane] = self.program_counter
+        batch.stack_pointer[lane]   = self.stack_pointer
+        batch.draw_flag[lane]       = self.draw_flag
+        batch.waiting_for_key[lane] = self.waiting_for_key
+        batch.spinning[lane]        = self.spinning
+
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+# Keypad conversion, the batch keeps a bool per key where Guacamole keeps a
+# bitmask with key 0 most significant
+
+def keys_to_mask(keys):
+    mask = 0
+    for k in keys:
+        mask = mask << 1 | bool(k)
+    return mask
+
+def mask_to_keys(mask):
+    return [ bool(mask >> (15 - k) & 1) for k in range(16) ]
+
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+# Vector instructions. Each takes the batch, the instances to run on and
+# their opcodes, and matches the handler of the same name in instructions.
+
+def v_se_byte(b, lanes, op):
+    b.program_counter[lanes] += 2 * (b.register[lanes, op >> 8 & 0xF] == (op & 0xFF))
+
+def v_se_reg(b, lanes, op):
+    b.program_counter[lanes] += 2 * (b.register[lanes, op >> 8 & 0xF] == b.register[lanes, op >> 4 & 0xF])
+
+def v_sne_byte(b, lanes, op):
+    b.program_counter[lanes] += 2 * (b.register[lanes, op >> 8 & 0xF] != (op & 0xFF))
+
+def v_sne_reg(b, lanes, op):
+    b.program_counter[lanes] += 2 * (b.register[lanes, op >> 8 & 0xF] != b.register[lanes, op >> 4 & 0xF])
+
+def v_skp(b, lanes, op):
+    b.program_counter[lanes] += 2 * b.keypad[lanes, b.register[lanes, op >> 8 & 0xF] & 0xF]
+
+def v_sknp(b, lanes, op):
+    b.program_counter[lanes] += 2 * ~b.keypad[lanes, b.register[lanes, op >> 8 & 0xF] & 0xF]
+
+def v_shl(b, lanes, op):
+    x, reg = op >> 8 & 0xF, b.register
+    reg[lanes, 0xF] = reg[lanes, x] >= 0x80
+    reg[lanes, x] = reg[lanes, x] << 1
+
+def v_shr(b, lanes, op):
+    x, reg = op >> 8 & 0xF, b.register
+    reg[lanes, 0xF] = reg[lanes, x] & 1
+    reg[lanes, x] = reg[lanes, x] >> 1
+
+def v_or(b, lanes, op):
+    b.register[lanes, op >> 8 & 0xF] |= b.register[lanes, op >> 4 & 0xF]
+
+def v_and(b, lanes, op):
+    b.register[lanes, op >> 8 & 0xF] &= b.register[lanes, op >> 4 & 0xF]
+
+def v_xor(b, lanes, op):
+    b.register[lanes, op >> 8 & 0xF] ^= b.register[lanes, op >> 4 & 0xF]
+
+def v_sub(b, lanes, op):
+    x, y, reg = op >> 8 & 0xF, op >> 4 & 0xF, b.register
+    reg[lanes, 0xF] = reg[lanes, x] >= reg[lanes, y]
+    reg[lanes, x] = reg[lanes, x] - reg[lanes, y]
+
+def v_subn(b, lanes, op):
+    x, y, reg = op >> 8 & 0xF, op >> 4 & 0xF, b.register
+    reg[lanes, 0xF] = reg[lanes, y] >= reg[lanes, x]
+    reg[lanes, x] = reg[lanes, y] - reg[lanes, x]
+
+def v_jp(b, lanes, op):
+    nnn = op & 0xFFF
+    b.spinning[lanes[b.program_counter[lanes] == nnn]] = True
+    b.program_counter[lanes] = nnn - 2
+
+def v_jp_v0(b, lanes, op):
+    init_pc = b.program_counter[lanes]
+    target = (op & 0xFFF) + b.register[lanes, 0] - 2
+    b.program_counter[lanes] = target
+    b.spinning[lanes[init_pc == target + 2]] = True
+
+def v_add_byte(b, lanes, op):
+    x = op >> 8 & 0xF
+    b.register[lanes, x] = (b.register[lanes, x] + (op & 0xFF)) & 0xFF
+
+def v_add_reg(b, lanes, op):
+    x, y, reg = op >> 8 & 0xF, op >> 4 & 0xF, b.register
+    total = reg[lanes, x].astype(np.int32) + reg[lanes, y]
+    reg[lanes, x] = total & 0xFF
+    reg[lanes, 0xF] = total > 0xFF
+
+def v_add_i(b, lanes, op):
+    b.index_register[lanes] = (b.index_register[lanes] + b.register[lanes, op >> 8 & 0xF]) & 0xFFF
+
+def v_ld_byte(b, lanes, op):
+    b.register[lanes, op >> 8 & 0xF] = op & 0xFF
+
+def v_ld_reg(b, lanes, op):
+    b.register[lanes, op >> 8 & 0xF] = b.register[lanes, op >> 4 & 0xF]
+
+def v_ld_get_dt(b, lanes, op):
+    b.register[lanes, op >> 8 & 0xF] = b.delay_timer_register[lanes]
+
+def v_ld_k(b, lanes, op):
+    b.waiting_for_key[lanes] = True
+    b.program_counter[lanes] -= 2
+
+def v_ld_i(b, lanes, op):
+    b.index_register[lanes] = op & 0xFFF
+
+def v_ld_set_dt(b, lanes, op):
+    b.delay_timer_register[lanes] = b.register[lanes, op >> 8 & 0xF]
+
+def v_ld_set_st(b, lanes, op):
+    b.sound_timer_register[lanes] = b.register[lanes, op >> 8 & 0xF]
+
+def v_ld_f(b, lanes, op):
+    b.index_register[lanes] = GFX_FONT_ADDRESS + 5 * b.register[lanes, op >> 8 & 0xF].astype(np.int32)
+
+def v_drw(b, lanes, op):
+    n = op & 0xF
+    index = b.index_register[lanes]
+    past_end = index + n > BYTES_OF_RAM
+    if past_end.any():
+        b.run_lanes(lanes[past_end], op[past_end])
+        lanes, op, n, index = lanes[~past_end], op[~past_end], n[~past_end], index[~past_end]
+
+    reg, ram = b.register, b.ram
+    vx = reg[lanes, op >> 8 & 0xF].astype(np.int32)
+    vy = reg[lanes, op >> 4 & 0xF].astype(np.int32)
+    b.draw_flag[lanes] = True
+    x_origin_byte = ( vx // 8 ) % GFX_WIDTH
+    y_origin_byte = ( vy % GFX_HEIGHT_PX ) * GFX_WIDTH
+    shift_amount = vx % GFX_WIDTH_PX % 8
+    next_byte_offset = np.where(x_origin_byte + 1 != GFX_WIDTH, 1, 1 - GFX_WIDTH)
+
+    reg[lanes, 0xF] = 0
+    for y in range(int(n.max(initial=0))):
+        rows = n > y
+        l, base = lanes[rows], x_origin_byte[rows] + y_origin_byte[rows] + y * GFX_WIDTH
+        sprite = ram[l, index[rows] + y].astype(np.int32) << (8 - shift_amount[rows])
+        first  = GFX_ADDRESS + base % GFX_RESOLUTION
+        second = GFX_ADDRESS + (base + next_byte_offset[rows]) % GFX_RESOLUTION
+        original = ram[l, first].astype(np.int32) << 8 | ram[l, second]
+        xor = original ^ sprite
+        ram[l, first], ram[l, second] = xor >> 8, xor & 0xFF
+        reg[l[(xor ^ original) & original != 0], 0xF] = 1
+
+# Vector form of each handler in instructions.HANDLERS, where there is one
+VECTORS = {
+    'Ex9E':v_skp,      'ExA1':v_sknp,    '3xyy':v_se_byte,   '5xy0':v_se_reg,
+    '4xyy':v_sne_byte, '9xy0':v_sne_reg, '7xyy':v_add_byte,  '8xy4':v_add_reg,
+    'Fy1E':v_add_i,    '8xy1':v_or,      '8xy2':v_and,       '8xy3':v_xor,
+    '8xy5':v_sub,      '8xy7':v_subn,    '8x06':v_shr,       '8xy6':v_shr,
+    '8x0E':v_shl,      '8xyE':v_shl,     'Byyy':v_jp_v0,     '1xxx':v_jp,
+    '6xyy':v_ld_byte,  '8xy0':v_ld_reg,  'Fx07':v_ld_get_dt, 'Fx0A':v_ld_k,
+    'Ayyy':v_ld_i,     'Fy15':v_ld_set_dt,'Fy18':v_ld_set_st,'Fy29':v_ld_f,
+    'Dxyz':v_drw }
+
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+# Vector quirks, matching instructions.QUIRK_HANDLERS. The loads and stores
+# through I have no vector form in either version.
+
+def v_shl_vy(b, lanes, op):
+    x, y, reg = op >> 8 & 0xF, op >> 4 & 0xF, b.register
+    reg[lanes, 0xF] = reg[lanes, y] >= 0x80
+    reg[lanes, x] = reg[lanes, y] << 1
+
+def v_shr_vy(b, lanes, op):
+    x, y, reg = op >> 8 & 0xF, op >> 4 & 0xF, b.register
+    reg[lanes, 0xF] = reg[lanes, y] & 1
+    reg[lanes, x] = reg[lanes, y] >> 1
+
+def v_jp_vx(b, lanes, op):
+    init_pc = b.program_counter[lanes]
+    target = (op & 0xFFF) + b.register[lanes, op >> 8 & 0xF] - 2
+    b.program_counter[lanes] = target
+    b.spinning[lanes[init_pc == target + 2]] = True
+
+def v_or_vf_reset(b, lanes, op):
+    v_or(b, lanes, op)
+    b.register[lanes, 0xF] = 0
+
+def v_and_vf_reset(b, lanes, op):
+    v_and(b, lanes, op)
+    b.register[lanes, 0xF] = 0
+
+def v_xor_vf_reset(b, lanes, op):
+    v_xor(b, lanes, op)
+    b.register[lanes, 0xF] = 0
+
+def v_drw_clip(b, lanes, op):
+    n = op & 0xF
+    index = b.index_register[lanes]
+    past_end = index + n > BYTES_OF_RAM
+    if past_end.any():
+        b.run_lanes(lanes[past_end], op[past_end])
+        lanes, op, n, index = lanes[~past_end], op[~past_end], n[~past_end], index[~past_end]
+
+    reg, ram = b.register, b.ram
+    vx = reg[lanes, op >> 8 & 0xF].astype(np.int32)
+    vy = reg[lanes, op >> 4 & 0xF].astype(np.int32)
+    b.draw_flag[lanes] = True
+    x_origin_byte = ( vx // 8 ) % GFX_WIDTH
+    y_origin = vy % GFX_HEIGHT_PX
+    shift_amount = vx % 8
+    has_second = x_origin_byte + 1 != GFX_WIDTH
+
+    reg[lanes, 0xF] = 0
+    for y in range(int(n.max(initial=0))):
+        rows = (n > y) & (y_origin + y < GFX_HEIGHT_PX)
+        l = lanes[rows]
+        sprite = ram[l, index[rows] + y].astype(np.int32) << (8 - shift_amount[rows])
+        first = GFX_ADDRESS + x_origin_byte[rows] + (y_origin[rows] + y) * GFX_WIDTH
+        for address, byte, on in ( (first, sprite >> 8, slice(None)),
+                                   (first + 1, sprite & 0xFF, has_second[rows]) ):
+            original = ram[l[on], address[on]]
+            ram[l[on], address[on]] = original ^ byte[on]
+            reg[l[on][original & byte[on] != 0], 0xF] = 1
+
+def v_add_i_overflow(b, lanes, op):
+    index = b.index_register[lanes] + b.register[lanes, op >> 8 & 0xF]
+    b.register[lanes[index > 0xFF], 0xF] = 1
+    b.index_register[lanes] = index & 0xFFF
+
+# Vector handlers replaced when a Quirks field is on
+VECTOR_QUIRKS = {
+    'shift_vy':       {'8x06':v_shr_vy, '8xy6':v_shr_vy, '8x0E':v_shl_vy, '8xyE':v_shl_vy},
+    'jump_vx':        {'Byyy':v_jp_vx},
+    'vf_reset':       {'8xy1':v_or_vf_reset, '8xy2':v_and_vf_reset, '8xy3':v_xor_vf_reset},
+    'clip_sprites':   {'Dxyz':v_drw_clip},
+    'index_overflow': {'Fy1E':v_add_i_overflow} }
+
+def vector_table(quirks):
+    '''
+    List of vector handlers indexed by Instruction.variant, None where the
+    instruction runs per instance. Picked for quirks, a Quirks.
+    '''
+    vectors = dict(VECTORS)
+    for field, on in zip(Quirks._fields, quirks):
+        if on:
+            vectors.update(VECTOR_QUIRKS.get(field, {}))
+    table = [None] * (len(VARIANT_IDS) + 1)
+    for hex_template, handler in vectors.items():
+        table[VARIANT_IDS[hex_template]] = handler
+    return table
+
+if np is not None:
+    DECODE_ENTRIES = np.frombuffer(bytes(decode_table()), np.uint8)
+    UNOFFICIAL_ENTRIES = np.array([ 0 < entry <= len(OP_VARIANTS) and
+        OP_VARIANTS[entry - 1][0] in UNOFFICIAL_OP_CODES for entry in range(256) ])
+
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+# Parity
+
+@export
+def parity_check(opcodes=None, legacy_shift=False, seed=0, quirks=None):
+    '''
+    Runs each opcode for one cycle on a Taquitos instance and on a Guacamole
+    from the same random state, by default every opcode. Returns the list
+    of opcodes whose results or error logs differ, an exception from either
+    engine counts as a difference. Quirks is as for Guacamole.
+    '''
+    opcodes = list(range(0x10000)) if opcodes is None else list(opcodes)
+    rng = Random(seed)
+    mismatches = []
+    for start in range(0, len(opcodes), 1024):
+        chunk = opcodes[start:start + 1024]
+        batch = Taquitos(None, len(chunk), legacy_shift=legacy_shift, quirks=quirks)
+        emus = []
+        for lane, op in enumerate(chunk):
+            emu = Guacamole(None, init_ram=True, legacy_shift=legacy_shift, rewind_budget=0, quirks=quirks)
+            emu.ram[PROGRAM_BEGIN_ADDRESS:] = bytes( rng.randrange(256) for _ in range(BYTES_OF_RAM - PROGRAM_BEGIN_ADDRESS) )
+            emu.ram[PROGRAM_BEGIN_ADDRESS], emu.ram[PROGRAM_BEGIN_ADDRESS + 1] = op >> 8, op & 0xFF
+            emu.register[:] = bytes( rng.randrange(256) for _ in range(NUMB_OF_REGS) )
+            emu.index_register = rng.randrange(0x1000)
+            emu.delay_timer_register = rng.randrange(256)
+            emu.stack_pointer = rng.randrange(STACK_SIZE + 1)
+            for i in range(STACK_SIZE):
+                emu.stack[i] = rng.randrange(0x200, 0x1000, 2)
+            emu.keypad = keys_to_mask( rng.random() < 0.5 for _ in range(16) )
+            emu.rng.seed(rng.random())
+            batch.import_lane(lane, emu)
+            emus.append(emu)
+
+        try:
+            batch.step()
+        except Exception:
+            mismatches.extend(chunk)
+            continue
+        check = Guacamole(None, init_ram=True, rewind_budget=0)
+        for lane, (op, emu) in enumerate(zip(chunk, emus)):
+            try:
+                emu.cpu_tick()
+            except Exception:
+                mismatches.append(op)
+                continue
+            batch.export_lane(lane, check)
+            if state_of(emu) != state_of(check) or \
+               list(emu.error_log) != list(batch.error_logs[lane]):
+                mismatches.append(op)
+    return mismatches
+
+def state_of(emu):
+    return (bytes(emu.ram), bytes(emu.register), emu.stack.tobytes(), emu.index_register,
+            emu.delay_timer_register, emu.sound_timer_register, emu.program_counter,
+            emu.stack_pointer, emu.draw_flag, emu.waiting_for_key, emu.spinning,
+            emu.rng.getstate())
@@ -0,0 +1,223 @@
+#!/usr/bin/env python3
+
+from . import export
+from mmap import mmap, ACCESS_READ
+from struct import Struct
+from collections import namedtuple
+from .salsa import decode_opcode
+__all__ = []
+
+# Trace file layout, all values big endian:
+#
+#   header | block | block | ...
+#
+# Blocks are BLOCK_SIZE bytes and form a ring, once every block is used the
+# oldest is overwritten. Each block starts with its sequence number (zero
+# while unused) and the cycle and next pc the first record is relative to,
+# then holds records until it is full:
+#
+#   cycles since last record (varint) | pc - (last pc + 2) (zigzag varint) |
+#   opcode (2) | [ changed register mask (varint) | new values ]
+#
+# The register part is only present in traces made with registers. The mask
+# has a bit per V register, bit 16 is I which takes two bytes. Cycle deltas
+# are never zero, so a zero byte ends a block that is not full.
+
+TRACE_MAGIC   = b'T8TR'
+TRACE_VERSION = 1
+
+HEADER = Struct('>4sBBII') # magic, version, flags, block size, block count
+BLOCK  = Struct('>IQH')    # sequence, cycle, pc
+WORD   = Struct('>H')      # opcodes and I
+
+FLAG_REGISTERS = 0x01
+
+DEFAULT_TRACE_SIZE = 16 * 1024 * 1024
+BLOCK_SIZE = 4096
+
+# Longest possible record, a new block is started when less is left
+MAX_RECORD = 10 + 3 + WORD.size + 3 + 16 + 2
+
+# Encoded varints for the values nearly every record uses
+SMALL_VARINTS = [ bytes((v,)) for v in range(0x80) ]
+
+@export
+class TraceRecord( namedtuple('TraceRecord', 'cycle pc opcode changes') ):
+    '''
+    One executed instruction. Cycle is the cycle count once it had run and
+    changes is a dictionary of the registers it set ('v0'-'vf', 'i'), or
+    None if the trace was made without registers.
+    '''
+    pass
+
+@export
+class TraceRecorder:
+    '''
+    Records executed instructions to a memory mapped ring file that never
+    grows past size bytes, see Guacamole.set_tracer(). Registers adds the
+    registers each instruction changed to its record. The file can be read
+    with read_trace() once the recorder is flushed or closed.
+    '''
+    def __init__(self, file_path, size=DEFAULT_TRACE_SIZE, registers=False):
+        self.blocks = max(1, (size - HEADER.size) // BLOCK_SIZE)
+        self.registers = registers
+        length = HEADER.size + self.blocks * BLOCK_SIZE
+        with open(file_path, 'w+b') as fh:
+            fh.truncate(length)
+            self.map = mmap(fh.fileno(), length)
+        self.map[:HEADER.size] = HEADER.pack(TRACE_MAGIC, TRACE_VERSION,
+            FLAG_REGISTERS if registers else 0, BLOCK_SIZE, self.blocks)
+        self.seq = 0
+        self.pos = self.end = 0
+        self.cycle = self.next_pc = 0
+        self.last_regs  = 0 # Registers as one int, v0 most significant
+        self.last_index = 0
+
+    def attach(self, emu):
+        '''
+        Takes the emulator's current state as the point the next record is
+        relative to, and starts a new block.
+        '''
+        self.cycle, self.next_pc = emu.cycles, emu.program_counter
+        self.last_regs  = int.from_bytes(emu.register, 'big')
+        self.last_index = emu.index_register
+        self.new_block()
+
+    def record(self, cycle, pc, opcode, register, index):
+        '''
+        Appends the record of one instruction.
+        '''
+        if self.pos + MAX_RECORD > self.end:
+            self.new_block()
+        delta, step = cycle - self.cycle, pc - self.next_pc
+        data = (SMALL_VARINTS[delta] if delta < 0x80 else varint(delta)) + \
+               (SMALL_VARINTS[step << 1] if 0 <= step < 0x40 else varint(zigzag(step))) + \
+               WORD.pack(opcode)
+        if self.registers:
+            data += self.register_delta(register, index)
+        self.map[self.pos:self.pos + len(data)] = data
+        self.pos += len(data)
+        self.cycle, self.next_pc = cycle, pc + 2
+
+    def register_delta(self, register, index):
+        mask, values = 0, bytearray()
+        regs = int.from_bytes(register, 'big')
+        diff = regs ^ self.last_regs
+        while diff:
+            byte = (diff.bit_length() - 1) >> 3
+            mask |= 1 << (15 - byte)
+            values.append(register[15 - byte])
+            diff &= ~(0xFF << (byte << 3))
+        self.last_regs = regs
+        if index != self.last_index:
+            mask |= 1 << 16
+            values += WORD.pack(index)
+            self.last_index = index
+        return varint(mask) + values
+
+    def new_block(self):
+        self.seq += 1
+        start = HEADER.size + (self.seq - 1) % self.blocks * BLOCK_SIZE
+        self.map[start:start + BLOCK_SIZE] = bytes(BLOCK_SIZE)
+        self.map[start:start + BLOCK.size] = BLOCK.pack(self.seq, self.cycle, self.next_pc)
+        self.pos, self.end = start + BLOCK.size, start + BLOCK_SIZE
+
+    def flush(self):
+        self.map.flush()
+
+    def close(self):
+        if not self.map.closed:
+            self.map.flush()
+            self.map.close()
+
+@export
+def read_trace(file_path):
+    '''
+    Generator of the TraceRecords in a file written by TraceRecorder, oldest
+    first. The file is memory mapped and decoded as records are asked for.
+    Raises RuntimeError if it is not a trace file.
+    '''
+    with open(file_path, 'rb') as fh:
+        with mmap(fh.fileno(), 0, access=ACCESS_READ) as mm:
+            if len(mm) < HEADER.size:
+                raise RuntimeError("Trace file is truncated")
+            magic, version, flags, block_size, blocks = HEADER.unpack_from(mm)
+            if magic != TRACE_MAGIC:
+                raise RuntimeError("Not a tortilla8 trace file")
+            if version != TRACE_VERSION:
+                raise RuntimeError("Trace file version " + str(version) + " is not supported")
+            if len(mm) < HEADER.size + blocks * block_size:
+                raise RuntimeError("Trace file is truncated")
+
+            starts = []
+            for b in range(blocks):
+                offset = HEADER.size + b * block_size
+                seq = BLOCK.unpack_from(mm, offset)[0]
+                if seq:
+                    starts.append( (seq, offset) )
+            for _, offset in sorted(starts):
+                yield from read_block(mm, offset, offset + block_size, flags & FLAG_REGISTERS)
+
+@export
+def render_trace(records):
+    '''
+    Generator of a line of text per TraceRecord, for records from
+    read_trace() or any other iterable.
+    '''
+    for rec in records:
+        line = str(rec.cycle).rjust(10) + "  " + hex(rec.pc)[2:].zfill(3) + "  " + \
+               hex(rec.opcode)[2:].zfill(4) + "  " + decode_opcode(rec.opcode).disassembled_line.rstrip()
+        if rec.changes:
+            line = line.ljust(48) + " ".join( n + "=" + hex(v) for n,v in rec.changes.items() )
+        yield line
+
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+# Helpers
+
+def varint(value):
+    out = bytearray()
+    while value > 0x7F:
+        out.append(value & 0x7F | 0x80)
+        value >>= 7
+    out.append(value)
+    return bytes(out)
+
+def zigzag(value):
+    return value << 1 if value >= 0 else (-value << 1) - 1
+
+def read_varint(mm, pos):
+    value = shift = 0
+    while True:
+        byte = mm[pos]
+        pos += 1
+        value |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            return value, pos
+        shift += 7
+
+def read_block(mm, pos, end, registers):
+    '''
+    Decodes the records of the block at pos.
+    '''
+    _, cycle, next_pc = BLOCK.unpack_from(mm, pos)
+    pos += BLOCK.size
+    while pos < end and mm[pos] != 0:
+        delta, pos = read_varint(mm, pos)
+        step, pos = read_varint(mm, pos)
+        cycle += delta
+        pc = next_pc + ( step >> 1 if not step & 1 else -((step + 1) >> 1) )
+        next_pc = pc + 2
+        opcode, = WORD.unpack_from(mm, pos)
+        pos += WORD.size
+        changes = None
+        if registers:
+            mask, pos = read_varint(mm, pos)
+            changes = {}
+            for r in range(16):
+                if mask >> r & 1:
+                    changes['v' + hex(r)[2:]] = mm[pos]
+                    pos += 1
+            if mask >> 16:
+                changes['i'], = WORD.unpack_from(mm, pos)
+                pos += WORD.size
+        yield TraceRecord(cycle, pc, opcode, changes)